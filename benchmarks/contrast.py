@@ -0,0 +1,60 @@
+"""Cost of re-windowing a 16-bit grayscale frame, as when dragging the contrast sliders
+
+usage: python benchmarks/contrast.py [--n 50] [--size 2048]
+Compares apply_window with gathering from a full 65536-entry lookup table, and times VideoFrame.set_window, which
+includes the repaint. Runs offscreen unless QT_QPA_PLATFORM is already set.
+"""
+import argparse
+import os
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy as np
+from PySide2 import QtWidgets
+
+from pose_annotator.contrast import Window, apply_window, get_lut
+from pose_annotator.gui.custom_widgets import VideoFrame
+
+
+def time_per_call(function, windows: list) -> float:
+    function(windows[0])
+    start = time.perf_counter()
+    for window in windows:
+        function(window)
+    return (time.perf_counter() - start) / len(windows)
+
+
+def benchmark(n: int, size: int):
+    # not bound: PySide keeps the application alive itself
+    QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    frame = np.random.default_rng(0).integers(0, 4096, (size, size), dtype=np.uint16)
+    # a new setting every call, so no lookup table comes from the cache
+    windows = [Window(i, 4095 - i, 1 + i / n) for i in range(n)]
+    out = np.empty(frame.shape, dtype=np.uint8)
+
+    full = time_per_call(lambda window: get_lut(window.low, window.high, window.gamma, 65536)[frame], windows)
+    ours = time_per_call(lambda window: apply_window(frame, window, out=out), windows)
+
+    view = VideoFrame()
+    view.resize(1280, 720)
+    view.show()
+    view.show_image(frame)
+    view.frame = frame
+
+    def redraw(window):
+        view.set_window(window)
+        view.viewport().repaint()
+    displayed = time_per_call(redraw, windows)
+    view.close()
+
+    print('{0}x{0} uint16: 65536-entry lut {1:.2f} ms, apply_window {2:.2f} ms, set_window + repaint {3:.2f} ms'.format(
+        size, full * 1000, ours * 1000, displayed * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='contrast windowing micro-benchmark')
+    parser.add_argument('--n', type=int, default=50, help='window settings to time')
+    parser.add_argument('--size', type=int, default=2048, help='frame height and width')
+    args = parser.parse_args()
+    benchmark(args.n, args.size)
@@ -0,0 +1,65 @@
+"""Round-trip benchmark for the wide <key>_x/_y/_p csv codec in pose_annotator.utils
+
+usage: python benchmarks/csv_codec.py [--frames 10000 100000 1000000] [--keypoints 20] [--fraction 1.0]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from pose_annotator import utils
+
+
+def make_array(n_frames: int, n_keypoints: int, fraction: float, rng) -> np.ndarray:
+    array = np.zeros((n_frames, n_keypoints, 3), dtype=np.float32)
+    labeled = rng.random(n_frames) < fraction
+    array[labeled, :, :2] = rng.random((labeled.sum(), n_keypoints, 2)) * 1000
+    array[labeled, :, 2] = rng.random((labeled.sum(), n_keypoints)) > 0.1
+    return array
+
+
+def benchmark(n_frames: int, n_keypoints: int, fraction: float, directory: str):
+    rng = np.random.default_rng(0)
+    keys = ['kp{}'.format(i) for i in range(n_keypoints)]
+    array = make_array(n_frames, n_keypoints, fraction, rng)
+    filename = os.path.join(directory, 'bench_{}_keypoints.csv'.format(n_frames))
+
+    timings = {}
+    start = time.perf_counter()
+    df = utils.array_to_df(array, keys)
+    timings['encode'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    df.to_csv(filename)
+    timings['to_csv'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    df = pd.read_csv(filename, index_col=0)
+    timings['read_csv'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    decoded = utils.df_to_array(df, keys, n_frames)
+    timings['decode'] = time.perf_counter() - start
+
+    assert np.array_equal(decoded[..., 2], array[..., 2])
+    p = array[..., 2] > 0
+    assert np.allclose(decoded[p][:, :2], array[p][:, :2], rtol=1e-5)
+    os.remove(filename)
+
+    print('{:>9d} frames, {} rows: '.format(n_frames, len(df)) +
+          ', '.join('{} {:.3f}s'.format(key, value) for key, value in timings.items()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='csv codec round-trip benchmark')
+    parser.add_argument('--frames', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--keypoints', type=int, default=20)
+    parser.add_argument('--fraction', type=float, default=1.0, help='fraction of frames with labels')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for n_frames in args.frames:
+            benchmark(n_frames, args.keypoints, args.fraction, directory)
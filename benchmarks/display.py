@@ -0,0 +1,60 @@
+"""Per-frame display cost: QPixmap conversion vs. painting from a reused QImage buffer (FrameItem)
+
+usage: python benchmarks/display.py [--n 100]
+Runs offscreen unless QT_QPA_PLATFORM is already set. Each timing includes a synchronous repaint of the view.
+"""
+import argparse
+import os
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy as np
+from PySide2 import QtWidgets
+
+from pose_annotator.gui.custom_widgets import VideoFrame, numpy_to_qpixmap
+
+RESOLUTIONS = {'1080p': (1080, 1920), '4K': (2160, 3840)}
+
+
+def time_per_frame(view: VideoFrame, show, frames: list) -> float:
+    # warm up once so allocation on the first frame isn't counted
+    show(frames[0])
+    view.viewport().repaint()
+    start = time.perf_counter()
+    for frame in frames:
+        show(frame)
+        view.viewport().repaint()
+    return (time.perf_counter() - start) / len(frames)
+
+
+def benchmark(n: int):
+    # not bound: PySide keeps the application alive itself
+    QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    rng = np.random.default_rng(0)
+    for name, (H, W) in RESOLUTIONS.items():
+        frames = [rng.integers(0, 255, (H, W, 3), dtype=np.uint8) for _ in range(4)]
+        frames = [frames[i % len(frames)] for i in range(n)]
+
+        view = VideoFrame()
+        view.resize(1280, 720)
+        view.show()
+        new = time_per_frame(view, view.show_image, frames)
+        view.close()
+
+        view = VideoFrame()
+        view.resize(1280, 720)
+        view.show()
+        pixmap_item = QtWidgets.QGraphicsPixmapItem()
+        view.scene.addItem(pixmap_item)
+        old = time_per_frame(view, lambda frame: pixmap_item.setPixmap(numpy_to_qpixmap(frame)), frames)
+        view.close()
+
+        print('{:>5}: qpixmap {:.2f} ms/frame, frame item {:.2f} ms/frame'.format(name, old * 1000, new * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='display path micro-benchmark')
+    parser.add_argument('--n', type=int, default=100, help='frames per resolution')
+    args = parser.parse_args()
+    benchmark(args.n)
@@ -0,0 +1,109 @@
+"""Cost of drawing keypoints on a frame change and while dragging one keypoint, and of finding the keypoint under a
+click, at 20, 200 and 2000 keypoints
+
+usage: python benchmarks/keypoints.py [--n 50]
+Compares one QGraphicsEllipseItem per keypoint, cleared and placed again on every frame as the annotator used to do,
+with KeypointGroup, which paints every keypoint from one item. Each drawing timing includes the repaint. Hit-testing
+compares checking every keypoint with the grid index KeypointGroup uses for large keypoint counts.
+Runs offscreen unless QT_QPA_PLATFORM is already set.
+"""
+import argparse
+import os
+import time
+from collections import OrderedDict
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy as np
+from PySide2 import QtGui, QtWidgets
+
+from pose_annotator.gui.custom_widgets import KeypointGroup, VideoFrame
+from pose_annotator.spatial import GridIndex, find_nearest
+
+SIZES = [20, 200, 2000]
+
+
+def time_per_update(view: VideoFrame, update, updates: list) -> float:
+    update(updates[0])
+    QtWidgets.QApplication.processEvents()
+    start = time.perf_counter()
+    for value in updates:
+        update(value)
+        # scene changes are painted once the event loop runs
+        QtWidgets.QApplication.processEvents()
+    return (time.perf_counter() - start) / len(updates)
+
+
+def make_ellipses(scene, colors: np.ndarray) -> list:
+    ellipses = []
+    for color in colors:
+        ellipse = QtWidgets.QGraphicsEllipseItem()
+        ellipse.setPen(QtGui.QPen(QtGui.QColor(*color), 2))
+        ellipse.setBrush(QtGui.QBrush(QtGui.QColor(color[0], color[1], color[2], int(color[3] * 0.3))))
+        scene.addItem(ellipse)
+        ellipses.append(ellipse)
+    return ellipses
+
+
+def set_ellipses(ellipses: list, coords: np.ndarray, radius: float):
+    for ellipse in ellipses:
+        ellipse.setVisible(False)
+    for ellipse, (x, y) in zip(ellipses, coords):
+        ellipse.setRect(x - radius, y - radius, 2 * radius, 2 * radius)
+        ellipse.setVisible(True)
+
+
+def time_hit_test(coords: np.ndarray, radii: np.ndarray, clicks: np.ndarray):
+    start = time.perf_counter()
+    for x, y in clicks:
+        find_nearest(coords, radii, x, y)
+    brute = (time.perf_counter() - start) / len(clicks)
+    grid = GridIndex(coords, radii.max())
+    start = time.perf_counter()
+    for x, y in clicks:
+        find_nearest(coords, radii, x, y, grid.query(x, y))
+    return brute, (time.perf_counter() - start) / len(clicks)
+
+
+def benchmark(n: int):
+    # not bound: PySide keeps the application alive itself
+    QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    rng = np.random.default_rng(0)
+    frame = np.zeros((1080, 1920, 3), dtype=np.uint8)
+    radius = 5
+    for size in SIZES:
+        keys = OrderedDict(('kp{}'.format(i), []) for i in range(size))
+        frames = [rng.uniform(0, (1920, 1080), (size, 2)).astype(np.float32) for _ in range(n)]
+        # one keypoint moving a few pixels at a time
+        drags = [np.concatenate([frames[0][:1] + i, frames[0][1:]]) for i in range(n)]
+
+        results = []
+        for kind in ['items', 'group']:
+            view = VideoFrame()
+            view.resize(1280, 720)
+            view.show()
+            view.show_image(frame)
+            view.fitInView()
+            if kind == 'items':
+                group = KeypointGroup(keys, view.scene, radius=radius)
+                group.remove_from_scene()
+                ellipses = make_ellipses(view.scene, group.colors)
+                update = lambda coords: set_ellipses(ellipses, coords, radius)
+            else:
+                group = KeypointGroup(keys, view.scene, radius=radius)
+                update = group.item.set_coords
+            results.append((time_per_update(view, update, frames), time_per_update(view, update, drags)))
+            view.close()
+        (items_frame, items_drag), (group_frame, group_drag) = results
+        brute, grid = time_hit_test(frames[0], np.full(size, radius, dtype=np.float32),
+                                    rng.uniform(0, (1920, 1080), (n, 2)))
+        print('{} keypoints: frame change {:.2f} -> {:.2f} ms, drag {:.2f} -> {:.2f} ms, '
+              'hit test {:.3f} -> {:.3f} ms'.format(size, items_frame * 1000, group_frame * 1000, items_drag * 1000,
+                                                    group_drag * 1000, brute * 1000, grid * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='keypoint drawing micro-benchmark')
+    parser.add_argument('--n', type=int, default=50, help='updates to time at each size')
+    args = parser.parse_args()
+    benchmark(args.n)
@@ -0,0 +1,5 @@
+import os
+
+# opencv refuses to decode images over 2**30 pixels unless this is set before cv2 is imported. images that big are
+# shown from a tile pyramid (see tiles.py)
+os.environ.setdefault('OPENCV_IO_MAX_IMAGE_PIXELS', str(2 ** 40))
@@ -4,8 +4,8 @@ import sys
 from omegaconf import OmegaConf
 from PySide2 import QtCore, QtWidgets, QtGui
 
-from pose_annotator.gui.main import run
+from pose_annotator.cli import main
 
 
 if __name__ == '__main__':
-    run()
+    main()
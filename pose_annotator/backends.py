@@ -0,0 +1,158 @@
+from collections import OrderedDict
+import json
+import os
+import time
+import warnings
+from typing import Union
+
+import h5py
+import numpy as np
+
+from pose_annotator.frame_source import (ArraySource, FrameSource, HDF5ArraySource, NpySource, OpenCVSource,
+                                         SingleImageSource, VidioSource, find_frame_dataset)
+from pose_annotator.image_sequence import ImageSequenceReader, image_endings
+
+video_endings = {'.avi', '.mov', '.mp4'}
+
+backends = OrderedDict([('opencv', OpenCVSource),
+                        ('vidio', VidioSource),
+                        ('images', ImageSequenceReader),
+                        ('image', SingleImageSource),
+                        ('array', ArraySource),
+                        ('npy', NpySource),
+                        ('hdf5', HDF5ArraySource)])
+
+
+def get_file_kind(path: Union[str, os.PathLike]) -> str:
+    # what the benchmark's choice is remembered by: a file extension, or 'directory'
+    if os.path.isdir(path):
+        return 'directory'
+    return os.path.splitext(path)[1].lower()
+
+
+def get_backends(path: Union[str, os.PathLike, np.ndarray]) -> list:
+    # names of the backends that can read path, default first
+    if isinstance(path, np.ndarray):
+        return ['array']
+    kind = get_file_kind(path)
+    if kind == 'directory':
+        # not vidio: it sorts file names lexicographically, so its frame numbers differ from those in saved csvs
+        return ['images']
+    elif kind in video_endings:
+        return ['opencv', 'vidio']
+    elif kind in image_endings:
+        return ['image']
+    elif kind == '.npy':
+        return ['npy']
+    elif kind in ['.h5', '.hdf5']:
+        # vidio's format, e.g. proxies, stores one jpg per frame. otherwise, look for an array of frames
+        with h5py.File(path, 'r') as f:
+            has_array = find_frame_dataset(f) is not None
+        return ['hdf5'] if has_array else ['vidio']
+    raise ValueError('no backend can read {}'.format(path))
+
+
+def get_preferences_filename() -> str:
+    return os.path.join(os.path.expanduser('~'), '.pose_annotator', 'backends.json')
+
+
+def load_preferences() -> dict:
+    filename = get_preferences_filename()
+    if not os.path.isfile(filename):
+        return {}
+    try:
+        with open(filename, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        warnings.warn('could not read backend preferences {}: {}'.format(filename, e))
+        return {}
+
+
+def save_preference(path: Union[str, os.PathLike], backend: str):
+    preferences = load_preferences()
+    preferences[get_file_kind(path)] = backend
+    filename = get_preferences_filename()
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'w') as f:
+        json.dump(preferences, f, indent=2)
+
+
+def choose_backend(path: Union[str, os.PathLike, np.ndarray], backend: str = None) -> str:
+    """Which backend to read path with
+
+    An explicit backend is used if it can read path. Otherwise, the fastest backend that benchmark-backends found for
+    files of this kind, or the default.
+    """
+    candidates = get_backends(path)
+    if backend is not None:
+        if backend in candidates:
+            return backend
+        warnings.warn('backend {} cannot read {}, using one of {}'.format(backend, path, candidates))
+    if not isinstance(path, np.ndarray):
+        preferred = load_preferences().get(get_file_kind(path))
+        if preferred in candidates:
+            return preferred
+    return candidates[0]
+
+
+def open_frame_source(path: Union[str, os.PathLike, np.ndarray], backend: str = None, seek_index=None) -> FrameSource:
+    backend = choose_backend(path, backend)
+    if backend == 'opencv':
+        return OpenCVSource(path, seek_index)
+    elif backend == 'images':
+        # readahead is off because the GUI's FrameCache already prefetches
+        return ImageSequenceReader(path, readahead=0)
+    return backends[backend](path)
+
+
+def benchmark_backend(path: Union[str, os.PathLike], backend: str, n_sequential: int = 200, n_random: int = 50,
+                      seed: int = 0) -> dict:
+    # times to open, to read the first n_sequential frames in order, and to read n_random frames at random
+    start = time.perf_counter()
+    source = open_frame_source(path, backend)
+    open_ms = (time.perf_counter() - start) * 1000
+    try:
+        n_sequential = min(n_sequential, source.nframes)
+        start = time.perf_counter()
+        for framenum in range(n_sequential):
+            source.read(framenum)
+        sequential_fps = n_sequential / (time.perf_counter() - start)
+
+        latencies = []
+        for framenum in np.random.default_rng(seed).integers(0, source.nframes, n_random):
+            start = time.perf_counter()
+            source.read(framenum)
+            latencies.append(time.perf_counter() - start)
+        seek_ms = float(np.median(latencies)) * 1000
+    finally:
+        source.close()
+    # annotating is roughly as much stepping through frames as jumping between them
+    return {'open_ms': open_ms,
+            'sequential_fps': sequential_fps,
+            'seek_ms': seek_ms,
+            'cost_ms': (1000 / sequential_fps + seek_ms) / 2}
+
+
+def benchmark_backends(path: Union[str, os.PathLike], names: list = None, **kwargs) -> OrderedDict:
+    # results for each backend that can read path, fastest first. backends that fail are left out with a warning
+    candidates = get_backends(path)
+    if names is None:
+        names = candidates
+    for name in names:
+        if name not in candidates:
+            warnings.warn('backend {} cannot read {}, skipping'.format(name, path))
+    names = [name for name in names if name in candidates]
+    if len(names) == 0:
+        return OrderedDict()
+    # untimed pass, so that whichever backend goes first isn't penalized for reading from a cold disk cache
+    try:
+        benchmark_backend(path, names[0], **kwargs)
+    except Exception:
+        pass
+    results = OrderedDict()
+    for name in names:
+        try:
+            results[name] = benchmark_backend(path, name, **kwargs)
+        except Exception as e:
+            warnings.warn('backend {} failed on {}: {}'.format(name, path, e))
+    return OrderedDict(sorted(results.items(), key=lambda item: item[1]['cost_ms']))
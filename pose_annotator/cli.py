@@ -0,0 +1,127 @@
+import argparse
+import sys
+
+
+def proxy_command(args):
+    from pose_annotator.proxy import make_proxy
+
+    def progress(n_done, n_total):
+        print('\r{}/{} frames'.format(n_done, n_total), end='', flush=True)
+
+    proxyfile = make_proxy(args.video, scale=args.scale, quality=args.quality, workers=args.workers,
+                           progress=progress)
+    print('\nwrote proxy to {}'.format(proxyfile))
+
+
+def benchmark_backends_command(args):
+    from pose_annotator.backends import benchmark_backends, save_preference
+
+    results = benchmark_backends(args.path, args.backends, n_sequential=args.frames, n_random=args.seeks)
+    if len(results) == 0:
+        sys.exit('no backend could read {}'.format(args.path))
+    print('{:<8} {:>10} {:>16} {:>10}'.format('backend', 'open (ms)', 'sequential (fps)', 'seek (ms)'))
+    for name, result in results.items():
+        print('{:<8} {:>10.1f} {:>16.1f} {:>10.2f}'.format(name, result['open_ms'], result['sequential_fps'],
+                                                          result['seek_ms']))
+    fastest = next(iter(results))
+    print('fastest: {}'.format(fastest))
+    if not args.no_save:
+        save_preference(args.path, fastest)
+        print('will use {} for files like {} from now on'.format(fastest, args.path))
+
+
+def select_frames_command(args):
+    from pose_annotator.frame_selection import get_frame_list_filename, select_frames, write_frame_list
+
+    def progress(n_done, n_total):
+        print('\r{}/{} frames'.format(n_done, n_total), end='', flush=True)
+
+    framenums = select_frames(args.video, args.n, stride=args.stride, max_samples=args.max_samples, size=args.size,
+                              n_components=args.pca, workers=args.workers, seed=args.seed, progress=progress)
+    output = args.output if args.output is not None else get_frame_list_filename(args.video)
+    write_frame_list(output, framenums)
+    print('\nwrote {} frames to {}'.format(len(framenums), output))
+
+
+def export_command(args):
+    from pose_annotator.export import export
+
+    def progress(videofile, n_images):
+        print('{}: {} labeled frames'.format(videofile, n_images))
+
+    written = export(args.videos, args.output, format=args.format, labels_dir=args.labels_dir,
+                     n_instances=args.instances, scorer=args.scorer, workers=args.workers, progress=progress)
+    for filename in written:
+        print('wrote {}'.format(filename))
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='pose_annotator',
+                                     description='Keypoint annotation GUI. Run without a subcommand to open the GUI, '
+                                                 'e.g. pose_annotator user_cfg=path/to/config.yaml')
+    subparsers = parser.add_subparsers(dest='command')
+
+    proxy = subparsers.add_parser('proxy', help='transcode a video into an intra-frame proxy for fast seeking')
+    proxy.add_argument('video', help='video file to make a proxy of')
+    proxy.add_argument('--scale', type=float, default=0.5, help='proxy resolution relative to the video')
+    proxy.add_argument('--quality', type=int, default=90, help='jpeg quality, 0-100')
+    proxy.add_argument('--workers', type=int, default=None, help='encoder processes. default: number of cpus')
+    proxy.set_defaults(func=proxy_command)
+
+    benchmark = subparsers.add_parser('benchmark-backends',
+                                      help='time each way of reading frames from a file, and use the fastest for '
+                                           'files of that kind')
+    benchmark.add_argument('path', help='video file or image directory')
+    benchmark.add_argument('--backends', nargs='+', default=None, help='backends to compare. default: all that apply')
+    benchmark.add_argument('--frames', type=int, default=200, help='frames to read sequentially')
+    benchmark.add_argument('--seeks', type=int, default=50, help='frames to read at random')
+    benchmark.add_argument('--no-save', action='store_true', help="don't remember the fastest backend")
+    benchmark.set_defaults(func=benchmark_backends_command)
+
+    select = subparsers.add_parser('select-frames',
+                                   help='pick visually diverse frames to label, by k-means on downscaled frames')
+    select.add_argument('video', help='video file, image directory or array file')
+    select.add_argument('-n', type=int, default=50, help='frames to pick')
+    select.add_argument('--stride', type=int, default=1, help='consider every stride-th frame')
+    select.add_argument('--max-samples', type=int, default=10000,
+                        help='consider at most this many frames, raising the stride for long videos')
+    select.add_argument('--size', type=int, default=32, help='frames are compared as size x size grayscale')
+    select.add_argument('--pca', type=int, default=32, help='principal components to keep. 0: no PCA')
+    select.add_argument('--workers', type=int, default=None, help='decoding processes. default: number of cpus')
+    select.add_argument('--seed', type=int, default=0)
+    select.add_argument('--output', default=None,
+                        help='frame list to write, one frame number per line. default: '
+                             '<video>_frames_to_label.txt, which the GUI opens with the video')
+    select.set_defaults(func=select_frames_command)
+
+    export = subparsers.add_parser('export', help='extract labeled frames and write a training set in COCO keypoints '
+                                                  'or DeepLabCut layout')
+    export.add_argument('videos', nargs='+', help='videos (or image directories, array files) that were labeled')
+    export.add_argument('--output', required=True, help='directory to write images and annotations to')
+    export.add_argument('--format', choices=['coco', 'dlc'], default='coco',
+                        help='coco: images/ and annotations.json. dlc: labeled-data/ and CollectedData_<scorer>.csv '
+                             'and .h5')
+    export.add_argument('--labels-dir', default=None,
+                        help='where the _keypoints.csv files are, if save_loc was set. default: next to each video')
+    export.add_argument('--instances', type=int, default=None,
+                        help='instances per frame, as set in the config when labeling. default: 1')
+    export.add_argument('--scorer', default='pose_annotator', help='scorer name for the dlc layout')
+    export.add_argument('--workers', type=int, default=None,
+                        help='videos to extract in parallel. default: number of cpus')
+    export.set_defaults(func=export_command)
+    return parser, subparsers
+
+
+def main():
+    parser, subparsers = get_parser()
+    if len(sys.argv) > 1 and (sys.argv[1] in subparsers.choices or sys.argv[1] in ['-h', '--help']):
+        args = parser.parse_args()
+        args.func(args)
+    else:
+        # the GUI takes omegaconf-style key=value overrides, which argparse doesn't understand
+        from pose_annotator.gui.main import run
+        run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import warnings
+from typing import Callable, Iterable, Union
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from pose_annotator import utils
+from pose_annotator.backends import open_frame_source
+from pose_annotator.frame_source import OpenCVSource
+from pose_annotator.image_sequence import align_to_image_names, legacy_sort
+from pose_annotator.seek_index import SeekIndex
+
+formats = ['coco', 'dlc']
+
+
+def get_keypoints_filename(videofile: Union[str, os.PathLike], labels_dir: Union[str, os.PathLike] = None) -> str:
+    # where the GUI saves keypoints for videofile: next to it, or in save_loc
+    videofile = str(videofile).rstrip(os.sep)
+    directory = labels_dir if labels_dir is not None else os.path.dirname(videofile)
+    return os.path.join(directory, os.path.splitext(os.path.basename(videofile))[0] + '_keypoints.csv')
+
+
+def get_image_dir_names(videofiles: list) -> dict:
+    # a directory name for each video's images: its file name, prefixed by its parent directory's if other videos
+    # have the same file name (day1/cam0.mp4, day2/cam0.mp4: day1_cam0, day2_cam0), and numbered if that isn't enough
+    stems = {videofile: os.path.splitext(os.path.basename(videofile))[0] for videofile in videofiles}
+    counts = Counter(stems.values())
+    names, used = {}, set()
+    for videofile, stem in stems.items():
+        name = stem
+        if counts[stem] > 1:
+            parent = os.path.basename(os.path.dirname(os.path.abspath(videofile)))
+            name = '{}_{}'.format(parent, stem) if parent else stem
+        unique, i = name, 1
+        while unique in used:
+            unique = '{}_{}'.format(name, i)
+            i += 1
+        used.add(unique)
+        names[videofile] = unique
+    return names
+
+
+def read_keypoints(csvfile: Union[str, os.PathLike], n_frames: int, n_instances: int = None,
+                   image_names: list = None, legacy_names: list = None) -> tuple:
+    # keys, and frame numbers and (n_labeled, n_instances, n_keypoints, 3) x, y, p of the labeled frames, in order.
+    # image_names: the images of a directory, which rows are matched to as when the GUI loads them (see
+    # align_to_image_names)
+    df = pd.read_csv(csvfile, index_col=0)
+    if image_names is not None:
+        df = align_to_image_names(df, image_names, legacy_names)
+    keys, n_instances = utils.get_keys_from_columns([column for column in df.columns if column != 'image_name'],
+                                                    n_instances)
+    framenums, rows = utils.df_to_rows(df, keys, n_frames, n_instances)
+    # a frame in the csv twice: the last row wins, as when the GUI loads it
+    _, last = np.unique(framenums[::-1], return_index=True)
+    framenums, rows = framenums[::-1][last], rows[::-1][last]
+    labeled = rows[..., 2].any(axis=(1, 2))
+    return keys, framenums[labeled], rows[labeled]
+
+
+def iter_frames(videofile: str, framenums: np.ndarray):
+    """(framenum, frame) for sorted framenums, in one forward pass through the video
+
+    Videos are read with a keyframe index (loaded from the seek index sidecar, or built, which only reads packets),
+    so gaps between labeled frames are skipped by seeking forward to the keyframe before the next one, or by
+    decoding forward if it is in the same group of pictures. Without an index, seeking can land on the wrong frame,
+    so every frame up to the last labeled one is decoded. Image directories and arrays read any frame exactly.
+    """
+    seek_index = SeekIndex(videofile)
+    if os.path.isfile(videofile) and not seek_index.load():
+        seek_index.build()
+    with open_frame_source(videofile, seek_index=seek_index if seek_index.keyframes is not None else None) as reader:
+        if isinstance(reader, OpenCVSource) and seek_index.keyframes is None:
+            wanted = set(int(framenum) for framenum in framenums)
+            for framenum in range(int(framenums[-1]) + 1):
+                frame = reader[framenum]
+                if framenum in wanted:
+                    yield framenum, frame
+        else:
+            for framenum in framenums:
+                yield int(framenum), reader[framenum]
+
+
+def write_image(filename: str, frame: np.ndarray):
+    if frame.ndim == 3 and frame.shape[2] == 3:
+        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+    elif frame.ndim == 3 and frame.shape[2] == 4:
+        frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGRA)
+    if not cv2.imwrite(filename, frame):
+        raise ValueError('could not write {}'.format(filename))
+
+
+def extract_video(videofile: str, csvfile: str, image_dir: str, n_instances: int = None) -> dict:
+    """Writes the labeled frames of one video as images into image_dir. Runs in a worker process
+
+    Returns the keys and, for each image written, its file name, frame number, size and keypoints.
+    """
+    with open_frame_source(videofile) as reader:
+        n_frames = len(reader)
+        image_names = reader.names if os.path.isdir(videofile) else None
+    legacy_names = legacy_sort(videofile) if image_names is not None else None
+    keys, framenums, rows = read_keypoints(csvfile, n_frames, n_instances, image_names, legacy_names)
+    os.makedirs(image_dir, exist_ok=True)
+    images = []
+    if len(framenums) == 0:
+        return {'keys': keys, 'images': images}
+    for (framenum, frame), keypoints in zip(iter_frames(videofile, framenums), rows):
+        # 8 and 16-bit frames as png, anything else (e.g. float) as tiff, which keeps the values
+        extension = '.png' if frame.dtype in (np.uint8, np.uint16) else '.tiff'
+        filename = os.path.join(image_dir, 'img{:06d}{}'.format(framenum, extension))
+        write_image(filename, frame)
+        images.append({'file_name': filename, 'framenum': framenum, 'height': int(frame.shape[0]),
+                       'width': int(frame.shape[1]), 'keypoints': keypoints})
+    return {'keys': keys, 'images': images}
+
+
+def make_coco(results: dict, output_dir: str, category: str = 'animal') -> dict:
+    # COCO keypoints: one annotation per labeled instance. v is 2 (labeled, visible) where _p > 0, else 0
+    keys = None
+    images, annotations = [], []
+    for videofile, result in results.items():
+        keys = result['keys'] if keys is None else keys
+        for image in result['images']:
+            image_id = len(images) + 1
+            images.append({'id': image_id, 'file_name': os.path.relpath(image['file_name'], output_dir),
+                           'width': image['width'], 'height': image['height'], 'video': videofile,
+                           'frame': image['framenum']})
+            for instance in image['keypoints']:
+                visible = instance[:, 2] > 0
+                if not visible.any():
+                    continue
+                xyv = np.where(visible[:, None], instance, 0)
+                xyv[:, 2] = np.where(visible, 2, 0)
+                x0, y0 = instance[visible, :2].min(axis=0)
+                x1, y1 = instance[visible, :2].max(axis=0)
+                annotations.append({'id': len(annotations) + 1, 'image_id': image_id, 'category_id': 1,
+                                    'keypoints': xyv.astype(np.float64).ravel().round(3).tolist(),
+                                    'num_keypoints': int(visible.sum()),
+                                    'bbox': [float(x0), float(y0), float(x1 - x0), float(y1 - y0)],
+                                    'area': float((x1 - x0) * (y1 - y0)), 'iscrowd': 0})
+    return {'images': images, 'annotations': annotations,
+            'categories': [{'id': 1, 'name': category, 'keypoints': keys, 'skeleton': []}]}
+
+
+def make_dlc(results: dict, output_dir: str, scorer: str) -> pd.DataFrame:
+    # DeepLabCut's CollectedData layout: rows are image paths relative to the project, columns are (scorer,
+    # bodyparts, coords), or (scorer, individuals, bodyparts, coords) with more than one instance. unlabeled is NaN
+    keys, n_instances = None, 1
+    index, values = [], []
+    for result in results.values():
+        keys = result['keys'] if keys is None else keys
+        for image in result['images']:
+            keypoints = image['keypoints']
+            n_instances = len(keypoints)
+            index.append(os.path.relpath(image['file_name'], output_dir).replace(os.sep, '/'))
+            values.append(np.where(keypoints[..., 2:] > 0, keypoints[..., :2], np.nan).ravel())
+    if n_instances == 1:
+        columns = pd.MultiIndex.from_product([[scorer], keys, ['x', 'y']], names=['scorer', 'bodyparts', 'coords'])
+    else:
+        columns = pd.MultiIndex.from_product([[scorer], ['individual{}'.format(i) for i in range(n_instances)], keys,
+                                              ['x', 'y']], names=['scorer', 'individuals', 'bodyparts', 'coords'])
+    values = np.stack(values) if len(values) > 0 else np.zeros((0, len(columns)))
+    return pd.DataFrame(values, index=index, columns=columns)
+
+
+def export(videofiles: Iterable[Union[str, os.PathLike]], output_dir: Union[str, os.PathLike], format: str = 'coco',
+           labels_dir: Union[str, os.PathLike] = None, n_instances: int = None, scorer: str = 'pose_annotator',
+           workers: int = None, progress: Callable = None) -> list:
+    """Extracts the labeled frames of each video and writes a training set in COCO keypoints or DeepLabCut layout
+
+    Keypoints are read from each video's _keypoints.csv (next to the video, or in labels_dir), as n_instances instances
+    (default 1). Each video is read in one forward pass over its sorted labeled frames (see iter_frames), in its own
+    process, into its own image directory (see get_image_dir_names). Returns the files written besides the images.
+    """
+    if format not in formats:
+        raise ValueError('format must be one of {}, not {}'.format(formats, format))
+    videofiles = [str(videofile).rstrip(os.sep) for videofile in videofiles]
+    output_dir = str(output_dir)
+    jobs = {}
+    for videofile in videofiles:
+        csvfile = get_keypoints_filename(videofile, labels_dir)
+        if not os.path.isfile(csvfile):
+            warnings.warn('no keypoints for {} at {}, skipping'.format(videofile, csvfile))
+            continue
+        jobs[videofile] = csvfile
+    names = get_image_dir_names(list(jobs))
+    image_dirs = {videofile: os.path.join(output_dir, 'labeled-data' if format == 'dlc' else 'images', name)
+                  for videofile, name in names.items()}
+
+    results = {}
+    with ProcessPoolExecutor(workers) as executor:
+        futures = {videofile: executor.submit(extract_video, videofile, csvfile, image_dirs[videofile], n_instances)
+                   for videofile, csvfile in jobs.items()}
+        for videofile, future in futures.items():
+            results[videofile] = future.result()
+            if progress is not None:
+                progress(videofile, len(results[videofile]['images']))
+    keys = {tuple(result['keys']) for result in results.values()}
+    if len(keys) > 1:
+        raise ValueError('videos were labeled with different keypoints: {}'.format(sorted(keys)))
+
+    written = []
+    if format == 'coco':
+        filename = os.path.join(output_dir, 'annotations.json')
+        with open(filename, 'w') as f:
+            json.dump(make_coco(results, output_dir), f)
+        written.append(filename)
+    else:
+        df = make_dlc(results, output_dir, scorer)
+        filename = os.path.join(output_dir, 'CollectedData_{}.csv'.format(scorer))
+        df.to_csv(filename)
+        written.append(filename)
+        try:
+            df.to_hdf(filename[:-4] + '.h5', key='df_with_missing', mode='w')
+            written.append(filename[:-4] + '.h5')
+        except ImportError:
+            # pandas needs pytables for hdf5. DeepLabCut can convert the csv itself
+            warnings.warn('pytables is not installed, so only the csv was written')
+    return written
@@ -0,0 +1,168 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from typing import Callable
+
+import numpy as np
+
+
+class FrameCache:
+    """LRU cache of decoded frames with a memory budget, in front of a VideoReader
+
+    After every request, background workers decode the next `prefetch` frames in the direction of travel. Each worker
+    is one thread with its own reader from `open_reader`, because readers keep a file position and are not
+    thread-safe. A block of frames goes to the worker whose reader stopped just before it, so that stepping through
+    the video keeps each reader reading sequentially instead of seeking. Misses are decoded synchronously with
+    `reader`.
+    """
+    def __init__(self, reader, open_reader: Callable, max_mb: float = 512, prefetch: int = 16, workers: int = 2):
+        self.reader = reader
+        self.open_reader = open_reader
+        self.max_bytes = max_mb * 1e6
+        self.prefetch = prefetch
+
+        self.frames = OrderedDict()
+        self.nbytes = 0
+        # frames queued or being decoded by the prefetcher
+        self.pending = set()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.evictions = 0
+
+        self.last_framenum = None
+        self.direction = 1
+        self.closed = False
+        # one single-thread executor per worker, each with its reader (opened on first use) and the frame after the
+        # last block it was given, where its reader will be
+        self.executors = []
+        if prefetch > 0 and workers > 0:
+            self.executors = [ThreadPoolExecutor(1, thread_name_prefix='FramePrefetch') for _ in range(workers)]
+        self.worker_readers = [None] * len(self.executors)
+        self.worker_ends = [None] * len(self.executors)
+        self.next_worker = 0
+
+    @property
+    def nframes(self) -> int:
+        return len(self.reader)
+
+    def __len__(self):
+        return self.nframes
+
+    def __getitem__(self, framenum: int) -> np.ndarray:
+        return self.get(framenum)
+
+    def __contains__(self, framenum: int) -> bool:
+        return framenum in self.frames
+
+    def get(self, framenum: int) -> np.ndarray:
+        with self.lock:
+            frame = self.frames.get(framenum)
+            if frame is not None:
+                self.frames.move_to_end(framenum)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if frame is None:
+            frame = self.reader[framenum]
+            self.put(framenum, frame)
+        self.schedule_prefetch(framenum)
+        return frame
+
+    def put(self, framenum: int, frame: np.ndarray):
+        with self.lock:
+            if framenum in self.frames:
+                return
+            self.frames[framenum] = frame
+            self.nbytes += frame.nbytes
+            while self.nbytes > self.max_bytes and len(self.frames) > 1:
+                _, evicted = self.frames.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+
+    def schedule_prefetch(self, framenum: int):
+        if len(self.executors) == 0 or self.closed:
+            return
+        if self.last_framenum is not None and framenum != self.last_framenum:
+            self.direction = 1 if framenum > self.last_framenum else -1
+        self.last_framenum = framenum
+
+        if self.direction > 0:
+            candidates = range(framenum + 1, min(framenum + 1 + self.prefetch, self.nframes))
+        else:
+            # still decoded in ascending order, so the worker's reader can read sequentially
+            candidates = range(max(framenum - self.prefetch, 0), framenum)
+        with self.lock:
+            todo = [i for i in candidates if i not in self.frames and i not in self.pending]
+            self.pending.update(todo)
+        if len(todo) > 0:
+            worker = self.choose_worker(todo[0])
+            self.worker_ends[worker] = todo[-1] + 1
+            self.executors[worker].submit(self.decode_block, worker, todo)
+
+    def choose_worker(self, framenum: int) -> int:
+        # the worker whose reader will be at framenum, e.g. when stepping forward one frame at a time each new block
+        # is the one frame after the last. otherwise, the workers take turns
+        if framenum in self.worker_ends:
+            return self.worker_ends.index(framenum)
+        worker = self.next_worker
+        self.next_worker = (self.next_worker + 1) % len(self.executors)
+        return worker
+
+    def get_worker_reader(self, worker: int):
+        # only ever called on the worker's own thread
+        if self.worker_readers[worker] is None:
+            self.worker_readers[worker] = self.open_reader()
+        return self.worker_readers[worker]
+
+    def is_stale(self, framenum: int) -> bool:
+        # the user has moved on; don't spend decode time on frames far from where they are now
+        return self.closed or abs(framenum - self.last_framenum) > 2 * self.prefetch
+
+    def decode_block(self, worker: int, framenums: list):
+        try:
+            reader = self.get_worker_reader(worker)
+            for framenum in framenums:
+                if self.is_stale(framenum):
+                    break
+                if framenum not in self.frames:
+                    self.put(framenum, reader[framenum])
+                    self.prefetched += 1
+                with self.lock:
+                    self.pending.discard(framenum)
+        finally:
+            with self.lock:
+                self.pending.difference_update(framenums)
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests > 0 else 0.0,
+                'prefetched': self.prefetched,
+                'evictions': self.evictions,
+                'frames': len(self.frames),
+                'mb': self.nbytes / 1e6}
+
+    def __str__(self):
+        return 'frame cache: ' + ', '.join('{}={:.3g}'.format(key, value) if isinstance(value, float) else
+                                           '{}={}'.format(key, value) for key, value in self.stats().items())
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            self.nbytes = 0
+
+    def close(self):
+        self.closed = True
+        for executor in self.executors:
+            executor.shutdown(wait=True)
+        self.executors = []
+        for reader in self.worker_readers:
+            if reader is not None:
+                reader.close()
+        self.worker_readers = []
+        self.worker_ends = []
+        self.clear()
@@ -0,0 +1,159 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+from typing import Callable, Iterable, Union
+
+import cv2
+import numpy as np
+
+from pose_annotator.backends import open_frame_source
+from pose_annotator.seek_index import SeekIndex
+
+
+def get_frame_list_filename(videofile: Union[str, os.PathLike]) -> str:
+    return os.path.splitext(str(videofile))[0] + '_frames_to_label.txt'
+
+
+def write_frame_list(filename: Union[str, os.PathLike], framenums: np.ndarray):
+    np.savetxt(filename, np.sort(framenums), fmt='%d')
+
+
+def read_frame_list(filename: Union[str, os.PathLike]) -> np.ndarray:
+    return np.sort(np.loadtxt(filename, dtype=np.int64, ndmin=1))
+
+
+def embed_frame(frame: np.ndarray, size: int) -> np.ndarray:
+    # downscaled grayscale, normalized per frame so that brightness changes alone don't make frames look different
+    frame = np.asarray(frame, dtype=np.float32)
+    if frame.ndim == 3:
+        frame = frame.mean(axis=2)
+    small = cv2.resize(frame, (size, size), interpolation=cv2.INTER_AREA).ravel()
+    small -= small.mean()
+    return small / (np.linalg.norm(small) + 1e-6)
+
+
+def embed_chunk(videofile: str, framenums: list, size: int) -> np.ndarray:
+    # runs in a worker process, which opens its own reader
+    seek_index = SeekIndex(videofile)
+    with open_frame_source(videofile, seek_index=seek_index if seek_index.load() else None) as reader:
+        return np.stack([embed_frame(reader[framenum], size) for framenum in framenums])
+
+
+def embed_video(videofile: Union[str, os.PathLike], framenums: np.ndarray, size: int = 32, workers: int = None,
+                chunk_size: int = 64, progress: Callable = None) -> np.ndarray:
+    # (len(framenums), size * size) embeddings, decoded in parallel processes. framenums should be sorted, so each
+    # worker reads forward through its chunk
+    videofile = str(videofile)
+    if workers is None:
+        workers = os.cpu_count()
+    embeddings = np.zeros((len(framenums), size * size), dtype=np.float32)
+    starts = iter(range(0, len(framenums), chunk_size))
+    # spawned, not forked, as in make_proxy: the GUI calls this with other threads running
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        # a bounded number of chunks in flight
+        futures = deque()
+        n_done = 0
+        while True:
+            while len(futures) < 2 * workers:
+                start = next(starts, None)
+                if start is None:
+                    break
+                chunk = [int(i) for i in framenums[start:start + chunk_size]]
+                futures.append((start, executor.submit(embed_chunk, videofile, chunk, size)))
+            if len(futures) == 0:
+                break
+            start, future = futures.popleft()
+            chunk = future.result()
+            embeddings[start:start + len(chunk)] = chunk
+            n_done += len(chunk)
+            if progress is not None:
+                progress(n_done, len(framenums))
+    return embeddings
+
+
+def pca(x: np.ndarray, n_components: int, max_rows: int = 5000, seed: int = 0) -> np.ndarray:
+    # projection onto the top principal components, fit on at most max_rows rows
+    rng = np.random.default_rng(seed)
+    mean = x.mean(axis=0)
+    rows = x[rng.choice(len(x), min(max_rows, len(x)), replace=False)] - mean
+    _, _, vt = np.linalg.svd(rows, full_matrices=False)
+    return (x - mean) @ vt[:n_components].T
+
+
+def get_sq_distances(x: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    # (len(x), len(centers))
+    distances = (x ** 2).sum(axis=1)[:, None] - 2 * x @ centers.T + (centers ** 2).sum(axis=1)[None]
+    return np.maximum(distances, 0)
+
+
+def kmeans_plusplus(x: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+    centers = [x[rng.integers(len(x))]]
+    closest = get_sq_distances(x, centers[0][None])[:, 0]
+    for _ in range(1, k):
+        total = closest.sum()
+        index = rng.choice(len(x), p=closest / total) if total > 0 else rng.integers(len(x))
+        centers.append(x[index])
+        closest = np.minimum(closest, get_sq_distances(x, x[index][None])[:, 0])
+    return np.stack(centers)
+
+
+def minibatch_kmeans(x: np.ndarray, k: int, batch_size: int = 1024, n_iter: int = 100, seed: int = 0) -> np.ndarray:
+    """Cluster centers of x by mini-batch k-means (Sculley 2010), seeded with k-means++
+
+    Each iteration assigns a random batch to its nearest centers and moves each center towards the mean of its batch
+    points, with a learning rate of 1 / (points assigned to it so far), so cost per iteration doesn't grow with x.
+    """
+    rng = np.random.default_rng(seed)
+    centers = kmeans_plusplus(x, k, rng)
+    counts = np.zeros(k)
+    for _ in range(n_iter):
+        batch = x[rng.choice(len(x), min(batch_size, len(x)), replace=False)]
+        labels = get_sq_distances(batch, centers).argmin(axis=1)
+        batch_counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, batch)
+        counts += batch_counts
+        moved = batch_counts > 0
+        centers[moved] += (sums[moved] - batch_counts[moved, None] * centers[moved]) / counts[moved, None]
+    return centers
+
+
+def pick_nearest(x: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    # index of the point nearest each center, a different point for every center
+    distances = get_sq_distances(x, centers)
+    picked = []
+    used = np.zeros(len(x), dtype=bool)
+    for center in range(len(centers)):
+        for index in np.argsort(distances[:, center]):
+            if not used[index]:
+                used[index] = True
+                picked.append(index)
+                break
+    return np.array(picked, dtype=np.int64)
+
+
+def select_frames(videofile: Union[str, os.PathLike], n: int, stride: int = 1, max_samples: int = 10000,
+                  size: int = 32, n_components: int = 32, exclude: Iterable[int] = None, workers: int = None,
+                  seed: int = 0, progress: Callable = None) -> np.ndarray:
+    """Sorted frame numbers of n visually diverse frames of a video, e.g. to label
+
+    Frames are sampled every stride frames, or more sparsely so that there are at most max_samples, which keeps
+    memory bounded however long the video is. Each is decoded in a worker process and embedded as a size x size
+    grayscale thumbnail, reduced to n_components principal components (0: no PCA). Mini-batch k-means finds n
+    clusters, and the sampled frame nearest each center is picked. Frames in exclude, e.g. ones already labeled,
+    are never sampled.
+    """
+    with open_frame_source(str(videofile)) as reader:
+        nframes = len(reader)
+    stride = max(stride, -(-nframes // max_samples))
+    framenums = np.arange(0, nframes, stride)
+    if exclude is not None:
+        framenums = np.setdiff1d(framenums, np.asarray(list(exclude), dtype=np.int64))
+    if len(framenums) <= n:
+        return framenums
+    x = embed_video(videofile, framenums, size=size, workers=workers, progress=progress)
+    if 0 < n_components < x.shape[1]:
+        x = pca(x, n_components, seed=seed)
+    centers = minibatch_kmeans(x, n, seed=seed)
+    return np.sort(framenums[pick_nearest(x, centers)])
@@ -0,0 +1,282 @@
+import os
+from typing import Union
+
+import cv2
+import h5py
+import numpy as np
+from vidio import VideoReader
+from vidio.read import HDF5Reader
+
+
+def read_image(filename: Union[str, os.PathLike]) -> np.ndarray:
+    # keeps the file's bit depth and channels: 16-bit and grayscale images are not converted to 8-bit color. not
+    # IMREAD_UNCHANGED, which would also keep alpha but ignores the EXIF orientation that phone and camera jpgs rely on
+    frame = cv2.imread(str(filename), cv2.IMREAD_ANYDEPTH | cv2.IMREAD_ANYCOLOR)
+    if frame is None:
+        raise ValueError('Error reading image file {}'.format(filename))
+    if frame.ndim == 3:
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    return frame
+
+
+class FrameSource:
+    """Random access to the frames of a video, image sequence, single image or array
+
+    Frames are numpy arrays: (H, W, 3) RGB for color, (H, W) for grayscale. Indexing reads any frame; iterating reads
+    sequentially from the current position, which for compressed video is much faster than seeking to every frame.
+    Sources keep a file position and are not thread-safe unless `thread_safe` is set, so other threads should read
+    from their own copy made with reopen().
+    """
+    thread_safe = False
+    # reads are views of memory, or of a memory-mapped file, so caching frames would gain nothing
+    in_memory = False
+    # file name of each frame, for sources made of image files
+    names = None
+
+    def __init__(self, nframes: int):
+        self.nframes = nframes
+        self.fnum = 0
+        self._frame_shape = None
+        self._dtype = None
+
+    def read(self, framenum: int) -> np.ndarray:
+        raise NotImplementedError
+
+    def reopen(self) -> 'FrameSource':
+        # an independent source for another thread
+        if self.thread_safe:
+            return self
+        raise NotImplementedError
+
+    def probe(self):
+        # shape and dtype of every frame, from the first one
+        frame = self.read(0)
+        self._frame_shape, self._dtype = frame.shape, frame.dtype
+
+    @property
+    def frame_shape(self) -> tuple:
+        if self._frame_shape is None:
+            self.probe()
+        return self._frame_shape
+
+    @property
+    def dtype(self) -> np.dtype:
+        if self._dtype is None:
+            self.probe()
+        return self._dtype
+
+    @property
+    def shape(self) -> tuple:
+        return (self.nframes,) + tuple(self.frame_shape)
+
+    def check_framenum(self, framenum: int) -> int:
+        framenum = int(framenum)
+        if framenum < 0 or framenum >= self.nframes:
+            raise ValueError('frame number requested outside video bounds: {}'.format(framenum))
+        return framenum
+
+    def __getitem__(self, framenum: Union[int, slice]):
+        if isinstance(framenum, slice):
+            return [self.read(i) for i in range(self.nframes)[framenum]]
+        return self.read(framenum)
+
+    def __len__(self):
+        return self.nframes
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> np.ndarray:
+        if self.fnum >= self.nframes:
+            raise StopIteration
+        return self.read(self.fnum)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        pass
+
+
+class OpenCVSource(FrameSource):
+    """Video file read with cv2.VideoCapture
+
+    Sequential reads never seek. Given a SeekIndex, random reads seek only to the keyframe before the target and
+    decode forward: seeking to an arbitrary frame makes the FFmpeg backend guess from timestamps, which is slow and,
+    for some files, inaccurate. If the reader is already between that keyframe and the target it doesn't seek at all.
+    """
+    def __init__(self, filename: Union[str, os.PathLike], seek_index=None):
+        self.filename = str(filename)
+        self.seek_index = seek_index
+        self.file_object = cv2.VideoCapture(self.filename)
+        if not self.file_object.isOpened():
+            raise ValueError('could not open video {}'.format(self.filename))
+        super().__init__(int(self.file_object.get(cv2.CAP_PROP_FRAME_COUNT)))
+        self.fps = self.file_object.get(cv2.CAP_PROP_FPS)
+        self._frame_shape = (int(self.file_object.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                             int(self.file_object.get(cv2.CAP_PROP_FRAME_WIDTH)), 3)
+        self._dtype = np.dtype(np.uint8)
+
+    def reopen(self) -> 'OpenCVSource':
+        return OpenCVSource(self.filename, self.seek_index)
+
+    def seek(self, framenum: int):
+        keyframe = self.seek_index.nearest_keyframe(framenum) if self.seek_index is not None else None
+        if keyframe is None:
+            self.file_object.set(int(cv2.CAP_PROP_POS_FRAMES), framenum)
+            self.fnum = framenum
+            return
+        if not keyframe <= self.fnum < framenum:
+            self.file_object.set(int(cv2.CAP_PROP_POS_FRAMES), keyframe)
+            self.fnum = keyframe
+        while self.fnum < framenum:
+            if not self.file_object.grab():
+                raise ValueError('error decoding frame {} from video {}'.format(self.fnum, self.filename))
+            self.fnum += 1
+
+    def read(self, framenum: int) -> np.ndarray:
+        framenum = self.check_framenum(framenum)
+        if framenum != self.fnum:
+            self.seek(framenum)
+        ret, frame = self.file_object.read()
+        if not ret:
+            raise ValueError('error decoding frame {} from video {}'.format(framenum, self.filename))
+        self.fnum = framenum + 1
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+    def close(self):
+        if self.file_object is not None:
+            self.file_object.release()
+            self.file_object = None
+
+
+class VidioSource(FrameSource):
+    """Anything vidio's VideoReader opens: videos, directories of images, and HDF5 files of jpgs such as proxies"""
+    def __init__(self, filename: Union[str, os.PathLike]):
+        self.filename = filename
+        self.reader = VideoReader(filename)
+        super().__init__(len(self.reader))
+        if os.path.isdir(filename):
+            self.names = [os.path.basename(name) for name in self.reader.file_object]
+        # read it now, rather than lazily from whichever thread asks first
+        self.probe()
+
+    def reopen(self) -> 'VidioSource':
+        return VidioSource(self.filename)
+
+    def read(self, framenum: int) -> np.ndarray:
+        frame = self.reader.read(self.check_framenum(framenum))
+        self.fnum = self.reader.fnum
+        if isinstance(self.reader, HDF5Reader):
+            # vidio decodes its HDF5 jpgs with cv2.imdecode and doesn't convert them from BGR like its other readers
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        return frame
+
+    def close(self):
+        self.reader.close()
+
+
+class SingleImageSource(FrameSource):
+    """One image file, as a source with one frame"""
+    thread_safe = True
+
+    def __init__(self, filename: Union[str, os.PathLike], frame: np.ndarray = None):
+        self.filename = filename
+        # frame can be passed in if the caller already read the image
+        self.frame = read_image(filename) if frame is None else frame
+        super().__init__(1)
+        self.names = [filename]
+        self._frame_shape, self._dtype = self.frame.shape, self.frame.dtype
+
+    def read(self, framenum: int) -> np.ndarray:
+        self.check_framenum(framenum)
+        self.fnum = 1
+        return self.frame
+
+
+class ArraySource(FrameSource):
+    """Frames already in memory, as a (nframes, H, W) or (nframes, H, W, C) array. Reads return views, not copies"""
+    thread_safe = True
+    in_memory = True
+
+    def __init__(self, array: np.ndarray):
+        if array.ndim not in (3, 4):
+            raise ValueError('expected an array of shape (nframes, H, W[, C]), got {}'.format(array.shape))
+        self.array = array
+        super().__init__(len(array))
+        self._frame_shape, self._dtype = array.shape[1:], array.dtype
+
+    def read(self, framenum: int) -> np.ndarray:
+        framenum = self.check_framenum(framenum)
+        self.fnum = framenum + 1
+        return self.array[framenum]
+
+
+class NpySource(ArraySource):
+    """A .npy file of frames, memory-mapped
+
+    Opening it only reads the header, however big the file is. Each frame is paged in from disk when it is first
+    shown, and reads return views of the mapping rather than copies.
+    """
+    def __init__(self, filename: Union[str, os.PathLike]):
+        self.filename = filename
+        super().__init__(np.load(filename, mmap_mode='r'))
+
+
+def find_frame_dataset(f: h5py.File):
+    # name of the first numeric dataset shaped like (nframes, H, W[, C]), or None
+    names = []
+
+    def visit(name, obj):
+        if isinstance(obj, h5py.Dataset) and obj.ndim in (3, 4) and obj.dtype.kind in 'uif':
+            names.append(name)
+    f.visititems(visit)
+    return names[0] if len(names) > 0 else None
+
+
+class HDF5ArraySource(FrameSource):
+    """A (nframes, H, W[, C]) dataset in an HDF5 file
+
+    Contiguous, uncompressed datasets are memory-mapped straight from the file, like NpySource. Chunked or compressed
+    ones are read a frame at a time through h5py.
+    """
+    def __init__(self, filename: Union[str, os.PathLike], dataset: str = None):
+        self.filename = filename
+        self.file_object = h5py.File(filename, 'r')
+        if dataset is None:
+            dataset = find_frame_dataset(self.file_object)
+            if dataset is None:
+                self.file_object.close()
+                raise ValueError('no dataset of shape (nframes, H, W[, C]) in {}'.format(filename))
+        self.dataset_name = dataset
+        self.dataset = self.file_object[dataset]
+        super().__init__(len(self.dataset))
+        self._frame_shape, self._dtype = self.dataset.shape[1:], self.dataset.dtype
+
+        self.array = None
+        offset = self.dataset.id.get_offset()
+        if self.dataset.chunks is None and offset is not None:
+            self.array = np.memmap(filename, dtype=self.dataset.dtype, mode='r', offset=offset,
+                                   shape=self.dataset.shape)
+            self.thread_safe = True
+            self.in_memory = True
+
+    def reopen(self) -> 'HDF5ArraySource':
+        if self.thread_safe:
+            return self
+        return HDF5ArraySource(self.filename, self.dataset_name)
+
+    def read(self, framenum: int) -> np.ndarray:
+        framenum = self.check_framenum(framenum)
+        self.fnum = framenum + 1
+        if self.array is not None:
+            return self.array[framenum]
+        return self.dataset[framenum]
+
+    def close(self):
+        self.array = None
+        if self.file_object.id.valid:
+            self.file_object.close()
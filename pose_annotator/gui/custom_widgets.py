@@ -2,26 +2,50 @@ from PySide2 import QtCore, QtGui, QtWidgets
 from PySide2.QtWidgets import (QGroupBox, QFormLayout, QLabel, QLineEdit, QVBoxLayout, QWidget, QMainWindow)
 from PySide2.QtCore import Qt, Signal, Slot, QPoint, QEvent
 from PySide2.QtGui import QPainter, QBrush, QPen, QPixmap, QColor
+from collections import OrderedDict
+from functools import partial
 from typing import Union, Tuple
 import os
+import threading
+import traceback
 import warnings
 
 import cv2
-from vidio import VideoReader
 import numpy as np
 import matplotlib.pyplot as plt
 
+from pose_annotator.backends import open_frame_source
+from pose_annotator.contrast import Window, apply_window, get_max_level
+from pose_annotator.frame_cache import FrameCache
+from pose_annotator.frame_source import SingleImageSource
+from pose_annotator.gui.frame_scheduler import FrameScheduler
+from pose_annotator.proxy import get_proxy_scale
+from pose_annotator.seek_index import get_seek_index
+from pose_annotator.spatial import GridIndex, find_nearest
+from pose_annotator.tiles import TilePyramid, load_image
+from pose_annotator.thumbnails import get_thumbnails
+from pose_annotator.timeline import TimelineHistogram
+from pose_annotator.utils import LatencyCounter
+
 
 def numpy_to_qpixmap(image: np.ndarray) -> QtGui.QPixmap:
-    if isinstance(image.flat[0], np.floating):
+    if np.issubdtype(image.dtype, np.floating):
         image = float_to_uint8(image)
-    H, W, C = int(image.shape[0]), int(image.shape[1]), int(image.shape[2])
-    if C == 4:
+    if image.ndim == 3 and image.shape[2] == 1:
+        image = image[..., 0]
+    H, W = int(image.shape[0]), int(image.shape[1])
+    C = int(image.shape[2]) if image.ndim == 3 else 1
+    if C == 1 and image.dtype == np.uint16:
+        format = QtGui.QImage.Format_Grayscale16
+    elif C == 1:
+        format = QtGui.QImage.Format_Grayscale8
+    elif C == 4:
         format = QtGui.QImage.Format_RGBA8888
     elif C == 3:
         format = QtGui.QImage.Format_RGB888
     else:
         raise ValueError('Aberrant number of channels: {}'.format(C))
+    image = np.ascontiguousarray(image)
     qpixmap = QtGui.QPixmap(QtGui.QImage(image, W,
                                          H, image.strides[0],
                                          format))
@@ -30,16 +54,228 @@ def numpy_to_qpixmap(image: np.ndarray) -> QtGui.QPixmap:
 
 
 def float_to_uint8(image: np.ndarray) -> np.ndarray:
-    if image.dtype == np.float:
+    if np.issubdtype(image.dtype, np.floating):
         image = (image * 255).clip(min=0, max=255).astype(np.uint8)
     # print(image)
     return image
 
 
+def numpy_to_bgra(image: np.ndarray, out: np.ndarray) -> np.ndarray:
+    # converts an RGB or RGBA frame into out, an (H, W, 4) uint8 buffer in QImage.Format_RGB32's memory layout
+    if np.issubdtype(image.dtype, np.floating):
+        image = float_to_uint8(image)
+    C = image.shape[2]
+    if C == 4:
+        code = cv2.COLOR_RGBA2BGRA
+    elif C == 3:
+        code = cv2.COLOR_RGB2BGRA
+    else:
+        raise ValueError('Aberrant number of channels: {}'.format(C))
+    return cv2.cvtColor(image, code, dst=out)
+
+
 def initializer(nframes: int):
     print('initialized with {}'.format(nframes))
 
 
+def convert_for_display(frame: np.ndarray, window: Window = None, buffer: np.ndarray = None) -> tuple:
+    """Converts frame into a buffer a QImage can wrap, reusing buffer if it fits. Returns the buffer and its format
+
+    Color frames are converted to Qt's native 32-bit format. Grayscale frames stay single-channel, as Grayscale8 or,
+    for 16-bit frames, Grayscale16. With a contrast window, frames are mapped to 8 bits through its lookup table first.
+    """
+    if np.issubdtype(frame.dtype, np.floating):
+        frame = float_to_uint8(frame)
+    if frame.ndim == 3 and frame.shape[2] == 1:
+        frame = frame[..., 0]
+    H, W = int(frame.shape[0]), int(frame.shape[1])
+
+    def get_buffer(shape, dtype):
+        if buffer is not None and buffer.shape == shape and buffer.dtype == dtype:
+            return buffer
+        return np.empty(shape, dtype=dtype)
+
+    if frame.ndim == 2:
+        if window is not None:
+            out = get_buffer((H, W), np.uint8)
+            apply_window(frame, window, out=out)
+            return out, QtGui.QImage.Format_Grayscale8
+        elif frame.dtype == np.uint8:
+            out = get_buffer((H, W), np.uint8)
+            np.copyto(out, frame)
+            return out, QtGui.QImage.Format_Grayscale8
+        elif frame.dtype == np.uint16:
+            out = get_buffer((H, W), np.uint16)
+            np.copyto(out, frame)
+            return out, QtGui.QImage.Format_Grayscale16
+        raise ValueError('unsupported frame dtype: {}'.format(frame.dtype))
+
+    if window is not None:
+        frame = apply_window(frame, window)
+    elif frame.dtype != np.uint8:
+        # e.g. 16-bit color: no native Qt format, so map the full range to 8 bits
+        frame = apply_window(frame, Window(0, get_max_level(frame.dtype)))
+    out = get_buffer((H, W, 4), np.uint8)
+    numpy_to_bgra(frame, out)
+    return out, QtGui.QImage.Format_RGB32
+
+
+def buffer_to_qimage(buffer: np.ndarray, format) -> QtGui.QImage:
+    # the QImage does not own or copy this memory; keep a reference to buffer for as long as the QImage is used
+    return QtGui.QImage(buffer, buffer.shape[1], buffer.shape[0], buffer.strides[0], format)
+
+
+# dtypes cv2.resize handles. others are shown at full resolution
+resizable_dtypes = (np.dtype(np.uint8), np.dtype(np.uint16), np.dtype(np.int16), np.dtype(np.float32),
+                    np.dtype(np.float64))
+
+
+class FrameItem(QtWidgets.QGraphicsItem):
+    """Graphics item that paints frames straight from a QImage
+
+    The QImage wraps a numpy buffer that is allocated once per frame size and format and refilled in place for every
+    frame (see convert_for_display), so showing a frame is one conversion and no QPixmap upload.
+    """
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.buffer = None
+        self.image = QtGui.QImage()
+        self.window = None
+
+    def boundingRect(self):
+        return QtCore.QRectF(0, 0, self.image.width(), self.image.height())
+
+    def paint(self, painter, option, widget=None):
+        if not self.image.isNull():
+            painter.drawImage(0, 0, self.image)
+
+    def set_frame(self, frame: np.ndarray):
+        buffer, format = convert_for_display(frame, self.window, self.buffer)
+        if buffer is not self.buffer:
+            if self.buffer is None or self.buffer.shape[:2] != buffer.shape[:2]:
+                self.prepareGeometryChange()
+            self.buffer = buffer
+            self.image = buffer_to_qimage(buffer, format)
+        self.update()
+
+
+class TiledImageItem(QtWidgets.QGraphicsObject):
+    """Graphics item for images too large to show as one frame, painted from a TilePyramid
+
+    Each paint draws only the tiles that overlap the exposed area, from the pyramid level that matches the current
+    zoom, on top of the whole-image overview. Tiles that aren't in memory yet are built and converted on a worker
+    thread, most recently requested first and center-out, and painted when they arrive, so painting never waits on
+    disk. Converted tiles are kept in an LRU cache of at most memory_mb.
+    """
+    tile_ready = Signal()
+
+    def __init__(self, pyramid, memory_mb: float = 256, parent=None):
+        super().__init__(parent)
+        self.pyramid = pyramid
+        self.max_bytes = memory_mb * 1e6
+        self.window = None
+        # (window, level, row, col): (buffer, QImage)
+        self.images = OrderedDict()
+        self.nbytes = 0
+        self.wanted = []
+        self.condition = threading.Condition()
+        self.stopped = False
+        # for exposedRect
+        self.setFlag(QtWidgets.QGraphicsItem.ItemUsesExtendedStyleOption)
+        self.tile_ready.connect(self.update)
+        self.thread = threading.Thread(target=self.run, name='TiledImageItem', daemon=True)
+        self.thread.start()
+
+    def boundingRect(self):
+        height, width = self.pyramid.frame_shape[:2]
+        return QtCore.QRectF(0, 0, width, height)
+
+    def get_image(self, key: tuple):
+        with self.condition:
+            entry = self.images.get(key)
+            if entry is not None:
+                self.images.move_to_end(key)
+                return entry[1]
+        return None
+
+    def put_image(self, key: tuple, buffer: np.ndarray, image: QtGui.QImage):
+        with self.condition:
+            self.images[key] = (buffer, image)
+            self.nbytes += buffer.nbytes
+            while self.nbytes > self.max_bytes and len(self.images) > 1:
+                _, (evicted, _) = self.images.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def draw_tile(self, painter, level: int, row: int, col: int, image: QtGui.QImage):
+        y0, y1, x0, x1 = self.pyramid.get_tile_bounds(level, row, col)
+        scale = 2 ** level
+        painter.drawImage(QtCore.QRectF(x0 * scale, y0 * scale, (x1 - x0) * scale, (y1 - y0) * scale), image)
+
+    def paint(self, painter, option, widget=None):
+        missing = []
+        top = self.pyramid.n_levels - 1
+        overview = self.get_image((self.window, top, 0, 0))
+        if overview is not None:
+            self.draw_tile(painter, top, 0, 0, overview)
+        else:
+            missing.append((top, 0, 0))
+
+        level = self.pyramid.get_level_for_scale(option.levelOfDetailFromTransform(painter.worldTransform()))
+        if level < top:
+            exposed = option.exposedRect
+            center = exposed.center()
+            extent = self.pyramid.tile_size * 2 ** level
+            tiles = self.pyramid.get_tiles_in_rect(level, exposed.left(), exposed.top(), exposed.right(),
+                                                   exposed.bottom())
+            tiles.sort(key=lambda tile: ((tile[1] + 0.5) * extent - center.x()) ** 2 +
+                                        ((tile[0] + 0.5) * extent - center.y()) ** 2)
+            for row, col in tiles:
+                image = self.get_image((self.window, level, row, col))
+                if image is not None:
+                    self.draw_tile(painter, level, row, col, image)
+                else:
+                    missing.append((level, row, col))
+        if len(missing) > 0:
+            self.request(missing)
+
+    def request(self, tiles: list):
+        # replaces earlier requests: only what the latest paint needed is worth building
+        with self.condition:
+            self.wanted = list(tiles)
+            self.condition.notify_all()
+
+    def set_window(self, window: Window):
+        self.window = window
+        self.update()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.stopped and len(self.wanted) == 0:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                level, row, col = self.wanted.pop(0)
+                window = self.window
+            key = (window, level, row, col)
+            if self.get_image(key) is not None:
+                continue
+            try:
+                buffer, format = convert_for_display(self.pyramid.get_tile(level, row, col), window)
+            except Exception:
+                traceback.print_exc()
+                continue
+            self.put_image(key, buffer, buffer_to_qimage(buffer, format))
+            self.tile_ready.emit()
+
+    def close(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.images.clear()
+
+
 class ClickableScene(QtWidgets.QGraphicsScene):
     click = QtCore.Signal(QtGui.QMouseEvent)
     move = QtCore.Signal(QtGui.QMouseEvent)
@@ -66,6 +302,8 @@ class ClickableScene(QtWidgets.QGraphicsScene):
 class VideoFrame(QtWidgets.QGraphicsView):
     frameNum = Signal(int)
     initialized = Signal(int)
+    # framenum, error message, when a requested frame couldn't be decoded
+    frame_failed = Signal(int, str)
     
     def __init__(self, videoFile: Union[str, os.PathLike] = None, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -73,8 +311,10 @@ class VideoFrame(QtWidgets.QGraphicsView):
         # self.videoView = QtWidgets.QGraphicsView()
         self.scene = ClickableScene(self) # QtWidgets.QGraphicsScene(self)
         # self.scene = CroppingOverlay(parent=self)
-        self._photo = QtWidgets.QGraphicsPixmapItem()
+        self._photo = FrameItem()
         self.scene.addItem(self._photo)
+        # (scene rect, viewport size, transform) after the last fitInView, to skip refitting when nothing changed
+        self.fitted = None
 
         # self.videoView.setScene(self.scene)
         self.setScene(self.scene)
@@ -88,6 +328,37 @@ class VideoFrame(QtWidgets.QGraphicsView):
         # self.setObjectName("videoView")
         
         self.vid = None
+        self.frame = None
+        self.cache = None
+        self.scheduler = None
+        self.seek_index = None
+        self.requested_fnum = None
+        # displayed pixels per original pixel, e.g. when showing a downscaled proxy. the pixmap item is scaled by the
+        # inverse, so scene coordinates (and so keypoints) are always in original pixels
+        self.display_scale = 1.0
+        # source pixels per original pixel, i.e. the proxy's scale
+        self.source_scale = 1.0
+        # frames are downsampled before display to at most this many pixels on their longest side, or to the zoom
+        # level if 'viewport'. None always shows full resolution. see get_target_scale
+        self.display_max_size = None
+        # what the scheduler's thread currently resizes frames by, relative to the source's frames
+        self.target_scale = 1.0
+        self.fit_on_next_frame = False
+        self.display_latency = LatencyCounter('frame request to display')
+        # print display latency and frame cache stats when a video is closed
+        self.print_latency = False
+        # see FrameCache. set before opening a video
+        self.frame_cache_kwargs = {}
+        # see backends.choose_backend. None picks automatically
+        self.backend = None
+        # for images of at least tile_megapixels, a TiledImageItem replaces _photo. see initialize_image
+        self.tiles = None
+        self.tile_megapixels = 64
+        self.tile_kwargs = {}
+        self.tile_memory_mb = 256
+        # scrubbing previews, see ThumbnailCache. set thumbnail_kwargs to None before opening a video to turn them off
+        self.thumbnails = None
+        self.thumbnail_kwargs = {}
         
         if videoFile is not None:
             self.initialize_video(videoFile)
@@ -107,93 +378,220 @@ class VideoFrame(QtWidgets.QGraphicsView):
             scale = gesture.scaleFactor()
             last_scale = gesture.lastScaleFactor()
             self.scale(scale, last_scale)
+            self.update_target_scale()
         return out
     
-    def initialize_image(self, imagefile: Union[str, os.PathLike])    : 
+    def close_video(self):
+        if self.tiles is not None:
+            self.tiles.close()
+            self.scene.removeItem(self.tiles)
+            self.tiles = None
+            self._photo.show()
+        if self.scheduler is not None:
+            self.scheduler.close()
+            self.scheduler = None
+            if self.print_latency and self.display_latency.count > 0:
+                print(self.display_latency)
+            self.display_latency.reset()
+        if self.thumbnails is not None:
+            self.thumbnails.close()
+            self.thumbnails = None
+        if self.seek_index is not None:
+            self.seek_index.cancel()
+            self.seek_index = None
+        if self.cache is not None:
+            if self.print_latency:
+                print(self.cache)
+            self.cache.close()
+            self.cache = None
         if self.vid is not None:
             self.vid.close()
             self.vid = None
 
-        self.videofile = imagefile
+    def set_window(self, window: Window):
+        # contrast window for display, or None to show frames as they are. redraws the current frame without decoding
+        self._photo.window = window
+        if self.tiles is not None:
+            self.tiles.set_window(window)
+        elif self.frame is not None:
+            self.show_image(self.frame)
+
+    def set_display_scale(self, display_scale: float):
+        self.display_scale = display_scale
+        self._photo.setScale(1 / display_scale)
+
+    def get_target_scale(self) -> float:
+        # how much to downsample frames for the current zoom. 1 once zoomed in past 1:1
+        if self.display_max_size is None or self.vid is None or self.tiles is not None:
+            return 1.0
+        # screen pixels per source pixel
+        zoom = self.transform().m11() * self.devicePixelRatioF() / self.source_scale
+        if zoom >= 1:
+            return 1.0
+        if self.display_max_size == 'viewport':
+            # the next power of two up, so zooming a little doesn't change the size of every frame
+            return 0.5 ** np.floor(np.log2(1 / zoom))
+        return min(1.0, self.display_max_size / max(self.vid.frame_shape[:2]))
+
+    def update_target_scale(self):
+        # after the zoom changes. redraws the current frame if it should now be shown at a different resolution
+        target_scale = self.get_target_scale()
+        if target_scale != self.target_scale:
+            self.target_scale = target_scale
+            if self.requested_fnum is not None:
+                self.update_frame(self.requested_fnum, force_update=True)
+
+    def downsample(self, frame: np.ndarray) -> np.ndarray:
+        # runs on the scheduler's thread. the cache keeps full-resolution frames, so zooming in needs no decoding
+        scale = self.target_scale
+        if scale >= 1 or frame.dtype not in resizable_dtypes:
+            return frame
+        height, width = frame.shape[:2]
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+    def initialize_image(self, imagefile: Union[str, os.PathLike], image=None):
+        # image: what tiles.load_image returned for imagefile, e.g. on a worker thread. loaded here if None
         assert os.path.isfile(imagefile)
-        
-        im = cv2.imread(imagefile, 1)
-        im = cv2.cvtColor(im, cv2.COLOR_BGR2RGB)
-        self.frame = im
+        self.close_video()
+        self.source_scale = 1.0
+        self.set_display_scale(1.0)
+
+        if image is None:
+            image = load_image(imagefile, self.tile_megapixels, **self.tile_kwargs)
+        if isinstance(image, TilePyramid):
+            self.initialize_tiles(image, imagefile)
+        else:
+            # a one-frame source, through the same pipeline as videos
+            self.initialize_source(SingleImageSource(imagefile, image), imagefile)
 
+    def initialize_tiles(self, pyramid, imagefile: Union[str, os.PathLike]):
+        self.videofile = imagefile
+        self.vid = pyramid
+        self.tiles = TiledImageItem(pyramid, self.tile_memory_mb)
+        self.tiles.window = self._photo.window
+        self._photo.hide()
+        self.scene.addItem(self.tiles)
+        # keypoints go on top
+        self.tiles.setZValue(-1)
+        self.frame = None
         self.initialized.emit(1)
-
-        # the frame in the videoreader is the position of the reader. If you've read frame 0, the current reader
-        # position is 1. This makes cv2.CAP_PROP_POS_FRAMES match vid.fnum. However, we want to keep track of our
-        # currently displayed image, which is fnum - 1
         self.current_fnum = 0
-        # print('new fnum: {}'.format(self.current_fnum))
-        self.show_image(self.frame)
-        self.frameNum.emit(self.current_fnum)
+        self.requested_fnum = 0
         self.fitInView()
+        self.frameNum.emit(self.current_fnum)
 
-        # print(self.palette())
-
-    def initialize_video(self, videofile: Union[str, os.PathLike]):
-        if self.vid is not None:
-            self.vid.close()
-            self.vid = None
+    def initialize_video(self, videofile: Union[str, os.PathLike], proxy_file: Union[str, os.PathLike] = None):
+        self.close_video()
 
+        if proxy_file is not None:
+            # every proxy frame is a jpg, so seeking needs no index
+            source = proxy_file
+            self.source_scale = get_proxy_scale(proxy_file)
+        else:
+            source = videofile
+            self.source_scale = 1.0
+            # loaded from a sidecar, or built in the background. readers fall back to plain seeking until it's ready
+            self.seek_index = get_seek_index(videofile)
+        self.set_display_scale(self.source_scale)
+        self.initialize_source(open_frame_source(source, self.backend, self.seek_index), videofile)
+
+    def initialize_source(self, vid, videofile: Union[str, os.PathLike]):
         self.videofile = videofile
-        self.vid = VideoReader(videofile)
+        self.vid = vid
+        self.target_scale = self.get_target_scale()
+        if self.vid.in_memory:
+            # e.g. a memory-mapped array: frames go straight to the display, without copies into a cache
+            self.scheduler = FrameScheduler(self.vid, self.downsample, parent=self)
+        else:
+            # prefetch threads each need their own reader, unless it's thread-safe
+            self.cache = FrameCache(self.vid, self.vid.reopen, **self.frame_cache_kwargs)
+            self.scheduler = FrameScheduler(self.cache, self.downsample, parent=self)
+        # bind the scheduler, so frames still in flight from a previous video can be recognized and dropped
+        self.scheduler.ready.connect(partial(self.receive_frame, self.scheduler))
+        self.scheduler.failed.connect(partial(self.receive_failure, self.scheduler))
+        if self.thumbnail_kwargs is not None:
+            self.thumbnails = get_thumbnails(videofile, self.vid, **self.thumbnail_kwargs)
         # self.frame = next(self.vid)
         self.initialized.emit(len(self.vid))
+        # frames arrive asynchronously, so fit the view once the first one is shown
+        self.fit_on_next_frame = True
         # there was a bug where sometimes subsequent videos with the same frame would not update the image
         self.update_frame(0, force_update=True)
-        self.fitInView()
+
+    def get_contrast_sample(self):
+        # the frame to compute an automatic contrast window from
+        if self.tiles is not None:
+            # the overview, rather than reading the full-resolution image
+            pyramid = self.tiles.pyramid
+            return pyramid.get_tile(pyramid.n_levels - 1, 0, 0)
+        return self.frame
 
     def get_image_names(self):
-        if self.vid is None: # single image
-            return [self.videofile]
-        elif isinstance(self.vid.file_object, list): # image directory 
-            return [os.path.split(n)[1] for n in self.vid.file_object]
+        if self.vid.names is not None: # image directory or single image
+            return self.vid.names
         else: # video
             return [self.videofile]*len(self.vid)
         
 
     def update_frame(self, value, force_update: bool=False):
-        # print('updating')
-        # print('update to: {}'.format(value))
-        # print(self.current_fnum)
-        # previous_frame = self.current_fnum
-        if not hasattr(self, 'vid'):
+        if self.scheduler is None:
+            # no video
             return
         value = int(value)
-        if hasattr(self, 'current_fnum'):
-            if self.current_fnum == value and not force_update:
-                # print('already there')
-                return
         if value < 0:
             # warnings.warn('Desired frame less than 0: {}'.format(value))
             value = 0
         if value >= self.vid.nframes:
             # warnings.warn('Desired frame beyond maximum: {}'.format(self.vid.nframes))
             value = self.vid.nframes - 1
+        if self.requested_fnum == value and not force_update:
+            # print('already there')
+            return
+
+        # decoding happens on the scheduler's thread; stale requests are dropped in favor of this one
+        self.requested_fnum = value
+        if self.thumbnails is not None:
+            self.thumbnails.touch()
+        self.scheduler.request(value)
 
-        self.frame = self.vid[value]
+    def receive_failure(self, scheduler: FrameScheduler, framenum: int, message: str):
+        # the previous frame stays on screen
+        if scheduler is self.scheduler:
+            self.frame_failed.emit(framenum, message)
 
-        # the frame in the videoreader is the position of the reader. If you've read frame 0, the current reader
-        # position is 1. This makes cv2.CAP_PROP_POS_FRAMES match vid.fnum. However, we want to keep track of our
-        # currently displayed image, which is fnum - 1
-        self.current_fnum = self.vid.fnum - 1
-        # print('new fnum: {}'.format(self.current_fnum))
+    def receive_frame(self, scheduler: FrameScheduler, framenum: int, frame: np.ndarray, requested_at: float):
+        if scheduler is not self.scheduler:
+            # left over from a video that has since been closed
+            return
+        self.frame = frame
+        self.current_fnum = framenum
+        # the frame may have been downsampled; scale the item back up so it covers the same scene rect
+        display_scale = self.source_scale * frame.shape[1] / self.vid.frame_shape[1]
+        if display_scale != self.display_scale:
+            self.set_display_scale(display_scale)
         self.show_image(self.frame)
+        if self.fit_on_next_frame:
+            self.fitInView()
+            self.fit_on_next_frame = False
         self.frameNum.emit(self.current_fnum)
-        if self.resize_on_each_frame: self.fitInView()
+        self.display_latency.stop(requested_at)
+        self.scheduler.frame_shown()
         
     def next_frame(self):
-        self.update_frame(self.current_fnum + 1)
+        # step from the last requested frame, not the last shown one, so key repeat isn't held back by decoding
+        if self.requested_fnum is not None:
+            self.update_frame(self.requested_fnum + 1)
 
     def previous_frame(self):
-        self.update_frame(self.current_fnum - 1)
+        if self.requested_fnum is not None:
+            self.update_frame(self.requested_fnum - 1)
 
     def fitInView(self, scale=True):
-        rect = QtCore.QRectF(self._photo.pixmap().rect())
+        # in scene coordinates, i.e. original pixels even if the displayed frame is downscaled
+        rect = (self.tiles if self.tiles is not None else self._photo).sceneBoundingRect()
+        if self.fitted == (rect, self.viewport().size(), self.transform()):
+            return
         if not rect.isNull():
             self.scene.setSceneRect(rect)
             # if self.hasPhoto():
@@ -206,37 +604,88 @@ class VideoFrame(QtWidgets.QGraphicsView):
             # print(factor, viewrect, scenerect)
             self.scale(factor, factor)
             self._zoom = 0
+            self.fitted = (rect, self.viewport().size(), self.transform())
+            self.update_target_scale()
 
     def adjust_aspect_ratio(self):
-        if not hasattr(self, 'vid'):
+        if self.vid is None:
             raise ValueError('Trying to set GraphicsView aspect ratio before video loaded.')
-        if not hasattr(self.vid, 'width'):
-            self.vid.width, self.vid.height = self.frame.shape[1], self.frame.shape[0]
-        video_aspect = self.vid.width / self.vid.height
+        height, width = self.vid.frame_shape[:2]
+        video_aspect = width / height
         H, W = self.height(), self.width()
         new_width = video_aspect * H
         if new_width < W:
             self.setFixedWidth(new_width)
-        new_height = W / self.vid.width * self.vid.height
+        new_height = W / width * height
         if new_height < H:
             self.setFixedHeight(new_height)
 
     def show_image(self, array):
-        qpixmap = numpy_to_qpixmap(array)
-        # THIS LINE CHANGES THE SCENE WIDTH AND HEIGHT
-        self._photo.setPixmap(qpixmap)
+        # THIS LINE CHANGES THE SCENE WIDTH AND HEIGHT, if the frame size changed
+        self._photo.set_frame(array)
 
         if self.resize_on_each_frame: self.fitInView()
-        self.update()
-        # self.show()
 
     # def resizeEvent(self, event):
     #     if hasattr(self, 'vid'):
     #         self.fitInView()
 
 
+class PreviewScrollBar(QtWidgets.QScrollBar):
+    """Scrollbar that reports which value the mouse is over, for previews"""
+    hovered = Signal(int)
+    left = Signal()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.setMouseTracking(True)
+
+    def get_value_at(self, x: int) -> int:
+        option = QtWidgets.QStyleOptionSlider()
+        self.initStyleOption(option)
+        style = self.style()
+        groove = style.subControlRect(QtWidgets.QStyle.CC_ScrollBar, option, QtWidgets.QStyle.SC_ScrollBarGroove,
+                                      self)
+        handle = style.subControlRect(QtWidgets.QStyle.CC_ScrollBar, option, QtWidgets.QStyle.SC_ScrollBarSlider,
+                                      self)
+        # the value whose handle would be centered on x
+        span = max(groove.width() - handle.width(), 1)
+        return QtWidgets.QStyle.sliderValueFromPosition(self.minimum(), self.maximum(),
+                                                        x - groove.x() - handle.width() // 2, span)
+
+    def mouseMoveEvent(self, event):
+        super().mouseMoveEvent(event)
+        if not self.isSliderDown():
+            self.hovered.emit(self.get_value_at(event.pos().x()))
+
+    def leaveEvent(self, event):
+        super().leaveEvent(event)
+        self.left.emit()
+
+
+class ThumbnailPopup(QtWidgets.QLabel):
+    """Tooltip-like window showing a thumbnail and its frame number above the scrollbar"""
+    def __init__(self, parent=None):
+        super().__init__(parent, Qt.ToolTip)
+        self.setStyleSheet('background: rgb(40, 40, 40); color: white; padding: 2px')
+
+    def show_thumbnail(self, framenum: int, thumbnail: np.ndarray, window: Window, bottom_center: QPoint):
+        buffer, format = convert_for_display(thumbnail, window)
+        pixmap = QtGui.QPixmap.fromImage(buffer_to_qimage(buffer, format))
+        painter = QPainter(pixmap)
+        painter.setPen(QColor(255, 255, 255))
+        painter.drawText(QPoint(3, pixmap.height() - 4), str(framenum))
+        painter.end()
+        self.setPixmap(pixmap)
+        self.adjustSize()
+        self.move(bottom_center - QPoint(self.width() // 2, self.height()))
+        self.show()
+
+
 class ScrollbarWithText(QtWidgets.QWidget):
     position = Signal(int)
+    # while dragging with previews on: the frame under the handle, without decoding it
+    preview = Signal(int)
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -255,7 +704,7 @@ class ScrollbarWithText(QtWidgets.QWidget):
 
         self.horizontalLayout.setObjectName("horizontalLayout")
 
-        self.horizontalScrollBar = QtWidgets.QScrollBar(self.horizontalWidget)
+        self.horizontalScrollBar = PreviewScrollBar(self.horizontalWidget)
         sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Maximum)
         sizePolicy.setHorizontalStretch(0)
         sizePolicy.setVerticalStretch(0)
@@ -291,6 +740,14 @@ class ScrollbarWithText(QtWidgets.QWidget):
         self.plainTextEdit.returnPressed.connect(self.text_change)
         self.horizontalScrollBar.sliderMoved.connect(self.scrollbar_change)
         self.horizontalScrollBar.valueChanged.connect(self.scrollbar_change)
+        self.horizontalScrollBar.sliderReleased.connect(self.scrollbar_released)
+
+        # with previews on, dragging only decodes the frame under the handle once it has stopped for settle_ms
+        self.preview_enabled = False
+        self.settle_timer = QtCore.QTimer(self)
+        self.settle_timer.setSingleShot(True)
+        self.settle_timer.setInterval(150)
+        self.settle_timer.timeout.connect(self.scrollbar_settled)
         # self.initialize_state(0)
         # self.update_state(0)
         self.update()
@@ -306,15 +763,31 @@ class ScrollbarWithText(QtWidgets.QWidget):
 
     def scrollbar_change(self):
         value = self.horizontalScrollBar.value()
+        if self.preview_enabled and self.horizontalScrollBar.isSliderDown():
+            self.preview.emit(value)
+            self.settle_timer.start()
+            return
         self.position.emit(value)
 
+    def scrollbar_settled(self):
+        self.position.emit(self.horizontalScrollBar.value())
+
+    def scrollbar_released(self):
+        if self.preview_enabled:
+            self.settle_timer.stop()
+            self.position.emit(self.horizontalScrollBar.value())
+
     @Slot(int)
     def update_state(self, value: int):
         if self.plainTextEdit.text() != '{}'.format(value):
             self.plainTextEdit.setText('{}'.format(value))
 
-        if self.horizontalScrollBar.value() != value:
+        # don't fight the user while they drag, and don't echo the value back out through valueChanged: with
+        # asynchronous decoding, the frame being shown can lag behind the one most recently requested
+        if self.horizontalScrollBar.value() != value and not self.horizontalScrollBar.isSliderDown():
+            self.horizontalScrollBar.blockSignals(True)
             self.horizontalScrollBar.setValue(value)
+            self.horizontalScrollBar.blockSignals(False)
 
     @Slot(int)
     def initialize_state(self, value: int):
@@ -329,6 +802,172 @@ class ScrollbarWithText(QtWidgets.QWidget):
         # self.update()
 
 
+class TimelineWidget(QtWidgets.QWidget):
+    """Strip showing where frames are labeled along the whole video, and how completely, one pixel column per bucket
+    of frames. Click or drag to seek
+
+    The strip is cached as an image, rendered from a TimelineHistogram. An edit re-renders only the columns of the
+    edited frame's bucket, and moving the cursor repaints only the cursor's old and new columns.
+    """
+    position = Signal(int)
+
+    def __init__(self, colors: np.ndarray, parent=None, band_height: int = 6):
+        super().__init__(parent)
+        self.colors = colors
+        self.band_height = band_height
+        # thinner rows for many keypoints, so the strip doesn't take over the window
+        self.row_height = int(np.clip(32 // max(len(colors), 1), 1, 4))
+        self.setFixedHeight(2 * band_height + len(colors) * self.row_height)
+        self.store = None
+        self.histogram = None
+        self.image = None
+        self.pixels = None
+        self.framenum = 0
+
+    def set_store(self, store):
+        self.store = store
+        self.rebuild()
+
+    def rebuild(self):
+        self.histogram = None
+        self.image = None
+        if self.store is None or self.store.n_frames == 0 or self.width() == 0:
+            self.update()
+            return
+        self.histogram = TimelineHistogram(self.store, self.width())
+        # which bucket each pixel column shows; with fewer frames than pixels, frames span several columns
+        self.pixel_buckets = np.arange(self.width()) * self.histogram.n_buckets // self.width()
+        columns = self.histogram.render(np.arange(self.histogram.n_buckets), self.colors, self.band_height,
+                                        self.row_height)
+        self.pixels = np.ascontiguousarray(columns[:, self.pixel_buckets])
+        height, width = self.pixels.shape[:2]
+        # shares memory with self.pixels, so updating the array updates the image
+        self.image = QtGui.QImage(self.pixels.data, width, height, 3 * width, QtGui.QImage.Format_RGB888)
+        self.update()
+
+    @Slot(int)
+    def update_frame(self, framenum: int):
+        # after frame framenum was edited
+        if self.histogram is None:
+            return
+        bucket = self.histogram.get_bucket(framenum)
+        self.histogram.update_bucket(bucket)
+        x0 = int(np.searchsorted(self.pixel_buckets, bucket, side='left'))
+        x1 = int(np.searchsorted(self.pixel_buckets, bucket, side='right'))
+        self.pixels[:, x0:x1] = self.histogram.render(np.array([bucket]), self.colors, self.band_height,
+                                                      self.row_height)
+        self.update(x0, 0, x1 - x0, self.height())
+
+    def get_x(self, framenum: int) -> int:
+        return int((framenum + 0.5) * self.width() / max(self.store.n_frames, 1))
+
+    @Slot(int)
+    def set_position(self, framenum: int):
+        if self.store is None:
+            return
+        old_x = self.get_x(self.framenum)
+        self.framenum = framenum
+        self.update(old_x - 1, 0, 3, self.height())
+        self.update(self.get_x(framenum) - 1, 0, 3, self.height())
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        if self.image is None:
+            painter.fillRect(self.rect(), QColor(40, 40, 40))
+            return
+        painter.drawImage(event.rect(), self.image, event.rect())
+        painter.setPen(QPen(QColor(255, 255, 255), 1))
+        x = self.get_x(self.framenum)
+        painter.drawLine(x, 0, x, self.height())
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.rebuild()
+
+    def seek(self, x: float):
+        if self.store is None or self.store.n_frames == 0:
+            return
+        framenum = int(np.clip(x * self.store.n_frames // max(self.width(), 1), 0, self.store.n_frames - 1))
+        self.position.emit(framenum)
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            self.seek(event.pos().x())
+
+    def mouseMoveEvent(self, event):
+        if event.buttons() & Qt.LeftButton:
+            self.seek(event.pos().x())
+
+
+class ContrastWidget(QtWidgets.QGroupBox):
+    """Min/max and gamma controls for the display window of grayscale or high bit depth frames"""
+    window_changed = Signal(object)
+
+    def __init__(self, parent=None):
+        super().__init__('Contrast', parent)
+        self.max_level = 255
+
+        layout = QtWidgets.QFormLayout()
+        self.low = QtWidgets.QSlider(Qt.Horizontal)
+        self.high = QtWidgets.QSlider(Qt.Horizontal)
+        self.gamma = QtWidgets.QDoubleSpinBox()
+        self.gamma.setRange(0.1, 10.0)
+        self.gamma.setSingleStep(0.1)
+        self.gamma.setValue(1.0)
+        self.label = QLabel()
+        self.auto_button = QtWidgets.QPushButton('Auto')
+        self.reset_button = QtWidgets.QPushButton('Reset')
+        buttons = QtWidgets.QHBoxLayout()
+        buttons.addWidget(self.auto_button)
+        buttons.addWidget(self.reset_button)
+
+        layout.addRow('min', self.low)
+        layout.addRow('max', self.high)
+        layout.addRow('gamma', self.gamma)
+        layout.addRow(self.label)
+        layout.addRow(buttons)
+        self.setLayout(layout)
+        self.set_max_level(255)
+
+        self.low.valueChanged.connect(self.controls_changed)
+        self.high.valueChanged.connect(self.controls_changed)
+        self.gamma.valueChanged.connect(self.controls_changed)
+        self.reset_button.clicked.connect(self.reset)
+
+    def set_max_level(self, max_level: int):
+        # called for each new video; keeps the window if the bit depth is the same
+        if max_level == self.max_level and self.high.maximum() == max_level:
+            return
+        self.max_level = max_level
+        for slider in [self.low, self.high]:
+            slider.blockSignals(True)
+            slider.setRange(0, max_level)
+            slider.blockSignals(False)
+        self.reset()
+
+    def get_window(self) -> Window:
+        return Window(self.low.value(), self.high.value(), self.gamma.value())
+
+    def set_window(self, window: Window):
+        # moves the controls to window and emits it once, rather than once per control
+        for widget, value in zip([self.low, self.high, self.gamma], window):
+            widget.blockSignals(True)
+            widget.setValue(value)
+            widget.blockSignals(False)
+        self.controls_changed()
+
+    def reset(self):
+        self.set_window(Window(0, self.max_level, 1.0))
+
+    def controls_changed(self):
+        window = self.get_window()
+        self.label.setText('{} - {}'.format(window.low, window.high))
+        if window == Window(0, self.max_level, 1.0):
+            # no windowing at all, so 8 and 16-bit grayscale are shown natively
+            window = None
+        self.window_changed.emit(window)
+
+
 class VideoPlayer(QtWidgets.QWidget):
     # added parent here because python-uic, which turns Qt Creator files into python files, always adds the parent
     # widget. so instead of just saying self.videoPlayer = VideoPlayer(), it does
@@ -360,6 +999,14 @@ class VideoPlayer(QtWidgets.QWidget):
         # self.videoView.initialized.connect(initializer)
         self.videoView.frameNum.connect(self.scrollbartext.update_state)
 
+        # thumbnails while hovering over or dragging the scrollbar
+        self.thumbnail_popup = ThumbnailPopup(self)
+        self.videoView.initialized.connect(self.initialize_preview)
+        self.scrollbartext.horizontalScrollBar.hovered.connect(self.show_preview)
+        self.scrollbartext.preview.connect(self.show_preview)
+        self.scrollbartext.horizontalScrollBar.left.connect(self.hide_preview)
+        self.scrollbartext.horizontalScrollBar.sliderReleased.connect(self.hide_preview)
+
         # I have to do this here because I think emitting a signal doesn't work from within the widget's constructor
         if self.videoView.vid is not None:
             self.videoView.initialized.emit(len(self.videoView.vid))
@@ -368,76 +1015,174 @@ class VideoPlayer(QtWidgets.QWidget):
         self.scene = self.videoView.scene
         
         self.update()
+
+    @Slot(int)
+    def initialize_preview(self, nframes: int):
+        self.scrollbartext.preview_enabled = self.videoView.thumbnails is not None
+
+    @Slot(int)
+    def show_preview(self, framenum: int):
+        thumbnails = self.videoView.thumbnails
+        nearest = thumbnails.get_nearest(framenum) if thumbnails is not None else None
+        if nearest is None:
+            return
+        scrollbar = self.scrollbartext.horizontalScrollBar
+        x = scrollbar.mapFromGlobal(QtGui.QCursor.pos()).x()
+        bottom_center = scrollbar.mapToGlobal(QPoint(x, -4))
+        self.thumbnail_popup.show_thumbnail(nearest[0], nearest[1], self.videoView._photo.window, bottom_center)
+
+    def hide_preview(self):
+        self.thumbnail_popup.hide()
         
     
 
 
-class Keypoint(QtWidgets.QGraphicsEllipseItem):
-    def __init__(self, xyr=None, color=(255,0,0,255), parent=None):
+class KeypointsItem(QtWidgets.QGraphicsItem):
+    """Graphics item that paints every keypoint from one (n_instances * n_keypoints, 2) coordinate array
+
+    One item instead of one ellipse item per keypoint, so changing frames is an array update rather than a scene
+    update per keypoint. Updates are diffed against the current coordinates and only the areas of keypoints that
+    moved, appeared or disappeared are repainted. Pens and brushes are made once per keypoint color. Unplaced
+    keypoints are NaN. Coordinates are instance-major: keypoint k of instance i is row i * n_keypoints + k. Instances
+    other than the active one are drawn fainter.
+    """
+    pen_width = 2
+    # beyond this many changed keypoints, repaint the rect around all of them rather than one rect each
+    max_dirty_rects = 64
+    # with at least this many keypoints, hit-testing goes through a GridIndex
+    grid_min_points = 512
+    # beyond this many changed keypoints, e.g. on a frame change, the grid is rebuilt rather than updated
+    max_grid_updates = 64
+
+    def __init__(self, colors: np.ndarray, radius: float, n_instances: int = 1, parent=None):
         super().__init__(parent)
-        
-        self.xyr = xyr
-        
-        # self.radius = 30
-        self.line_color = QColor(*color)
-        self.face_color = QColor(color[0], color[1], color[2], int(color[3]*0.3))
-        
-        if self.xyr is not None:
-            self.cx = self.xyr[0]
-            self.cy = self.xyr[1]
-            self.radius = self.xyr[2]
-            self.draw(self.cx, self.cy, self.radius)
-        else:
-            self.cx = None
-            self.cy = None
-            self.radius = None
-        # self.ItemIsMovable()
-        self.setFlag(QtWidgets.QGraphicsItem.ItemIsMovable, False)
-        self.setFlag(QtWidgets.QGraphicsItem.ItemIsSelectable, False)
-        self.setFlag(QtWidgets.QGraphicsItem.ItemIsFocusable)
-        
-        self.pen = QPen(self.line_color, 2, Qt.SolidLine, Qt.FlatCap, Qt.MiterJoin)
-        self.brush = QBrush(self.face_color)
-        self.setBrush(self.brush)
-        # self.painter = QPainter()
-        # self.painter.setBrush(self.brush)
-        # self.setPainter
-        self.setPen(self.pen)
-        
-    def set_coords(self, cx, cy, r):
-        if cx != cx or cy != cy:
+        self.n_keypoints = len(colors)
+        self.coords = np.full((n_instances * self.n_keypoints, 2), np.nan, dtype=np.float32)
+        self.radii = np.full(len(self.coords), radius, dtype=np.float32)
+        self.pens = [QPen(QColor(*color), self.pen_width, Qt.SolidLine, Qt.FlatCap, Qt.MiterJoin)
+                     for color in colors]
+        self.brushes = [QBrush(QColor(color[0], color[1], color[2], int(color[3] * 0.3))) for color in colors]
+        self.inactive_pens = [QPen(QColor(*color), self.pen_width / 2, Qt.DashLine, Qt.FlatCap, Qt.MiterJoin)
+                              for color in colors]
+        self.inactive_brushes = [QBrush(QColor(color[0], color[1], color[2], int(color[3] * 0.1))) for color in colors]
+        self.active_instance = 0
+        # only grows, so keypoints moving within it don't need prepareGeometryChange
+        self.bounds = QtCore.QRectF()
+        # built on the first hit-test, then kept up to date as keypoints move
+        self.grid = None
+        # for exposedRect
+        self.setFlag(QtWidgets.QGraphicsItem.ItemUsesExtendedStyleOption)
+
+    def boundingRect(self):
+        return self.bounds
+
+    def get_rect(self, index: int) -> QtCore.QRectF:
+        # area keypoint index covers, including its outline
+        x, y = self.coords[index]
+        extent = float(self.radii[index]) + self.pen_width
+        return QtCore.QRectF(x - extent, y - extent, 2 * extent, 2 * extent)
+
+    def get_extent(self, indices: np.ndarray):
+        # rect around the given keypoints and their outlines, or None if none of them are placed
+        coords = self.coords[indices]
+        placed = np.isfinite(coords).all(axis=1)
+        if not placed.any():
+            return None
+        coords = coords[placed]
+        extent = self.radii[indices][placed, None] + self.pen_width
+        x0, y0 = (coords - extent).min(axis=0)
+        x1, y1 = (coords + extent).max(axis=0)
+        return QtCore.QRectF(float(x0), float(y0), float(x1 - x0), float(y1 - y0))
+
+    def get_dirty_rects(self, indices: np.ndarray) -> list:
+        if len(indices) > self.max_dirty_rects:
+            extent = self.get_extent(indices)
+            return [] if extent is None else [extent]
+        return [self.get_rect(i) for i in indices if np.isfinite(self.coords[i]).all()]
+
+    def paint(self, painter, option, widget=None):
+        exposed = option.exposedRect
+        x, y = self.coords[:, 0], self.coords[:, 1]
+        extent = self.radii + self.pen_width
+        with np.errstate(invalid='ignore'):
+            # NaNs compare False, so unplaced keypoints drop out here
+            indices = np.flatnonzero((x + extent >= exposed.left()) & (x - extent <= exposed.right()) &
+                                     (y + extent >= exposed.top()) & (y - extent <= exposed.bottom()))
+        for i, x, y, radius in zip(indices.tolist(), x[indices].tolist(), y[indices].tolist(),
+                                   self.radii[indices].tolist()):
+            instance, keypoint = divmod(i, self.n_keypoints)
+            if instance == self.active_instance:
+                painter.setPen(self.pens[keypoint])
+                painter.setBrush(self.brushes[keypoint])
+            else:
+                painter.setPen(self.inactive_pens[keypoint])
+                painter.setBrush(self.inactive_brushes[keypoint])
+            painter.drawEllipse(QtCore.QPointF(x, y), radius, radius)
+
+    def set_active_instance(self, instance: int):
+        if instance != self.active_instance:
+            self.active_instance = instance
+            self.update()
+
+    def set_coords(self, coords: np.ndarray, radii: np.ndarray = None):
+        # replaces every keypoint, repainting only the ones that changed
+        coords = np.asarray(coords, dtype=np.float32)
+        radii = self.radii if radii is None else np.asarray(radii, dtype=np.float32)
+        same = (coords == self.coords) | (np.isnan(coords) & np.isnan(self.coords))
+        changed = np.flatnonzero(~same.all(axis=1) | (radii != self.radii))
+        if len(changed) == 0:
             return
-        self.cx = cx
-        self.cy = cy
-        self.radius = r
-        # print(cx, cy, r)
-        self.draw(self.cx, self.cy, self.radius)
-        
-    def draw(self, cx, cy, r):        
-        # painter = QPainter()
-        self.setRect(cx - r, cy - r, r*2, r*2)
-        self.setVisible(True)
-        # print(self.isVisible())
-        # painter.drawEllipse(x, y, self.radius, self.radius)
-        
+        # where the changed keypoints were, and where they are now
+        dirty = self.get_dirty_rects(changed)
+        self.coords[changed] = coords[changed]
+        self.radii[changed] = radii[changed]
+        if self.grid is not None:
+            if len(changed) <= self.max_grid_updates and self.radii.max() <= self.grid.cell_size:
+                self.grid.update(changed, self.coords)
+            else:
+                # rebuilt on the next hit-test
+                self.grid = None
+        extent = self.get_extent(changed)
+        if extent is not None and not self.bounds.contains(extent):
+            self.prepareGeometryChange()
+            self.bounds = self.bounds.united(extent)
+        for rect in dirty + self.get_dirty_rects(changed):
+            self.update(rect)
+
+    def find_keypoint(self, x: float, y: float):
+        # the keypoint nearest (x, y), if (x, y) is inside its radius. otherwise None
+        candidates = None
+        if len(self.coords) >= self.grid_min_points:
+            if self.grid is None:
+                # cells as big as the largest keypoint, so the 3x3 cells around a click hold every keypoint it can hit
+                self.grid = GridIndex(self.coords, max(float(self.radii.max()), 1.0))
+            candidates = self.grid.query(x, y)
+        return find_nearest(self.coords, self.radii, x, y, candidates)
+
+    def set_point(self, index: int, x: float, y: float, radius: float = None):
+        coords = self.coords.copy()
+        coords[index] = x, y
+        radii = self.radii.copy()
+        if radius is not None:
+            radii[index] = radius
+        self.set_coords(coords, radii)
+
+    def clear_point(self, index: int):
+        self.set_point(index, np.nan, np.nan)
+
     def clear(self):
-        # debug
-        # self.cx = 100
-        # self.cy = 100
-        # self.radius = 20
-        # self.draw(self.cx, self.cy, self.radius)
-        self.cx = None
-        self.cy = None
-        self.setVisible(False)
-    
+        self.set_coords(np.full(self.coords.shape, np.nan, dtype=np.float32))
 
 
 class KeypointGroup(QtWidgets.QWidget):
     selected = Signal(int)
-    data = Signal(dict)
+    instance_selected = Signal(int)
+    # (n_instances, n_keypoints, 2), NaN for unplaced keypoints
+    data = Signal(object)
     
     def __init__(self, keypoint_dict, scene, parent=None, colormap:str='viridis', radius=20, 
-                 text_over_mouse=True, click_type_to_add_keypoint='right'):
+                 text_over_mouse=True, click_type_to_add_keypoint='right', drag_update_hz=0, print_latency=False,
+                 n_instances: int = 1):
         super().__init__(parent)
         
         self.cmap = plt.get_cmap(colormap)
@@ -445,14 +1190,15 @@ class KeypointGroup(QtWidgets.QWidget):
         colors = plt.get_cmap(colormap)(np.linspace(0, 1, len(keypoint_dict)))
         self.colors = (colors*255).clip(0, 255).astype(np.uint8)
         
-        self.keypoints = {}
         self.keys = list(keypoint_dict.keys())
-        
-        for i, (key, value) in enumerate(keypoint_dict.items()):
-            self.keypoints[key] = Keypoint(color=self.colors[i])
-            
-        self.N = len(self.keypoints)
+        self.key_index = {key: i for i, key in enumerate(self.keys)}
+        self.N = len(self.keys)
+        self.n_instances = n_instances
+        # the instance that clicks place keypoints for, e.g. which animal
+        self.instance = 0
         self.radius = radius
+        # every keypoint of every instance is painted by this one item
+        self.item = KeypointsItem(self.colors, radius, n_instances)
         self.add_to_scene(scene)
         self.index = 0
         self.key = None
@@ -461,6 +1207,14 @@ class KeypointGroup(QtWidgets.QWidget):
         self.tmp_selected = None
         self.text_over_mouse = text_over_mouse
         self.click_type_to_add_keypoint = click_type_to_add_keypoint
+        # while dragging, only the graphics item moves. data is broadcast on release, plus at most drag_update_hz
+        # times per second during the drag. None broadcasts on every mouse move
+        self.drag_update_interval = None if drag_update_hz is None else (
+            float('inf') if drag_update_hz <= 0 else 1 / drag_update_hz)
+        self.last_broadcast = 0.0
+        self.dragged = False
+        self.print_latency = print_latency
+        self.move_latency = LatencyCounter('drag move')
         self.set_data(keypoint_dict)
         self.text = None
         self.update_text()
@@ -468,36 +1222,50 @@ class KeypointGroup(QtWidgets.QWidget):
         # self.scene.viewport().installEventFilter(self)
             
     def broadcast_data(self):
-        array = self.get_keypoint_coords()
-        data = {self.keys[i]: array[i] for i in range(len(self.keys))}
-        self.data.emit(data)
+        self.data.emit(self.get_keypoint_coords())
+
+    def get_flat_index(self, index: int) -> int:
+        # row of keypoint index of the current instance in the item's coordinates
+        return self.instance * self.N + index
         
-    def set_data(self, data: dict):
+    def get_coords_from_dict(self, data: dict):
+        # item coordinates and radii with the current instance's keypoints from data, and which keypoints data placed
+        coords = self.item.coords.copy()
+        radii = self.item.radii.copy()
+        placed = np.zeros(len(coords), dtype=bool)
         for key, value in data.items():
-            if value is None:
-                continue
-            elif isinstance(value, list) and len(value) == 0:
+            if value is None or len(value) == 0 or value[0] != value[0] or value[1] != value[1]:
                 continue
-            else:
-                if len(value) == 2:
-                    value = (value[0], value[1], self.radius)
-                self.keypoints[key].set_coords(*value)
+            index = self.get_flat_index(self.key_index[key])
+            coords[index] = value[:2]
+            radii[index] = value[2] if len(value) > 2 else self.radius
+            placed[index] = True
+        return coords, radii, placed
+
+    def set_data(self, data: dict):
+        # places the keypoints in data, leaving the others where they are
+        coords, radii, placed = self.get_coords_from_dict(data)
+        self.item.set_coords(np.where(placed[:, None], coords, self.item.coords), radii)
+
+    def set_frame(self, coords: np.ndarray):
+        # replaces every keypoint of every instance with (n_instances, n_keypoints, 2) coords, e.g. on a frame change.
+        # only keypoints that differ are redrawn
+        self.item.set_coords(np.asarray(coords, dtype=np.float32).reshape(-1, 2))
+
+    def select_first_unplaced(self):
+        # the first keypoint of the current instance that isn't placed yet, or the last one if all of them are
+        coords = self.get_keypoint_coords()[self.instance]
+        unplaced = np.flatnonzero(np.isnan(coords).any(axis=1))
+        self.set_selected(int(unplaced[0]) if len(unplaced) > 0 else self.N - 1)
             
     def add_to_scene(self, scene):
-        # print('add to scene')
-        for key, value in self.keypoints.items():
-            scene.addItem(value)
+        scene.addItem(self.item)
             
     def remove_from_scene(self):
-        # print('remove from scene')
-        for key, value in self.keypoints.items():
-            self.scene.removeItem(value)
+        self.scene.removeItem(self.item)
             
     def clear_data(self):
-        # self.remove_from_scene()
-        for i, key in enumerate(self.keys):
-            self.keypoints[key].clear()
-        # self.broadcast_data()
+        self.item.clear()
         
     def increment_selected(self):
         self.set_selected(self.index + 1)
@@ -506,7 +1274,23 @@ class KeypointGroup(QtWidgets.QWidget):
         self.set_selected(self.index - 1)
         
     def clear_selected(self):
-        self.get_keypoint(self.index).clear()
+        self.item.clear_point(self.get_flat_index(self.index))
+
+    def increment_instance(self):
+        self.set_instance(self.instance + 1)
+
+    def decrement_instance(self):
+        self.set_instance(self.instance - 1)
+
+    @Slot(int)
+    def set_instance(self, instance: int):
+        if instance < 0 or instance >= self.n_instances or instance == self.instance:
+            return
+        self.instance = instance
+        self.item.set_active_instance(instance)
+        self.instance_selected.emit(self.instance)
+        self.select_first_unplaced()
+        self.update_text()
             
     @Slot(int)
     def set_selected(self, index: int):
@@ -531,16 +1315,17 @@ class KeypointGroup(QtWidgets.QWidget):
         self.key = self.keys[self.index]
         if not self.text_over_mouse:
             return
+        label = self.key if self.n_instances == 1 else '{} ({})'.format(self.key, self.instance)
         color = self.colors[self.index]
         line_color = QColor(color[0], color[1], color[2], color[3])
         face_color = QColor(color[0], color[1], color[2], int(color[3]*0.3))
         pen = QPen(line_color, 0.5, Qt.SolidLine, Qt.FlatCap, Qt.MiterJoin)
         brush = QBrush(face_color)
         if self.text is None:
-            self.text = QtWidgets.QGraphicsSimpleTextItem(self.key)
+            self.text = QtWidgets.QGraphicsSimpleTextItem(label)
             self.scene.addItem(self.text)
 
-        self.text.setText(self.key)
+        self.text.setText(label)
         self.text.setBrush(brush)
         self.text.setPen(pen)
     
@@ -548,9 +1333,7 @@ class KeypointGroup(QtWidgets.QWidget):
         pos = event.scenePos()
         x, y = pos.x(), pos.y()
         
-        key = self.keys[self.index]
-        # self.keypoints[key].setRect(x, y, self.radius, self.radius)
-        self.keypoints[key].set_coords(x,y, self.radius)
+        self.item.set_point(self.get_flat_index(self.index), x, y, self.radius)
         self.broadcast_data()
         
         # print(x,y)
@@ -558,36 +1341,14 @@ class KeypointGroup(QtWidgets.QWidget):
         
     def move_keypoint(self, event):
         pos = event.scenePos()
-        x, y = pos.x(), pos.y()
-        dists = self.get_distance_to_keypoints(x, y)
-        
-        if np.mean(np.isnan(dists)) > 0.99:
-            return
-        
-        min_ind = np.nanargmin(dists)
-        min_dist = dists[min_ind]
-        keypoint = self.get_keypoint(min_ind)
-        if min_dist < keypoint.radius and keypoint.isVisible():
-            self.tmp_selected = min_ind
-            # self.set_selected(min_ind)
-            # print('inside')    
-        # else:
-        #     print('not close')
+        index = self.item.find_keypoint(pos.x(), pos.y())
+        if index is not None:
+            # keypoints of every instance can be grabbed. grabbing one makes its instance the current one
+            self.set_instance(index // self.N)
+            self.tmp_selected = index
     
     def get_keypoint_coords(self):
-        coords = []
-        for i, (key, value) in enumerate(self.keypoints.items()):
-            x, y = value.cx, value.cy
-            if x is None or y is None:
-                x, y = np.nan, np.nan
-            coords.append([x,y])
-        coords = np.array(coords).astype(np.float32)
-        return coords
-    
-    def get_distance_to_keypoints(self, x, y):
-        coords = self.get_keypoint_coords()
-        dists = np.sqrt((coords[:, 0] - x)**2 + (coords[:, 1] - y)**2)
-        return dists
+        return self.item.coords.reshape(self.n_instances, self.N, 2).copy()
     
     @Slot(QtGui.QMouseEvent)
     def receive_click(self, event):
@@ -614,8 +1375,14 @@ class KeypointGroup(QtWidgets.QWidget):
             if self.tmp_selected is None:
                 return
 
-            self.keypoints[self.keys[self.tmp_selected]].set_coords(x, y, self.radius)
-            self.broadcast_data()
+            start = self.move_latency.start()
+            self.item.set_point(self.tmp_selected, x, y, self.radius)
+            self.dragged = True
+            if self.drag_update_interval is None or start - self.last_broadcast >= self.drag_update_interval:
+                self.broadcast_data()
+                self.last_broadcast = start
+                self.dragged = False
+            self.move_latency.stop(start)
         if self.text_over_mouse:
             if self.text is not None:
                 # print(x, y)
@@ -624,33 +1391,34 @@ class KeypointGroup(QtWidgets.QWidget):
     
     @Slot(QtGui.QMouseEvent)
     def receive_release(self, event):
+        # commit the end of a drag in one update
+        if self.dragged:
+            self.broadcast_data()
+            self.dragged = False
         self.tmp_selected = None
-        
-    def get_keypoint(self, index): 
-        if index < 0:
-            warnings.warn('index below zero, bug somewhere')
-            return
-        elif index > self.N:
-            warnings.warn('index > len(keypoints)')
-            return
-        elif index == self.N:
-            # happens when you click the final keypoint; tries to increment above the total number
-            return
-        
-        key = self.keys[index]
-        return self.keypoints[key]
+        if self.print_latency and self.move_latency.count > 0:
+            print(self.move_latency)
+            self.move_latency.reset()
 
 
 class KeypointButtons(QtWidgets.QWidget):
     selected = Signal(int)
+    instance_selected = Signal(int)
     
-    def __init__(self, keypoint_list, colormap: str='viridis',parent=None):
+    def __init__(self, keypoint_list, colormap: str='viridis', n_instances: int = 1, parent=None):
         super().__init__(parent)
         
         colors = plt.get_cmap(colormap)(np.linspace(0, 1, len(keypoint_list)))
         self.colors = (colors*255).clip(0, 255).astype(np.uint8)
         
         self.layout = QVBoxLayout(self)
+        # only shown with more than one instance
+        self.instance_box = None
+        if n_instances > 1:
+            self.instance_box = QtWidgets.QComboBox()
+            self.instance_box.addItems(['instance {}'.format(i) for i in range(n_instances)])
+            self.instance_box.currentIndexChanged.connect(self.instance_changed)
+            self.layout.addWidget(self.instance_box)
         self.button_group = QtWidgets.QButtonGroup(self)
         self.button_group.setExclusive(True)
         
@@ -702,6 +1470,14 @@ class KeypointButtons(QtWidgets.QWidget):
         self.buttons[self.index].setChecked(True)
         self.selected.emit(self.index)
 
+    def instance_changed(self, instance: int):
+        self.instance_selected.emit(instance)
+
+    @Slot(int)
+    def set_instance(self, instance: int):
+        if self.instance_box is not None and self.instance_box.currentIndex() != instance:
+            self.instance_box.setCurrentIndex(instance)
+
         
 
 def simple_popup_question(parent, message: str):
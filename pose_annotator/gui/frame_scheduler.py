@@ -0,0 +1,73 @@
+import threading
+import time
+import traceback
+
+from PySide2 import QtCore
+from PySide2.QtCore import Signal
+
+
+class FrameScheduler(QtCore.QObject):
+    """Decodes requested frames on a worker thread, latest request wins
+
+    Requests that arrive while a frame is decoding or waiting to be shown replace each other, so holding an arrow
+    key or dragging the scrollbar never builds a backlog: the next frame decoded is always the most recent one
+    asked for. Only one decoded frame is handed to the GUI at a time; the GUI calls frame_shown() once it has painted
+    it, which bounds input-to-display latency to one decode plus one paint.
+    """
+    # framenum, frame, time.perf_counter() when it was requested
+    ready = Signal(int, object, float)
+    failed = Signal(int, str)
+
+    def __init__(self, source, transform=None, parent=None):
+        super().__init__(parent)
+        # anything indexable by frame number. only this scheduler's thread reads from it
+        self.source = source
+        # applied to every frame on this thread before it's handed to the GUI, e.g. downsampling for display
+        self.transform = transform
+        self.condition = threading.Condition()
+        self.latest = None
+        self.awaiting_display = False
+        self.stopped = False
+        self.n_requested = 0
+        self.n_skipped = 0
+        self.thread = threading.Thread(target=self.run, name='FrameScheduler', daemon=True)
+        self.thread.start()
+
+    def request(self, framenum: int):
+        with self.condition:
+            if self.latest is not None:
+                self.n_skipped += 1
+            self.latest = (framenum, time.perf_counter())
+            self.n_requested += 1
+            self.condition.notify_all()
+
+    def frame_shown(self):
+        with self.condition:
+            self.awaiting_display = False
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.stopped and (self.latest is None or self.awaiting_display):
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                (framenum, requested_at), self.latest = self.latest, None
+                self.awaiting_display = True
+            try:
+                frame = self.source[framenum]
+                if self.transform is not None:
+                    frame = self.transform(frame)
+            except Exception as e:
+                traceback.print_exc()
+                self.frame_shown()
+                self.failed.emit(framenum, str(e))
+                continue
+            self.ready.emit(framenum, frame, requested_at)
+
+    def close(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.thread.join()
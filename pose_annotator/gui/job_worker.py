@@ -0,0 +1,41 @@
+import threading
+import traceback
+from typing import Callable
+
+from PySide2 import QtCore
+from PySide2.QtCore import Signal
+
+
+class JobWorker(QtCore.QObject):
+    """Runs one long job, e.g. making a proxy, on its own thread
+
+    The job is called with a progress(n_done, n_total) keyword argument, which emits `progressed`. Signals are queued
+    back to the GUI thread, so the GUI stays responsive without the job ever running on it or pumping its events.
+    The job's return value is in `result` when `finished` is emitted; if it raised, `error` is set instead.
+    """
+    progressed = Signal(int, int)
+    finished = Signal()
+
+    def __init__(self, function: Callable, *args, parent=None, **kwargs):
+        super().__init__(parent)
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.result = None
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name='JobWorker', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def progress(self, n_done: int, n_total: int):
+        self.progressed.emit(int(n_done), int(n_total))
+
+    def run(self):
+        try:
+            self.result = self.function(*self.args, progress=self.progress, **self.kwargs)
+        except Exception as e:
+            traceback.print_exc()
+            self.error = e
+        finally:
+            self.finished.emit()
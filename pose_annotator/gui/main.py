@@ -1,5 +1,4 @@
 from collections import OrderedDict
-from copy import deepcopy
 from functools import partial
 import os
 import sys
@@ -12,11 +11,22 @@ import pandas as pd
 from PySide2 import QtCore, QtWidgets, QtGui
 
 from pose_annotator.gui.mainwindow import Ui_MainWindow
-from pose_annotator.gui.custom_widgets import KeypointGroup, KeypointButtons, simple_popup_question
-from pose_annotator import utils
+from pose_annotator.contrast import Window, auto_window, get_max_level
+from pose_annotator.frame_selection import get_frame_list_filename, read_frame_list, select_frames, write_frame_list
+from pose_annotator.gui.custom_widgets import (ContrastWidget, KeypointGroup, KeypointButtons, TimelineWidget,
+                                               simple_popup_question)
+from pose_annotator.gui.job_worker import JobWorker
+from pose_annotator.gui.save_worker import SaveWorker, SaveJob
+from pose_annotator.image_sequence import align_to_image_names, legacy_sort
+from pose_annotator.journal import EditJournal, get_journal_filename
+from pose_annotator.proxy import find_proxy, make_proxy
+from pose_annotator.store import EMPTY, LABELED, PARTIAL, make_store
+from pose_annotator.tiles import load_image
 
 image_endings = ['.png', '.jpg', '.tiff', '.tif', '.bmp']
 video_endings = ['.mov', '.mp4', '.avi']
+# stacks of frames, opened memory-mapped where possible
+array_endings = ['.npy', '.h5', '.hdf5']
 
 
 class MainWindow(QtWidgets.QMainWindow):
@@ -31,6 +41,20 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.player = self.ui.widget
         self.player.videoView.resize_on_each_frame = self.cfg.resize_on_each_frame
+        self.player.videoView.frame_cache_kwargs = OmegaConf.to_container(self.cfg.frame_cache)
+        self.player.videoView.backend = self.cfg.backend
+        self.player.videoView.print_latency = self.cfg.print_latency
+        self.player.videoView.display_max_size = self.cfg.display.max_size
+        self.player.videoView.tile_megapixels = self.cfg.tiles.min_megapixels
+        self.player.videoView.tile_memory_mb = self.cfg.tiles.memory_mb
+        self.player.videoView.thumbnail_kwargs = None
+        if self.cfg.thumbnails.use:
+            self.player.videoView.thumbnail_kwargs = {'size': self.cfg.thumbnails.size,
+                                                      'max_count': self.cfg.thumbnails.max_count,
+                                                      'idle_s': self.cfg.thumbnails.idle_s}
+        self.player.videoView.tile_kwargs = {'cache_dir': self.cfg.tiles.cache_dir,
+                                             'tile_size': self.cfg.tiles.tile_size,
+                                             'max_disk_gb': self.cfg.tiles.disk_gb}
         # for convenience
         self.scene = self.player.scene
 
@@ -44,11 +68,24 @@ class MainWindow(QtWidgets.QMainWindow):
                                        parent=self.player,
                                        colormap=self.cfg.viz.colormap,
                                        radius=self.cfg.viz.radius,
-                                       click_type_to_add_keypoint=self.cfg.click_type_to_add_keypoint)
+                                       click_type_to_add_keypoint=self.cfg.click_type_to_add_keypoint,
+                                       drag_update_hz=self.cfg.drag_update_hz,
+                                       print_latency=self.cfg.print_latency,
+                                       n_instances=self.cfg.instances)
 
-        self.keypoint_selector = KeypointButtons(keys, colormap=cfg.viz.colormap, parent=self)
+        self.keypoint_selector = KeypointButtons(keys, colormap=cfg.viz.colormap, n_instances=self.cfg.instances,
+                                                 parent=self)
         self.ui.verticalLayout_2.addWidget(self.keypoint_selector)
 
+        # where the labels are, between the video and the scrollbar
+        self.timeline = TimelineWidget(self.keypoints.colors, parent=self.player)
+        self.player.layout().insertWidget(1, self.timeline)
+
+        self.contrast = ContrastWidget(parent=self)
+        self.ui.verticalLayout.addWidget(self.contrast)
+        self.contrast.window_changed.connect(self.player.videoView.set_window)
+        self.contrast.auto_button.clicked.connect(self.auto_contrast)
+
         # should do this somewhere else
         self.ui.keypoints_box.setStyleSheet('QGroupBox {background-color: rgb(80,80,80)}'
                                             'QGroupBox::title {background: transparent}')
@@ -65,17 +102,23 @@ class MainWindow(QtWidgets.QMainWindow):
         # these link the keypoint click area with the toolbar on the left
         self.keypoint_selector.selected.connect(self.keypoints.set_selected)
         self.keypoints.selected.connect(self.keypoint_selector.set_selected)
+        self.keypoint_selector.instance_selected.connect(self.keypoints.set_instance)
+        self.keypoints.instance_selected.connect(self.keypoint_selector.set_instance)
         self.player.videoView.frameNum.connect(self.update_framenum)
+        self.player.videoView.frameNum.connect(self.timeline.set_position)
+        self.timeline.position.connect(self.player.videoView.update_frame)
 
         # menu buttons
         self.ui.actionOpen_image.triggered.connect(self.open_image_file)
         self.ui.actionOpen_image_directory.triggered.connect(self.open_image_directory)
         self.ui.actionOpen_video.triggered.connect(self.open_video)
-        self.ui.actionSave.triggered.connect(self.save)
+        self.ui.actionSave.triggered.connect(lambda: self.save())
+        self.select_frames_action = self.ui.menuFile.addAction('Select frames to label')
+        self.select_frames_action.triggered.connect(self.select_frames_to_label)
 
         # hotkeys
         save_shortcut = QtWidgets.QShortcut(QtGui.QKeySequence('Ctrl+S'), self)
-        save_shortcut.activated.connect(self.save)
+        save_shortcut.activated.connect(lambda: self.save())
         nextframe_shortcut = QtWidgets.QShortcut(QtGui.QKeySequence('Right'), self)
         nextframe_shortcut.activated.connect(self.player.videoView.next_frame)
         prevframe_shortcut = QtWidgets.QShortcut(QtGui.QKeySequence('Left'), self)
@@ -90,19 +133,44 @@ class MainWindow(QtWidgets.QMainWindow):
         delete_shortcut.activated.connect(self.keypoints.clear_selected)
         backspace_shortcut = QtWidgets.QShortcut(QtGui.QKeySequence('Backspace'), self)
         backspace_shortcut.activated.connect(self.keypoints.clear_selected)
-
-        self.data = []
+        next_instance_shortcut = QtWidgets.QShortcut(QtGui.QKeySequence(']'), self)
+        next_instance_shortcut.activated.connect(self.keypoints.increment_instance)
+        previous_instance_shortcut = QtWidgets.QShortcut(QtGui.QKeySequence('['), self)
+        previous_instance_shortcut.activated.connect(self.keypoints.decrement_instance)
+        # jump to the next / previous frame with any keypoints, with some keypoints missing, or with none
+        for modifier, statuses in [('Ctrl', (PARTIAL, LABELED)), ('Shift', PARTIAL), ('Alt', EMPTY)]:
+            for arrow, forward in [('Right', True), ('Left', False)]:
+                shortcut = QtWidgets.QShortcut(QtGui.QKeySequence('{}+{}'.format(modifier, arrow)), self)
+                shortcut.activated.connect(partial(self.jump_to_status, statuses, forward))
+        # step through the frames picked by select-frames
+        next_selected_shortcut = QtWidgets.QShortcut(QtGui.QKeySequence('PgDown'), self)
+        next_selected_shortcut.activated.connect(partial(self.jump_to_selected, True))
+        previous_selected_shortcut = QtWidgets.QShortcut(QtGui.QKeySequence('PgUp'), self)
+        previous_selected_shortcut.activated.connect(partial(self.jump_to_selected, False))
+
+        self.data = make_store(self.cfg.store, keys, 0, self.cfg.instances)
         self.saved = True
         self.framenum = 0
         self.save_loc = None
         # self.initialize_save_loc()
         self.save_filename = None
+        # set when the csv has keypoints or instances the config can't hold, so saving would lose them
+        self.read_only = False
+        self.journal = None
+        # sorted frame numbers to label, from select-frames
+        self.frame_list = np.zeros(0, dtype=np.int64)
+        # incremented on every edit, so we know whether a finished background save is up to date
+        self.generation = 0
+        self.saver = SaveWorker(debounce=cfg.save_debounce_ms / 1000, parent=self)
+        self.saver.finished.connect(self.handle_saved)
+        self.saver.failed.connect(self.handle_save_failed)
+        self.player.videoView.frame_failed.connect(self.handle_frame_failed)
         if cfg.path is not None:
             assert os.path.exists(cfg.path)
             ending = os.path.splitext(cfg.path)[1]
             if ending.lower() in image_endings:
                 filetype = 'image'
-            elif ending.lower() in video_endings:
+            elif ending.lower() in video_endings + array_endings:
                 filetype = 'video'
             elif os.path.isdir(cfg.path):
                 filetype = 'video'
@@ -143,7 +211,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.initialize_new_file(filename, 'image')
 
     def open_video(self):
-        filestring = 'VideoReader files (*.h5 *.avi *.mp4 *.png *.jpg *.mov)'
+        filestring = 'Video files (*.avi *.mp4 *.mov *.h5 *.hdf5 *.npy)'
         prompt = 'Click a video file to open'
         filename = self.open_file_browser(filestring, prompt, 'file')
 
@@ -159,31 +227,106 @@ class MainWindow(QtWidgets.QMainWindow):
     def initialize_new_file(self, filename, filetype):
         self.prompt_for_save()
 
-        # hack for startup: we will open on frame zero, so have to have a 1-element list when initialize-image or
+        image = None
+        if filetype == 'image':
+            # closed first: a stale pyramid of this image may be rebuilt in place
+            self.player.videoView.close_video()
+            image = self.run_job('Opening {}'.format(os.path.basename(filename)), load_image, filename,
+                                 self.cfg.tiles.min_megapixels, **self.player.videoView.tile_kwargs)
+            if image is None:
+                return
+
+        # hack for startup: we will open on frame zero, so have to have a 1-frame store when initialize-image or
         # initialize-video is called, because that will trigger the "update_framenum" slot
-        self.data = [deepcopy(self.keypoint_dict) for i in range(1)]
+        self.data = make_store(self.cfg.store, self.keypoint_dict.keys(), 1, self.cfg.instances)
 
         if filetype == 'image':
-            self.player.videoView.initialize_image(filename)
-            N = 1
+            self.player.videoView.initialize_image(filename, image)
         elif filetype == 'video':
-            self.player.videoView.initialize_video(filename)
-            N = len(self.player.videoView.vid)
+            self.player.videoView.initialize_video(filename, proxy_file=self.get_proxy(filename))
         else:
             raise ValueError('unknown file type: {}'.format(filetype))
+        N = len(self.player.videoView.vid)
+        self.initialize_contrast()
 
         save_loc = self.get_save_loc()
         if save_loc is None:
             save_loc = os.path.dirname(filename)
 
         self.save_filename = os.path.join(save_loc, os.path.splitext(os.path.basename(filename))[0] + '_keypoints.csv')
-        self.data = [deepcopy(self.keypoint_dict) for i in range(N)]
+        self.data = make_store(self.cfg.store, self.keypoint_dict.keys(), N, self.cfg.instances)
+        self.read_only = False
         if os.path.isfile(self.save_filename):
             self.load(self.save_filename)
 
-    def initialize_keypoint_group(self, keypoints: dict):
-        self.clear_keypoints()
-        self.keypoints.set_data(keypoints)
+        # edits that were journaled but never compacted into the csv, e.g. because of a crash
+        self.journal = EditJournal(get_journal_filename(self.save_filename), self.data.keys, self.data.n_instances)
+        n_replayed = self.journal.replay(self.data)
+        if n_replayed > 0:
+            print('replayed {} edits from {}'.format(n_replayed, self.journal.filename))
+            self.saved = False
+            self.update_framenum(0, force=True)
+        self.timeline.set_store(self.data)
+
+        frame_list_filename = get_frame_list_filename(filename)
+        self.frame_list = np.zeros(0, dtype=np.int64)
+        if os.path.isfile(frame_list_filename):
+            self.frame_list = read_frame_list(frame_list_filename)
+            print('{} frames to label from {}'.format(len(self.frame_list), frame_list_filename))
+
+    def initialize_contrast(self):
+        vid = self.player.videoView.vid
+        self.contrast.set_max_level(get_max_level(vid.dtype))
+        cfg = self.cfg.contrast
+        if cfg.low is not None or cfg.high is not None or cfg.gamma != 1:
+            low = cfg.low if cfg.low is not None else 0
+            high = cfg.high if cfg.high is not None else self.contrast.max_level
+            self.contrast.set_window(Window(low, high, cfg.gamma))
+
+    def auto_contrast(self):
+        frame = self.player.videoView.get_contrast_sample()
+        if frame is not None:
+            self.contrast.set_window(auto_window(frame, gamma=self.contrast.gamma.value()))
+
+    def get_proxy(self, videofile):
+        if not self.cfg.proxy.use or os.path.splitext(videofile)[1].lower() not in video_endings:
+            return None
+        proxyfile = find_proxy(videofile)
+        if proxyfile is None and self.cfg.proxy.ask:
+            if simple_popup_question(self, 'Make an intra-frame proxy of this video for faster seeking? '
+                                           'This only needs to happen once, but can take a while.'):
+                proxyfile = self.make_proxy(videofile)
+        return proxyfile
+
+    def run_job(self, label: str, function, *args, **kwargs):
+        # runs function on a worker thread behind a modal progress dialog, and returns its result, or None if it failed
+        dialog = QtWidgets.QProgressDialog(label, None, 0, 1, self)
+        dialog.setWindowModality(QtCore.Qt.WindowModal)
+        dialog.setMinimumDuration(0)
+        worker = JobWorker(function, *args, parent=self, **kwargs)
+        def progress(n_done, n_total):
+            dialog.setMaximum(n_total)
+            dialog.setValue(n_done)
+
+        worker.progressed.connect(progress, QtCore.Qt.QueuedConnection)
+        loop = QtCore.QEventLoop()
+        worker.finished.connect(loop.quit, QtCore.Qt.QueuedConnection)
+        worker.start()
+        loop.exec_()
+        dialog.close()
+        worker.deleteLater()
+        if worker.error is not None:
+            QtWidgets.QMessageBox.warning(self, 'Error', '{} failed: {}'.format(label, worker.error))
+            return None
+        return worker.result
+
+    def make_proxy(self, videofile):
+        return self.run_job('Making proxy for {}'.format(os.path.basename(videofile)), make_proxy, videofile,
+                            scale=self.cfg.proxy.scale, quality=self.cfg.proxy.quality, workers=self.cfg.proxy.workers)
+
+    def initialize_keypoint_group(self, coords: np.ndarray):
+        # one diffed update, rather than clearing every keypoint and placing them again
+        self.keypoints.set_frame(coords)
         # self.keypoints = KeypointGroup(keypoints, self.player.videoView.scene,
         #                                parent=self.player, colormap=self.cfg.viz.colormap, radius=self.cfg.radius)
 
@@ -194,71 +337,172 @@ class MainWindow(QtWidgets.QMainWindow):
         # else:
         #     print('not clearing')
 
-    @QtCore.Slot(dict)
+    @QtCore.Slot(object)
     def update_data_buffer(self, data):
-        # without copying, could have an issue where the underlying keypoint gui state changes. we want to only
-        # keep the real data
-        self.data[self.framenum] = deepcopy(data)
+        # (n_instances, n_keypoints, 2). values are copied into the store's array, so later changes to the keypoint gui
+        # state can't leak in
+        self.data.set_frame(self.framenum, data)
+        self.timeline.update_frame(self.framenum)
+        self.generation += 1
         self.saved = False
-        if self.cfg.autosave:
-            self.save()
+        if self.cfg.autosave and not self.read_only:
+            # only append the changed frame. the full csv is rewritten in the background once edits pause, or
+            # right away if the journal is getting big
+            self.journal.append(self.framenum, self.data.get_frame(self.framenum))
+            self.save(debounce=self.journal.size <= self.cfg.journal_max_mb * 1e6)
+
+    def select_frames_to_label(self):
+        videoView = self.player.videoView
+        if videoView.vid is None or len(videoView.vid) < 2:
+            return
+        cfg = self.cfg.frame_selection
+        n, ok = QtWidgets.QInputDialog.getInt(self, 'Select frames to label', 'Number of frames', cfg.n, 1,
+                                              len(videoView.vid))
+        if not ok:
+            return
+        # frames that are already labeled aren't picked again. a proxy decodes faster and looks the same at this size
+        proxyfile = find_proxy(videoView.videofile) if self.cfg.proxy.use else None
+        source = proxyfile if proxyfile is not None else videoView.videofile
+        frame_list = self.run_job('Reading frames', select_frames, source, n, stride=cfg.stride,
+                                  max_samples=cfg.max_samples, size=cfg.size, n_components=cfg.pca,
+                                  exclude=self.data.labeled_frames(), workers=cfg.workers)
+        if frame_list is None:
+            return
+        self.frame_list = frame_list
+        filename = get_frame_list_filename(videoView.videofile)
+        write_frame_list(filename, self.frame_list)
+        print('wrote {} frames to label to {}'.format(len(self.frame_list), filename))
+        if len(self.frame_list) > 0:
+            videoView.update_frame(self.frame_list[0])
+
+    def jump_to_selected(self, forward: bool = True):
+        current = self.player.videoView.requested_fnum
+        if current is None or len(self.frame_list) == 0:
+            return
+        if forward:
+            index = np.searchsorted(self.frame_list, current, side='right')
+        else:
+            index = np.searchsorted(self.frame_list, current, side='left') - 1
+        if 0 <= index < len(self.frame_list):
+            self.player.videoView.update_frame(self.frame_list[index])
+
+    def jump_to_status(self, statuses, forward: bool = True):
+        # from the last requested frame, like next_frame, so holding the key keeps going. only the target is decoded
+        current = self.player.videoView.requested_fnum
+        if current is None:
+            return
+        if forward:
+            framenum = self.data.next_with_status(current, statuses)
+        else:
+            framenum = self.data.previous_with_status(current, statuses)
+        if framenum is not None:
+            self.player.videoView.update_frame(framenum)
 
     @QtCore.Slot(int)
     def update_framenum(self, framenum, force: bool = False):
         if self.framenum != framenum or force:
             # convenience: rather than dig this value out of the widgets, the app will have this attribute
             self.framenum = framenum
-            keypoints = self.data[framenum]
-            self.initialize_keypoint_group(keypoints)
+            self.initialize_keypoint_group(self.data.get_coords(framenum))
 
             # radio button will be set to the first keypoint that hasn't been placed on this frame
-            first_nonzero = len(keypoints) - 1
-            for i, (key, value) in enumerate(keypoints.items()):
-                if len(value) == 0 or np.sum(np.isnan(value)) > 0 or value is None:
-                    if i < first_nonzero:
-                        first_nonzero = i
-                        break
+            self.keypoints.select_first_unplaced()
 
-            self.keypoint_selector.set_selected(first_nonzero)
-
-    def save(self):
+    def save(self, debounce: bool = False, block: bool = False):
+        if self.save_filename is None:
+            # nothing opened yet
+            return
+        if self.read_only:
+            self.statusBar().showMessage('not saving: {} has keypoints the config can\'t hold'.format(
+                self.save_filename), 5000)
+            return
         # add image names to data
         image_names = None
-        if self.cfg.save_image_names:
+        # always for image directories, so their rows can be matched to images by name when loaded
+        if self.cfg.save_image_names or os.path.isdir(self.player.videoView.videofile):
             image_names = self.player.videoView.get_image_names()
 
-        df = utils.convert_data_to_df(self.data, image_names=image_names)
-        df.to_csv(self.save_filename)
-        print('saving to {}'.format(self.save_filename))
+        # the snapshot only copies labeled frames; encoding and writing happen on the save thread
+        indices, rows = self.data.snapshot()
+        job = SaveJob(self.save_filename, self.data.keys, indices, rows, image_names, self.generation)
+        self.saver.request(job, debounce=debounce)
+        if block:
+            self.wait_for_saves()
+
+    def wait_for_saves(self):
+        self.saver.flush()
+        # the finished signal is queued until the event loop runs again, so handle it now
+        if self.saver.last_saved is not None:
+            self.handle_saved(*self.saver.last_saved)
+
+    @QtCore.Slot(str, int)
+    def handle_saved(self, filename: str, generation: int):
+        if filename != self.save_filename or generation != self.generation:
+            # a stale save, or there were edits after the snapshot was taken
+            return
+        if self.saved:
+            return
+        # everything in the journal is now in the csv
+        if self.journal is not None:
+            self.journal.clear()
         self.saved = True
-        return df
+        self.statusBar().showMessage('saved to {}'.format(filename), 3000)
+
+    @QtCore.Slot(str, str)
+    def handle_save_failed(self, filename: str, message: str):
+        QtWidgets.QMessageBox.warning(self, 'Save failed', 'Could not save {}: {}'.format(filename, message))
+
+    def handle_frame_failed(self, framenum: int, message: str):
+        # in the status bar rather than a dialog, since scrubbing over a damaged stretch fails on many frames
+        self.statusBar().showMessage('could not read frame {}: {}'.format(framenum, message), 5000)
 
     def load(self, filename):
         assert os.path.isfile(filename)
         print('loading from {}'.format(filename))
         df = pd.read_csv(filename, index_col=0)
-        if 'image_name' in df: del df['image_name']
-
-        # data is initialized when we load our video
-        data = utils.convert_df_to_data(df, len(self.data), self.keypoint_dict)
-        df.head()
-        self.data = data
+        videoView = self.player.videoView
+        if os.path.isdir(videoView.videofile):
+            # rows are matched to images by name. csvs without names were saved when directories were sorted
+            # lexicographically, so their row numbers are ranks in that order
+            df = align_to_image_names(df, videoView.get_image_names(), legacy_sort(videoView.videofile))
+        elif 'image_name' in df:
+            del df['image_name']
+
+        # data is initialized when we load our video. only frames in the csv are touched
+        try:
+            self.data.update_from_df(df)
+        except ValueError as e:
+            # saving would overwrite the csv without the columns the config can't show, so don't
+            self.read_only = True
+            QtWidgets.QMessageBox.warning(self, 'Opened read-only',
+                                          '{}: {}.\n\nShowing what fits; edits will not be saved. Set keypoints and '
+                                          'instances in the config to match the csv and reopen it.'.format(filename, e))
+            self.data.update_from_df(df, strict=False)
         # do this to re-load the zeroth frame with data
         self.update_framenum(0, force=True)
 
     def prompt_for_save(self):
-        if self.saved:
+        # let background saves land first, so we don't ask about edits that are already on disk
+        self.wait_for_saves()
+        if self.saved or self.read_only:
+            return
+        if self.cfg.autosave:
+            # compact the journal without asking
+            self.save(block=True)
             return
         if simple_popup_question(self, 'You have unsaved changes. Do you want to save?'):
-            self.save()
+            self.save(block=True)
+        elif self.journal is not None:
+            # don't resurrect discarded edits next time this file is opened
+            self.journal.clear()
 
     def closeEvent(self, event, *args, **kwargs):
         super().closeEvent(event, *args, **kwargs)
         # https://stackoverflow.com/questions/1414781/prompt-on-exit-in-pyqt-application
         self.prompt_for_save()
+        self.saver.stop()
 
-        if hasattr(self.player.videoView, 'vid'):
-            self.player.videoView.vid.close()
+        self.player.videoView.close_video()
 
 
 def set_style(app):
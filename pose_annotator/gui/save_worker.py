@@ -0,0 +1,97 @@
+import threading
+import time
+import traceback
+from typing import NamedTuple
+
+import numpy as np
+from PySide2 import QtCore
+from PySide2.QtCore import Signal
+
+from pose_annotator import utils
+
+
+class SaveJob(NamedTuple):
+    filename: str
+    keys: list
+    # frame numbers and (n_labeled, n_instances, n_keypoints, 3) rows, from AnnotationStore.snapshot()
+    indices: np.ndarray
+    rows: np.ndarray
+    image_names: list
+    # MainWindow's edit counter when the snapshot was taken, so it knows which edits made it to disk
+    generation: int
+
+
+class SaveWorker(QtCore.QObject):
+    """Writes keypoint csvs on a dedicated thread
+
+    Requests within the debounce window of each other are coalesced: only the most recent snapshot is written.
+    Results are reported through Qt signals, which are queued back to the GUI thread.
+    """
+    finished = Signal(str, int)
+    failed = Signal(str, str)
+
+    def __init__(self, debounce: float = 1.0, parent=None):
+        super().__init__(parent)
+        self.debounce = debounce
+        self.condition = threading.Condition()
+        self.pending = None
+        self.deadline = 0
+        self.busy = False
+        self.stopped = False
+        # (filename, generation) of the last successful write
+        self.last_saved = None
+        self.thread = threading.Thread(target=self.run, name='SaveWorker', daemon=True)
+        self.thread.start()
+
+    def request(self, job: SaveJob, debounce: bool = True):
+        with self.condition:
+            self.pending = job
+            self.deadline = time.monotonic() + (self.debounce if debounce else 0)
+            self.condition.notify_all()
+
+    def flush(self):
+        # write any pending job now and block until it is on disk
+        with self.condition:
+            self.deadline = time.monotonic()
+            self.condition.notify_all()
+            while self.pending is not None or self.busy:
+                self.condition.wait()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.thread.join()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.stopped:
+                    if self.pending is None:
+                        self.condition.wait()
+                        continue
+                    remaining = self.deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                if self.pending is None:
+                    # stopped with nothing left to write
+                    return
+                job, self.pending = self.pending, None
+                self.busy = True
+            try:
+                self.write(job)
+                self.last_saved = (job.filename, job.generation)
+                self.finished.emit(job.filename, job.generation)
+            except Exception as e:
+                traceback.print_exc()
+                self.failed.emit(job.filename, str(e))
+            finally:
+                with self.condition:
+                    self.busy = False
+                    self.condition.notify_all()
+
+    def write(self, job: SaveJob):
+        df = utils.array_to_df(job.rows, job.keys, image_names=job.image_names, index=job.indices)
+        utils.atomic_to_csv(df, job.filename)
+        print('saved to {}'.format(job.filename))
@@ -0,0 +1,175 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import re
+import threading
+import warnings
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+from pose_annotator.frame_source import FrameSource, read_image
+from pose_annotator.utils import get_file_key
+
+image_endings = {'.bmp', '.jpg', '.jpeg', '.png', '.tiff', '.tif'}
+digits = re.compile(r'\d+')
+
+
+def pad_digits(match) -> str:
+    # length-prefixed, so that plain string comparison orders numbers by value
+    number = match.group().lstrip('0') or '0'
+    return '{:03d}{}'.format(len(number), number)
+
+
+def natural_key(name: str) -> str:
+    # frame2.png sorts before frame10.png
+    return digits.sub(pad_digits, name.lower())
+
+
+def natural_sort(names: list) -> list:
+    # fast path for the usual <prefix><number><suffix> naming, e.g. frame_000123.jpg: sort by the number alone
+    prefix = os.path.commonprefix(names)
+    suffix = os.path.commonprefix([name[::-1] for name in names])[::-1]
+    # the shared parts can't include digits, or frame1 and frame10 would share the prefix frame1
+    prefix = prefix.rstrip('0123456789')
+    suffix = suffix.lstrip('0123456789')
+    numbers = [name[len(prefix):len(name) - len(suffix)] for name in names]
+    if len(names) > 0 and all(number.isdigit() and len(number) < 19 for number in numbers):
+        order = np.argsort(np.array(numbers, dtype=np.int64), kind='stable')
+        return [names[i] for i in order]
+    return sorted(names, key=natural_key)
+
+
+def legacy_sort(directory: Union[str, os.PathLike]) -> list:
+    # image file names in the order vidio's DirectoryReader listed them: lexicographic, extensions matched
+    # case-sensitively. csvs saved for directories before they were sorted naturally number their rows in this order
+    return [name for name in sorted(os.listdir(directory)) if os.path.splitext(name)[1] in image_endings]
+
+
+def align_to_image_names(df: pd.DataFrame, names: list, legacy_names: list = None) -> pd.DataFrame:
+    """Renumbers the rows of a keypoints csv to the positions of the images they were labeled on in names
+
+    Rows are matched by their image_name column if there is one. Without it, rows are numbered by rank in legacy_names,
+    the order they were saved in, if given. Rows whose image isn't in names are dropped with a warning.
+    """
+    if 'image_name' in df:
+        row_names = [os.path.basename(str(name)) for name in df['image_name']]
+        df = df.drop(columns='image_name')
+    elif legacy_names is not None:
+        row_names = [legacy_names[i] if 0 <= i < len(legacy_names) else None for i in df.index]
+    else:
+        return df
+    positions = {name: i for i, name in enumerate(names)}
+    index = np.array([positions.get(name, -1) for name in row_names], dtype=np.int64)
+    missing = index < 0
+    if missing.any():
+        warnings.warn('dropping {} rows whose images are not in the directory, e.g. {}'.format(
+            missing.sum(), row_names[int(np.argmax(missing))]))
+    df = df[~missing]
+    df.index = index[~missing]
+    return df
+
+
+def get_index_filename(directory: Union[str, os.PathLike]) -> str:
+    # next to the directory rather than inside it, so writing the index doesn't change the directory's mtime
+    return os.path.normpath(directory) + '_images.json'
+
+
+def scan_directory(directory: Union[str, os.PathLike]) -> list:
+    names = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name[entry.name.rfind('.'):].lower() in image_endings and entry.is_file():
+                names.append(entry.name)
+    return natural_sort(names)
+
+
+def load_image_names(directory: Union[str, os.PathLike]) -> list:
+    # image file names in directory, naturally sorted, from the sidecar index if the directory hasn't changed
+    index_filename = get_index_filename(directory)
+    file_key = get_file_key(directory).tolist()
+    if os.path.isfile(index_filename):
+        try:
+            with open(index_filename, 'r') as f:
+                index = json.load(f)
+            if index['file_key'] == file_key:
+                return index['names']
+        except (OSError, ValueError, KeyError) as e:
+            warnings.warn('could not read image index {}: {}'.format(index_filename, e))
+
+    names = scan_directory(directory)
+    try:
+        with open(index_filename, 'w') as f:
+            json.dump({'file_key': file_key, 'names': names}, f)
+    except OSError as e:
+        warnings.warn('could not write image index {}: {}'.format(index_filename, e))
+    return names
+
+
+class ImageSequenceReader(FrameSource):
+    """Reads a directory of images as a video
+
+    The file listing comes from load_image_names. Images are decoded with cv2 in a thread pool: after each read, the
+    next `readahead` images are decoded in the background, so sequential reads rarely wait on disk. Reads are
+    thread-safe.
+    """
+    thread_safe = True
+
+    def __init__(self, directory: Union[str, os.PathLike], readahead: int = 8, workers: int = 4):
+        assert os.path.isdir(directory)
+        self.directory = directory
+        self.names = load_image_names(directory)
+        if len(self.names) == 0:
+            raise ValueError('no images found in {}'.format(directory))
+        super().__init__(len(self.names))
+        self.readahead = readahead
+        self.futures = OrderedDict()
+        self.lock = threading.Lock()
+        self.executor = None
+        if readahead > 0 and workers > 0:
+            self.executor = ThreadPoolExecutor(workers, thread_name_prefix='ImageSequenceReader')
+
+    @property
+    def file_object(self) -> list:
+        # full paths, like vidio's DirectoryReader
+        return [os.path.join(self.directory, name) for name in self.names]
+
+    def probe(self):
+        # without touching the read-ahead
+        frame = self.imread(0)
+        self._frame_shape, self._dtype = frame.shape, frame.dtype
+
+    def imread(self, framenum: int) -> np.ndarray:
+        return read_image(os.path.join(self.directory, self.names[framenum]))
+
+    def read(self, framenum: int) -> np.ndarray:
+        framenum = self.check_framenum(framenum)
+        with self.lock:
+            future = self.futures.pop(framenum, None)
+        frame = future.result() if future is not None else self.imread(framenum)
+        self.fnum = framenum + 1
+        self.schedule_readahead(framenum)
+        return frame
+
+    def schedule_readahead(self, framenum: int):
+        if self.executor is None:
+            return
+        window = range(framenum + 1, min(framenum + 1 + self.readahead, self.nframes))
+        with self.lock:
+            # drop read-ahead from wherever we were before a jump
+            for stale in [i for i in self.futures if i not in window]:
+                self.futures.pop(stale).cancel()
+            for i in window:
+                if i not in self.futures:
+                    self.futures[i] = self.executor.submit(self.imread, i)
+
+    def close(self):
+        if self.executor is not None:
+            with self.lock:
+                for future in self.futures.values():
+                    future.cancel()
+                self.futures.clear()
+            self.executor.shutdown(wait=True)
+            self.executor = None
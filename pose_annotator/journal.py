@@ -0,0 +1,95 @@
+import json
+import os
+import warnings
+from typing import Union
+
+import numpy as np
+
+
+def get_journal_filename(save_filename: Union[str, os.PathLike]) -> str:
+    # video_keypoints.csv -> video_keypoints.journal
+    return os.path.splitext(save_filename)[0] + '.journal'
+
+
+class EditJournal:
+    """Append-only JSON-lines log of per-frame keypoint edits, kept next to the keypoints csv
+
+    The first line is a header with the keypoint names and number of instances; every following line is one frame's
+    full (n_instances, n_keypoints, 3) x, y, p state, so replaying lines in order reproduces the edits.
+    The journal is deleted once its contents are compacted into the csv.
+    """
+    def __init__(self, filename: Union[str, os.PathLike], keys: list, n_instances: int = 1):
+        self.filename = filename
+        self.keys = list(keys)
+        self.n_instances = n_instances
+        self.file_object = None
+
+    @property
+    def size(self) -> int:
+        if not os.path.isfile(self.filename):
+            return 0
+        return os.path.getsize(self.filename)
+
+    def open(self):
+        new_file = self.size == 0
+        self.file_object = open(self.filename, 'a')
+        if new_file:
+            self.write_line({'keys': self.keys, 'instances': self.n_instances})
+
+    def write_line(self, line: dict):
+        self.file_object.write(json.dumps(line) + '\n')
+        # flush so that a crash of the GUI loses at most the edit in progress
+        self.file_object.flush()
+
+    def append(self, framenum: int, frame: np.ndarray):
+        if self.file_object is None:
+            self.open()
+        # NaN is not valid JSON; unlabeled keypoints are all zeros in the store anyway
+        xyp = np.nan_to_num(np.asarray(frame, dtype=np.float64)).round(4).tolist()
+        self.write_line({'frame': int(framenum), 'xyp': xyp})
+
+    def replay(self, store) -> int:
+        if not os.path.isfile(self.filename):
+            return 0
+        n_replayed = 0
+        columns = None
+        with open(self.filename, 'r') as f:
+            for i, line in enumerate(f):
+                try:
+                    line = json.loads(line)
+                except json.JSONDecodeError:
+                    # most likely a half-written final line from a crash
+                    warnings.warn('stopping journal replay at corrupt line {} of {}'.format(i, self.filename))
+                    break
+                if 'keys' in line:
+                    # map journal keypoints onto the store's by name, in case the config changed
+                    columns = [store.key_index.get(key) for key in line['keys']]
+                    continue
+                if columns is None:
+                    raise ValueError('journal {} has no header'.format(self.filename))
+                framenum = line['frame']
+                if framenum < 0 or framenum >= store.n_frames:
+                    warnings.warn('journal frame {} out of range, skipping'.format(framenum))
+                    continue
+                xyp = np.asarray(line['xyp'], dtype=np.float32)
+                if xyp.ndim == 2:
+                    # written before instances existed
+                    xyp = xyp[None]
+                frame = np.zeros((store.n_instances, store.n_keypoints, 3), dtype=np.float32)
+                n_instances = min(len(xyp), store.n_instances)
+                for column, value in zip(columns, xyp.transpose(1, 0, 2)):
+                    if column is not None:
+                        frame[:n_instances, column] = value[:n_instances]
+                store.set_frame(framenum, frame)
+                n_replayed += 1
+        return n_replayed
+
+    def close(self):
+        if self.file_object is not None:
+            self.file_object.close()
+            self.file_object = None
+
+    def clear(self):
+        self.close()
+        if os.path.isfile(self.filename):
+            os.remove(self.filename)
@@ -0,0 +1,118 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import warnings
+from typing import Callable, Union
+
+import cv2
+import h5py
+import numpy as np
+
+from pose_annotator.backends import open_frame_source
+from pose_annotator.utils import get_file_key
+
+
+def get_proxy_filename(videofile: Union[str, os.PathLike]) -> str:
+    return os.path.splitext(videofile)[0] + '_proxy.h5'
+
+
+def find_proxy(videofile: Union[str, os.PathLike]):
+    # the proxy for videofile, if one exists and was made from the current version of the video
+    proxyfile = get_proxy_filename(videofile)
+    if not os.path.isfile(videofile) or not os.path.isfile(proxyfile):
+        return None
+    try:
+        with h5py.File(proxyfile, 'r') as f:
+            if not np.array_equal(f.attrs['file_key'], get_file_key(videofile)):
+                warnings.warn('proxy {} is out of date with {}, ignoring'.format(proxyfile, videofile))
+                return None
+    except (OSError, KeyError) as e:
+        warnings.warn('could not read proxy {}: {}'.format(proxyfile, e))
+        return None
+    return proxyfile
+
+
+def get_proxy_scale(proxyfile: Union[str, os.PathLike]) -> float:
+    # proxy pixels per original video pixel
+    with h5py.File(proxyfile, 'r') as f:
+        return float(f.attrs['scale'])
+
+
+def encode_chunk(videofile: str, start: int, stop: int, scale: float, quality: int) -> list:
+    # runs in a worker process: one seek, then sequential decoding of [start, stop)
+    encoded = []
+    with open_frame_source(videofile) as reader:
+        for framenum in range(start, stop):
+            frame = reader[framenum]
+            if scale != 1:
+                frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            # grayscale frames are encoded as they are, as one-channel jpgs
+            if frame.ndim == 3 and frame.shape[2] == 3:
+                frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+            elif frame.ndim == 3 and frame.shape[2] == 4:
+                frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
+            ret, jpg = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+            if not ret:
+                raise ValueError('error encoding frame {} of {}'.format(framenum, videofile))
+            encoded.append(jpg.ravel())
+    return encoded
+
+
+def make_proxy(videofile: Union[str, os.PathLike], scale: float = 0.5, quality: int = 90, workers: int = None,
+               chunk_size: int = 256, progress: Callable = None) -> str:
+    """Transcodes videofile into an intra-only proxy: one JPEG per frame, in an HDF5 file readable by VideoReader
+
+    Any frame of the proxy decodes independently, so seeking is as cheap as stepping. Frames can be stored at a
+    reduced scale; the scale is saved with the proxy so that keypoints can stay in original-resolution coordinates.
+    Chunks of frames are encoded in parallel processes and written in order.
+    """
+    videofile = str(videofile)
+    with open_frame_source(videofile) as reader:
+        nframes = len(reader)
+        height, width = reader.frame_shape[:2]
+        dtype = reader.dtype
+    if dtype != np.uint8:
+        # checked here rather than failing in every worker process
+        raise ValueError('proxies are 8-bit jpgs, but {} has {} frames, which are displayed through a contrast window '
+                         'instead'.format(videofile, dtype))
+    proxyfile = get_proxy_filename(videofile)
+    tmp_filename = proxyfile + '.tmp'
+    starts = list(range(0, nframes, chunk_size))
+    if workers is None:
+        workers = os.cpu_count()
+
+    with h5py.File(tmp_filename, 'w') as f:
+        # same layout as the HDF5 files vidio writes, so VideoReader can open the proxy directly
+        dset = f.create_dataset('frame', (nframes,), dtype=h5py.vlen_dtype(np.dtype('uint8')))
+        f.attrs['scale'] = scale
+        f.attrs['width'] = width
+        f.attrs['height'] = height
+        f.attrs['file_key'] = get_file_key(videofile)
+
+        # spawned, not forked: forking copies the locks held by the parent's other threads (e.g. the GUI's readers),
+        # which can deadlock the children
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            # keep a bounded number of chunks in flight, so memory doesn't grow with video length
+            futures = deque()
+            chunks = iter(starts)
+            n_done = 0
+            while True:
+                while len(futures) < 2 * workers:
+                    start = next(chunks, None)
+                    if start is None:
+                        break
+                    stop = min(start + chunk_size, nframes)
+                    futures.append((start, executor.submit(encode_chunk, videofile, start, stop, scale, quality)))
+                if len(futures) == 0:
+                    break
+                start, future = futures.popleft()
+                encoded = future.result()
+                # one frame at a time: h5py turns a slice of equal-length jpgs into a 2-D array it can't broadcast
+                for i, jpg in enumerate(encoded):
+                    dset[start + i] = jpg
+                n_done += len(encoded)
+                if progress is not None:
+                    progress(n_done, nframes)
+    os.replace(tmp_filename, proxyfile)
+    return proxyfile
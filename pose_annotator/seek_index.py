@@ -0,0 +1,167 @@
+import os
+import threading
+import warnings
+from typing import Union
+
+import cv2
+import numpy as np
+
+from pose_annotator.utils import get_file_key
+
+try:
+    import av
+except ImportError:
+    # optional: without PyAV, videos with reordered frames (e.g. B-frames) are seeked without an index
+    av = None
+
+
+class SeekIndex:
+    """Frame numbers of the keyframes in a video, cached in a sidecar file next to it
+
+    The index is built by reading the video's packets without decoding them, which takes seconds even for hour-long
+    videos. Packets come in decode order, which with B-frames isn't the order frames are shown in. With PyAV installed,
+    packets are put in display order by their timestamps, so keyframes are numbered like frames in any stream,
+    including open-GOP H.264. Otherwise packets are read with OpenCV's raw stream mode, which doesn't report
+    timestamps, so they are only numbered like frames if the stream isn't reordered. That is checked by decoding the
+    first frames; for reordered streams keyframes stays None and readers seek without an index.
+    The sidecar is keyed by the video's size and mtime, so it is rebuilt if the video changes. Used by OpenCVSource to
+    seek only to keyframes.
+    """
+    def __init__(self, videofile: Union[str, os.PathLike]):
+        self.videofile = videofile
+        self.keyframes = None
+        # frames are decoded in a different order than they're shown, so packet numbers aren't frame numbers
+        self.reordered = False
+        self.thread = None
+        self.cancelled = False
+
+    @property
+    def sidecar_filename(self) -> str:
+        return os.path.splitext(self.videofile)[0] + '.seekindex.npz'
+
+    def load(self) -> bool:
+        if not os.path.isfile(self.sidecar_filename):
+            return False
+        try:
+            with np.load(self.sidecar_filename) as f:
+                # sidecars from before reordering was checked are rebuilt
+                if 'reordered' not in f.files or not np.array_equal(f['file_key'], get_file_key(self.videofile)):
+                    return False
+                self.reordered = bool(f['reordered'])
+                self.keyframes = None if self.reordered else f['keyframes']
+        except Exception as e:
+            warnings.warn('could not read seek index {}: {}'.format(self.sidecar_filename, e))
+            return False
+        return True
+
+    def save(self):
+        try:
+            keyframes = self.keyframes if self.keyframes is not None else np.zeros(0, dtype=np.int64)
+            np.savez(self.sidecar_filename, keyframes=keyframes, reordered=self.reordered,
+                     file_key=get_file_key(self.videofile))
+        except OSError as e:
+            # e.g. a read-only video directory. the index still works for this session
+            warnings.warn('could not write seek index {}: {}'.format(self.sidecar_filename, e))
+
+    def build(self):
+        is_key = None
+        if av is not None:
+            try:
+                is_key = self.read_keyframes_by_pts()
+            except Exception as e:
+                warnings.warn('PyAV could not read {}, using OpenCV: {}'.format(self.videofile, e))
+        reordered = False
+        if is_key is None and not self.cancelled:
+            is_key = self.read_keyframes_by_packet()
+            if is_key is not None and any(is_key):
+                keyframes = np.flatnonzero(is_key)
+                reordered = not self.decodes_in_order(is_key[:keyframes[1] + 1 if len(keyframes) > 1 else len(is_key)])
+        if self.cancelled or is_key is None or not any(is_key):
+            return
+        self.reordered = reordered
+        self.keyframes = None if reordered else np.flatnonzero(is_key).astype(np.int64)
+        self.save()
+        if reordered:
+            print('{} has reordered frames (e.g. B-frames), so keyframes can\'t be numbered without PyAV (pip install '
+                  'av); seeking without an index'.format(self.videofile))
+        else:
+            print('built seek index for {}: {} keyframes in {} frames'.format(self.videofile, len(self.keyframes),
+                                                                               len(is_key)))
+
+    def read_keyframes_by_pts(self):
+        # whether each frame, in display order, is a keyframe: packets sorted by timestamp. demuxing only, no decoding
+        timestamps, is_key = [], []
+        with av.open(str(self.videofile)) as container:
+            for packet in container.demux(container.streams.video[0]):
+                if self.cancelled:
+                    return None
+                # the final flush packet has no timestamp, and discarded packets (e.g. cut by an mp4 edit list) are
+                # never shown
+                if packet.pts is None or packet.is_discard:
+                    continue
+                timestamps.append(packet.pts)
+                is_key.append(packet.is_keyframe)
+        order = np.argsort(np.array(timestamps, dtype=np.int64), kind='stable')
+        return np.array(is_key, dtype=bool)[order].tolist()
+
+    def read_keyframes_by_packet(self):
+        # whether each packet, in decode order, is a keyframe
+        cap = cv2.VideoCapture(self.videofile, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+        try:
+            if not cap.isOpened() or cap.get(cv2.CAP_PROP_FORMAT) != -1:
+                warnings.warn('raw stream reading not supported for {}; seeking without an index'.format(
+                    self.videofile))
+                return None
+            is_key = []
+            # grab() in raw mode only demuxes the next packet, it does not decode it
+            while not self.cancelled and cap.grab():
+                is_key.append(bool(cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME)))
+        finally:
+            cap.release()
+        return is_key
+
+    def decodes_in_order(self, is_key: list, max_frames: int = 300) -> bool:
+        # whether decoding the first frames reports the same keyframes as their packets did. if the stream is
+        # reordered, the decoder reads packets ahead before returning each frame, and the last packet read is what
+        # OpenCV reports the keyframe flag of, so the flags lag behind. single-threaded, since a frame-threaded
+        # decoder also reads ahead, even in streams that aren't reordered
+        cap = cv2.VideoCapture(self.videofile, cv2.CAP_FFMPEG, [cv2.CAP_PROP_N_THREADS, 1])
+        try:
+            for expected in is_key[:max_frames]:
+                if self.cancelled or not cap.grab():
+                    return False
+                if bool(cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME)) != expected:
+                    return False
+        finally:
+            cap.release()
+        return True
+
+    def build_in_background(self):
+        self.thread = threading.Thread(target=self.build, name='SeekIndex', daemon=True)
+        self.thread.start()
+
+    def cancel(self):
+        self.cancelled = True
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def nearest_keyframe(self, framenum: int):
+        # the last keyframe at or before framenum, or None if the index isn't ready
+        keyframes = self.keyframes
+        if keyframes is None:
+            return None
+        index = np.searchsorted(keyframes, framenum, side='right') - 1
+        if index < 0:
+            return None
+        return int(keyframes[index])
+
+
+def get_seek_index(videofile: Union[str, os.PathLike]):
+    # only opencv-readable video files have keyframes; image directories and hdf5 files seek exactly already
+    if not os.path.isfile(videofile) or os.path.splitext(videofile)[1].lower() not in ['.avi', '.mp4', '.mov']:
+        return None
+    index = SeekIndex(videofile)
+    if not index.load():
+        index.build_in_background()
+    return index
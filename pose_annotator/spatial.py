@@ -0,0 +1,69 @@
+import numpy as np
+
+
+class GridIndex:
+    """Uniform grid over 2D points, for finding the points near a location
+
+    Points are bucketed into square cells by sorting their cell ids, so building the index is a few vectorized numpy
+    calls, and a query looks only at the 3x3 cells around the query point. Moving a few points merges their new ids into
+    the sorted ones rather than re-sorting. Points that aren't finite are left out.
+    """
+    def __init__(self, coords: np.ndarray, cell_size: float):
+        self.cell_size = float(cell_size)
+        indices = np.flatnonzero(np.isfinite(coords).all(axis=1))
+        ids = self.get_ids(coords[indices])
+        order = np.argsort(ids)
+        self.ids = ids[order]
+        self.indices = indices[order]
+
+    @staticmethod
+    def get_cell_ids(col, row):
+        # cells in the same column have consecutive ids, so three cells of a column are one range of the sorted ids
+        return col * 2 ** 32 + row
+
+    def get_ids(self, coords: np.ndarray) -> np.ndarray:
+        cells = np.floor(coords / self.cell_size).astype(np.int64)
+        return self.get_cell_ids(cells[:, 0], cells[:, 1])
+
+    def update(self, indices: np.ndarray, coords: np.ndarray):
+        # moves points indices to coords[indices] without rebuilding. linear in the number of points, but vectorized
+        keep = ~np.isin(self.indices, indices)
+        ids, kept = self.ids[keep], self.indices[keep]
+        indices = indices[np.isfinite(coords[indices]).all(axis=1)]
+        new_ids = self.get_ids(coords[indices])
+        order = np.argsort(new_ids)
+        new_ids, indices = new_ids[order], indices[order]
+        positions = np.searchsorted(ids, new_ids)
+        self.ids = np.insert(ids, positions, new_ids)
+        self.indices = np.insert(kept, positions, indices)
+
+    def query(self, x: float, y: float) -> np.ndarray:
+        # indices of every point within cell_size of (x, y), and some further away
+        col, row = int(np.floor(x / self.cell_size)), int(np.floor(y / self.cell_size))
+        candidates = []
+        for neighbor in (col - 1, col, col + 1):
+            start = np.searchsorted(self.ids, self.get_cell_ids(neighbor, row - 1), side='left')
+            stop = np.searchsorted(self.ids, self.get_cell_ids(neighbor, row + 1), side='right')
+            candidates.append(self.indices[start:stop])
+        # in index order, so ties go to the same point as without the index
+        return np.sort(np.concatenate(candidates))
+
+
+def find_nearest(coords: np.ndarray, radii: np.ndarray, x: float, y: float, candidates: np.ndarray = None):
+    """Index of the point nearest (x, y) if (x, y) is within that point's radius, otherwise None
+
+    Only candidates are checked if given, e.g. from GridIndex.query with a cell size of at least the largest radius,
+    which gives the same answer as checking every point.
+    """
+    if candidates is None:
+        candidates = np.arange(len(coords))
+    if len(candidates) == 0:
+        return None
+    dists = np.hypot(coords[candidates, 0] - x, coords[candidates, 1] - y)
+    if np.isnan(dists).all():
+        return None
+    nearest = np.nanargmin(dists)
+    index = int(candidates[nearest])
+    if dists[nearest] < radii[index]:
+        return index
+    return None
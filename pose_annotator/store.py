@@ -0,0 +1,381 @@
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+from pose_annotator import utils
+
+
+# frame statuses
+EMPTY, PARTIAL, LABELED = 0, 1, 2
+STATUS_NAMES = {'empty': EMPTY, 'partial': PARTIAL, 'labeled': LABELED}
+
+
+def get_status(frames: np.ndarray) -> np.ndarray:
+    # (n_frames, n_instances, n_keypoints, 3) -> (n_frames,) uint8. a frame is partial if any instance has some but
+    # not all of its keypoints, so instances that aren't in the frame at all (e.g. an animal out of view) don't count
+    p = frames[..., 2] > 0
+    started = p.any(axis=2)
+    incomplete = (started & ~p.all(axis=2)).any(axis=1)
+    return np.where(started.any(axis=1), np.where(incomplete, PARTIAL, LABELED), EMPTY).astype(np.uint8)
+
+
+class FrameStatus:
+    """Status of every frame (EMPTY, PARTIAL or LABELED) as one uint8 array, with a count of each status per block of
+    frames
+
+    Finding the next or previous frame with a status skips whole blocks that have none by looking at the counts, then
+    scans one block, so it doesn't depend on how far away that frame is. Updates are O(1) per frame.
+    """
+    def __init__(self, n_frames: int, block_size: int = 4096):
+        self.block_size = block_size
+        self.status = np.zeros(n_frames, dtype=np.uint8)
+        n_blocks = -(-n_frames // block_size)
+        self.counts = np.zeros((n_blocks, len(STATUS_NAMES)), dtype=np.int64)
+        self.counts[:, EMPTY] = block_size
+        if n_blocks > 0:
+            self.counts[-1, EMPTY] = n_frames - (n_blocks - 1) * block_size
+
+    def __len__(self):
+        return len(self.status)
+
+    def __getitem__(self, framenum: int) -> int:
+        return int(self.status[framenum])
+
+    def set(self, framenums: np.ndarray, statuses: np.ndarray):
+        framenums = np.atleast_1d(np.asarray(framenums, dtype=np.int64))
+        statuses = np.broadcast_to(np.asarray(statuses, dtype=np.uint8), framenums.shape)
+        # if a frame is given twice, the last one wins
+        _, last = np.unique(framenums[::-1], return_index=True)
+        framenums, statuses = framenums[::-1][last], statuses[::-1][last]
+        blocks = framenums // self.block_size
+        np.subtract.at(self.counts, (blocks, self.status[framenums]), 1)
+        np.add.at(self.counts, (blocks, statuses), 1)
+        self.status[framenums] = statuses
+
+    def count(self, statuses) -> int:
+        return int(self.counts[:, np.atleast_1d(statuses)].sum())
+
+    def next(self, framenum: int, statuses):
+        # first frame after framenum with one of statuses, or None
+        statuses = np.atleast_1d(statuses)
+        block = max(framenum + 1, 0) // self.block_size
+        stop = (block + 1) * self.block_size
+        hits = np.flatnonzero(np.isin(self.status[max(framenum + 1, 0):stop], statuses))
+        if len(hits) > 0:
+            return int(max(framenum + 1, 0) + hits[0])
+        blocks = np.flatnonzero(self.counts[block + 1:, statuses].sum(axis=1) > 0)
+        if len(blocks) == 0:
+            return None
+        start = (block + 1 + blocks[0]) * self.block_size
+        hits = np.flatnonzero(np.isin(self.status[start:start + self.block_size], statuses))
+        return int(start + hits[0])
+
+    def previous(self, framenum: int, statuses):
+        # last frame before framenum with one of statuses, or None
+        statuses = np.atleast_1d(statuses)
+        framenum = min(framenum, len(self.status))
+        if framenum <= 0:
+            return None
+        block = (framenum - 1) // self.block_size
+        start = block * self.block_size
+        hits = np.flatnonzero(np.isin(self.status[start:framenum], statuses))
+        if len(hits) > 0:
+            return int(start + hits[-1])
+        blocks = np.flatnonzero(self.counts[:block, statuses].sum(axis=1) > 0)
+        if len(blocks) == 0:
+            return None
+        start = blocks[-1] * self.block_size
+        hits = np.flatnonzero(np.isin(self.status[start:start + self.block_size], statuses))
+        return int(start + hits[-1])
+
+
+class AnnotationStore:
+    """Columnar keypoint storage: one (n_frames, n_instances, n_keypoints, 3) float32 array of x, y, p
+
+    Instances are e.g. animals, each with the full set of keypoints. A keypoint is labeled when p > 0. The array is
+    allocated with np.zeros, which the OS backs with lazily-committed zero pages, so opening a long video costs
+    neither time nor memory until frames are actually labeled.
+    """
+    def __init__(self, keys: Iterable[str], n_frames: int, n_instances: int = 1):
+        self.keys = list(keys)
+        self.key_index = {key: i for i, key in enumerate(self.keys)}
+        self.status = FrameStatus(n_frames)
+        self.allocate(n_frames, n_instances)
+
+    def allocate(self, n_frames: int, n_instances: int):
+        self.array = np.zeros((n_frames, n_instances, len(self.keys), 3), dtype=np.float32)
+
+    @property
+    def n_frames(self) -> int:
+        return self.array.shape[0]
+
+    @property
+    def n_instances(self) -> int:
+        return self.array.shape[1]
+
+    @property
+    def n_keypoints(self) -> int:
+        return self.array.shape[2]
+
+    def __len__(self):
+        return self.n_frames
+
+    def check_framenum(self, framenum: int) -> int:
+        framenum = int(framenum)
+        if framenum < 0 or framenum >= self.n_frames:
+            raise IndexError('frame {} out of range for store with {} frames'.format(framenum, self.n_frames))
+        return framenum
+
+    def get_frame(self, framenum: int) -> np.ndarray:
+        # a (n_instances, n_keypoints, 3) view, not a copy
+        return self.array[self.check_framenum(framenum)]
+
+    def get_coords(self, framenum: int) -> np.ndarray:
+        # (n_instances, n_keypoints, 2), NaN where unlabeled
+        frame = self.get_frame(framenum)
+        return np.where(frame[..., 2:] > 0, frame[..., :2], np.nan)
+
+    def to_frame(self, coords: np.ndarray) -> np.ndarray:
+        # (n_instances, n_keypoints, 3) x, y, p from coords of shape (n_instances, n_keypoints, 2 or 3), NaN or p == 0
+        # where unlabeled. a single instance's (n_keypoints, 2 or 3) also works
+        coords = np.asarray(coords, dtype=np.float32)
+        if coords.ndim == 2 and self.n_instances == 1:
+            coords = coords[None]
+        if coords.shape[:2] != (self.n_instances, self.n_keypoints) or coords.shape[2] not in (2, 3):
+            raise ValueError('expected coords of shape ({0}, {1}, 2) or ({0}, {1}, 3), got {2}'.format(
+                self.n_instances, self.n_keypoints, coords.shape))
+        valid = np.isfinite(coords[..., :2]).all(axis=-1)
+        if coords.shape[2] == 3:
+            valid &= coords[..., 2] > 0
+        frame = np.zeros((self.n_instances, self.n_keypoints, 3), dtype=np.float32)
+        frame[..., :2] = np.where(valid[..., None], coords[..., :2], 0)
+        frame[..., 2] = valid
+        return frame
+
+    def set_frame(self, framenum: int, coords: np.ndarray):
+        frame = self.get_frame(framenum)
+        frame[:] = self.to_frame(coords)
+        self.status.set(framenum, get_status(frame[None]))
+
+    def clear_frame(self, framenum: int):
+        self.get_frame(framenum)[:] = 0
+        self.status.set(framenum, EMPTY)
+
+    def labeled_mask(self) -> np.ndarray:
+        return self.status.status != EMPTY
+
+    def labeled_frames(self) -> np.ndarray:
+        return np.flatnonzero(self.labeled_mask())
+
+    def is_labeled(self, framenum: int) -> bool:
+        return self.status[self.check_framenum(framenum)] != EMPTY
+
+    def next_labeled(self, framenum: int):
+        # first frame after framenum with any keypoints, or None
+        return self.status.next(framenum, (PARTIAL, LABELED))
+
+    def previous_labeled(self, framenum: int):
+        # last frame before framenum with any keypoints, or None
+        return self.status.previous(framenum, (PARTIAL, LABELED))
+
+    def next_with_status(self, framenum: int, statuses):
+        return self.status.next(framenum, statuses)
+
+    def previous_with_status(self, framenum: int, statuses):
+        return self.status.previous(framenum, statuses)
+
+    def get_labeled_rows(self, start: int = 0, stop: int = None) -> tuple:
+        # frame numbers and copies of the labeled frames in [start, stop)
+        indices = start + np.flatnonzero(self.status.status[start:stop])
+        return indices, self.array[indices]
+
+    def snapshot(self):
+        # copy of only the labeled frames, cheap to hand to another thread
+        return self.get_labeled_rows()
+
+    def to_df(self, image_names=None) -> pd.DataFrame:
+        return utils.array_to_df(self.array, self.keys, image_names=image_names)
+
+    def check_columns(self, columns: list, n_instances: int):
+        # raises if a keypoints csv has columns this store would drop, e.g. one saved with more instances
+        ignored = utils.get_ignored_columns(columns, self.keys, n_instances)
+        if len(ignored) == 0:
+            return
+        try:
+            keys, n = utils.get_keys_from_columns(list(columns), infer=True)
+            layout = '{} keypoints x {} instances'.format(len(keys), n)
+        except ValueError:
+            layout = 'an unknown layout'
+        raise ValueError('the csv has {}, but the store holds {} keypoints x {} instances, so {} columns (e.g. {}) '
+                         'would be dropped'.format(layout, self.n_keypoints, self.n_instances, len(ignored), ignored[0]))
+
+    def read_df(self, df: pd.DataFrame, strict: bool = True) -> tuple:
+        # frame numbers and (n_rows, n_instances, n_keypoints, 3) frames of the rows of a keypoints csv. strict: raise
+        # ValueError rather than drop columns the store can't hold
+        if self.n_instances > 1 and not df.columns.isin(utils.get_columns(self.keys, self.n_instances)).any():
+            # a csv from before instances were configured: its keypoints go to the first instance
+            if strict:
+                self.check_columns(df.columns, 1)
+            index, values = utils.df_to_rows(df, self.keys, self.n_frames)
+            frames = np.zeros((len(values), self.n_instances, self.n_keypoints, 3), dtype=np.float32)
+            frames[:, :1] = values
+            return index, frames
+        if strict:
+            self.check_columns(df.columns, self.n_instances)
+        return utils.df_to_rows(df, self.keys, self.n_frames, self.n_instances)
+
+    def update_from_df(self, df: pd.DataFrame, strict: bool = True):
+        # frames in df replace those in the store
+        index, frames = self.read_df(df, strict)
+        self.array[index] = frames
+        self.status.set(index, get_status(frames))
+
+
+class SparseAnnotationStore(AnnotationStore):
+    """AnnotationStore that only holds labeled frames, for long recordings of which only a few frames are labeled
+
+    Labeled frames are packed into one (capacity, n_instances, n_keypoints, 3) array, in the order they were first
+    labeled, with a sorted array of their frame numbers and the row each one is in. Looking up a frame, or the next or
+    previous labeled one, is a binary search; memory, snapshots and saving scale with the number of labeled frames,
+    not with the length of the video. Labeling a new frame appends a row; a frame that loses its last label is
+    removed by moving the last row into its place.
+    """
+    def allocate(self, n_frames: int, n_instances: int):
+        self._n_frames = n_frames
+        # labeled frame numbers, sorted, and the row of self.rows each is in
+        self.frames = np.zeros(0, dtype=np.int64)
+        self.slots = np.zeros(0, dtype=np.int64)
+        self.rows = np.zeros((16, n_instances, len(self.keys), 3), dtype=np.float32)
+
+    @property
+    def array(self) -> np.ndarray:
+        # a dense copy with a row per frame, as in AnnotationStore. writing to it doesn't change the store
+        array = np.zeros((self.n_frames,) + self.rows.shape[1:], dtype=np.float32)
+        array[self.frames] = self.rows[self.slots]
+        return array
+
+    @property
+    def n_frames(self) -> int:
+        return self._n_frames
+
+    @property
+    def n_instances(self) -> int:
+        return self.rows.shape[1]
+
+    @property
+    def n_keypoints(self) -> int:
+        return self.rows.shape[2]
+
+    @property
+    def n_labeled(self) -> int:
+        return len(self.frames)
+
+    def find(self, framenum: int) -> int:
+        # position of framenum in self.frames, or -1 if it isn't labeled
+        position = int(np.searchsorted(self.frames, framenum))
+        if position < len(self.frames) and self.frames[position] == framenum:
+            return position
+        return -1
+
+    def get_frame(self, framenum: int) -> np.ndarray:
+        # a view for labeled frames. unlabeled frames aren't stored, so they get zeros that aren't written back
+        position = self.find(self.check_framenum(framenum))
+        if position < 0:
+            return np.zeros(self.rows.shape[1:], dtype=np.float32)
+        return self.rows[self.slots[position]]
+
+    def set_frame(self, framenum: int, coords: np.ndarray):
+        framenum = self.check_framenum(framenum)
+        frame = self.to_frame(coords)
+        self.status.set(framenum, get_status(frame[None]))
+        position = self.find(framenum)
+        if not frame[..., 2].any():
+            self.remove(position)
+        elif position >= 0:
+            self.rows[self.slots[position]] = frame
+        else:
+            self.insert(framenum, frame)
+
+    def insert(self, framenum: int, frame: np.ndarray):
+        slot = self.n_labeled
+        if slot == len(self.rows):
+            # amortized growth, like a list
+            rows = np.zeros((2 * len(self.rows),) + self.rows.shape[1:], dtype=np.float32)
+            rows[:slot] = self.rows
+            self.rows = rows
+        self.rows[slot] = frame
+        position = np.searchsorted(self.frames, framenum)
+        self.frames = np.insert(self.frames, position, framenum)
+        self.slots = np.insert(self.slots, position, slot)
+
+    def remove(self, position: int):
+        if position < 0:
+            return
+        slot = self.slots[position]
+        self.frames = np.delete(self.frames, position)
+        self.slots = np.delete(self.slots, position)
+        last = self.n_labeled
+        if slot != last:
+            # keep the rows packed
+            self.rows[slot] = self.rows[last]
+            self.slots[self.slots == last] = slot
+
+    def clear_frame(self, framenum: int):
+        self.remove(self.find(self.check_framenum(framenum)))
+        self.status.set(framenum, EMPTY)
+
+    def labeled_mask(self) -> np.ndarray:
+        mask = np.zeros(self.n_frames, dtype=bool)
+        mask[self.frames] = True
+        return mask
+
+    def labeled_frames(self) -> np.ndarray:
+        return self.frames.copy()
+
+    def is_labeled(self, framenum: int) -> bool:
+        return self.find(framenum) >= 0
+
+    def next_labeled(self, framenum: int):
+        position = np.searchsorted(self.frames, framenum, side='right')
+        return int(self.frames[position]) if position < len(self.frames) else None
+
+    def previous_labeled(self, framenum: int):
+        position = np.searchsorted(self.frames, framenum, side='left')
+        return int(self.frames[position - 1]) if position > 0 else None
+
+    def get_labeled_rows(self, start: int = 0, stop: int = None) -> tuple:
+        # in frame order
+        first = np.searchsorted(self.frames, start)
+        last = len(self.frames) if stop is None else np.searchsorted(self.frames, stop)
+        return self.frames[first:last].copy(), self.rows[self.slots[first:last]]
+
+    def to_df(self, image_names=None) -> pd.DataFrame:
+        indices, rows = self.snapshot()
+        return utils.array_to_df(rows, self.keys, image_names=image_names, index=indices)
+
+    def update_from_df(self, df: pd.DataFrame, strict: bool = True):
+        # frames in df replace those in the store. rebuilt in one pass rather than inserted one at a time
+        index, frames = self.read_df(df, strict)
+        # if a frame is in df twice, its last row wins, even if that row is unlabeled
+        _, last = np.unique(index[::-1], return_index=True)
+        index, frames = index[::-1][last], frames[::-1][last]
+        self.status.set(index, get_status(frames))
+        labeled = frames[..., 2].any(axis=(1, 2))
+        keep = ~np.isin(self.frames, index)
+        framenums = np.concatenate([self.frames[keep], index[labeled]])
+        rows = np.concatenate([self.rows[self.slots[keep]], frames[labeled]])
+        order = np.argsort(framenums, kind='stable')
+        self.frames = framenums[order]
+        self.slots = np.arange(len(self.frames))
+        self.rows = np.zeros((max(16, 2 * len(self.frames)),) + self.rows.shape[1:], dtype=np.float32)
+        self.rows[:len(self.frames)] = rows[order]
+
+
+stores = {'dense': AnnotationStore, 'sparse': SparseAnnotationStore}
+
+
+def make_store(kind: str, keys: Iterable[str], n_frames: int, n_instances: int = 1) -> AnnotationStore:
+    if kind not in stores:
+        raise ValueError('store must be one of {}, not {}'.format(list(stores), kind))
+    return stores[kind](keys, n_frames, n_instances)
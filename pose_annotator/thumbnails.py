@@ -0,0 +1,157 @@
+import os
+import threading
+import time
+import warnings
+from typing import Union
+
+import cv2
+import numpy as np
+
+from pose_annotator.frame_source import FrameSource
+from pose_annotator.utils import get_file_key
+
+
+def make_thumbnail(frame: np.ndarray, size: int) -> np.ndarray:
+    # at most size pixels on the longest side, in the frame's dtype
+    scale = size / max(frame.shape[:2])
+    if scale >= 1:
+        return np.array(frame)
+    if frame.dtype in (np.uint8, np.uint16, np.int16, np.float32, np.float64):
+        height, width = frame.shape[:2]
+        dsize = (max(1, round(width * scale)), max(1, round(height * scale)))
+        return cv2.resize(frame, dsize, interpolation=cv2.INTER_AREA).reshape(dsize[::-1] + frame.shape[2:])
+    # dtypes cv2.resize doesn't handle: nearest neighbor
+    step = int(np.ceil(1 / scale))
+    return np.array(frame[::step, ::step])
+
+
+class ThumbnailCache:
+    """Small thumbnails of a video's frames, for previewing while scrubbing, cached in a sidecar file next to it
+
+    A background thread reads the video once at a coarse stride, then halves the stride pass by pass, each pass
+    reading only frames it doesn't have yet, in order. Passes after the first only run while the app is idle, i.e.
+    idle_s after the last call to touch(). It stops at stride 1 or at max_count thumbnails. Each finished pass is
+    saved to a compressed sidecar keyed by the video's size and mtime, so later sessions start from there.
+    """
+    def __init__(self, videofile: Union[str, os.PathLike], source: FrameSource, size: int = 128,
+                 max_count: int = 2048, initial_count: int = 256, idle_s: float = 1.0, save: bool = True):
+        self.videofile = str(videofile)
+        self.source = source
+        self.nframes = len(source)
+        self.size = size
+        self.max_count = max_count
+        self.initial_count = initial_count
+        self.idle_s = idle_s
+        self.save_sidecar = save
+        # framenum: thumbnail. framenums is the sorted keys, replaced rather than modified so readers never lock
+        self.thumbnails = {}
+        self.framenums = np.zeros(0, dtype=np.int64)
+        self.stride = None
+        self.last_touch = 0.0
+        self.thread = None
+        self.cancelled = False
+
+    @property
+    def sidecar_filename(self) -> str:
+        return os.path.splitext(self.videofile)[0] + '.thumbs.npz'
+
+    def load(self) -> bool:
+        if not os.path.isfile(self.sidecar_filename):
+            return False
+        try:
+            with np.load(self.sidecar_filename) as f:
+                if not np.array_equal(f['file_key'], get_file_key(self.videofile)) or int(f['size']) != self.size:
+                    return False
+                framenums, thumbnails = f['framenums'], f['thumbnails']
+                self.stride = int(f['stride'])
+        except Exception as e:
+            warnings.warn('could not read thumbnails {}: {}'.format(self.sidecar_filename, e))
+            return False
+        self.thumbnails = {int(framenum): thumbnail for framenum, thumbnail in zip(framenums, thumbnails)}
+        self.framenums = framenums.astype(np.int64)
+        return True
+
+    def save(self):
+        if not self.save_sidecar or len(self.framenums) == 0:
+            return
+        framenums = self.framenums
+        tmp_filename = self.sidecar_filename + '.tmp'
+        try:
+            with open(tmp_filename, 'wb') as f:
+                np.savez_compressed(f, framenums=framenums,
+                                    thumbnails=np.stack([self.thumbnails[int(i)] for i in framenums]),
+                                    stride=self.stride, size=self.size, file_key=get_file_key(self.videofile))
+            os.replace(tmp_filename, self.sidecar_filename)
+        except OSError as e:
+            # e.g. a read-only video directory. the thumbnails still work for this session
+            warnings.warn('could not write thumbnails {}: {}'.format(self.sidecar_filename, e))
+
+    def get_first_stride(self) -> int:
+        # a power of two, so that every pass's frames include the previous pass's
+        return int(2 ** np.ceil(np.log2(max(self.nframes / self.initial_count, 1))))
+
+    def touch(self):
+        # the user is doing something, e.g. changing frames: hold off refining
+        self.last_touch = time.monotonic()
+
+    def wait_for_idle(self) -> bool:
+        while time.monotonic() - self.last_touch < self.idle_s:
+            if self.cancelled:
+                return False
+            time.sleep(0.05)
+        return not self.cancelled
+
+    def build(self):
+        try:
+            stride = self.get_first_stride() if self.stride is None else self.stride // 2
+            first = self.stride is None
+            while stride >= 1 and -(-self.nframes // stride) <= self.max_count:
+                framenums = [i for i in range(0, self.nframes, stride) if i not in self.thumbnails]
+                for n, framenum in enumerate(framenums):
+                    if not first and not self.wait_for_idle():
+                        return
+                    if self.cancelled:
+                        return
+                    self.thumbnails[framenum] = make_thumbnail(self.source[framenum], self.size)
+                    if n % 16 == 15 or n == len(framenums) - 1:
+                        self.framenums = np.array(sorted(self.thumbnails), dtype=np.int64)
+                self.stride = stride
+                self.save()
+                first = False
+                stride //= 2
+        except Exception as e:
+            warnings.warn('stopped building thumbnails for {}: {}'.format(self.videofile, e))
+        finally:
+            # this thread's own reader, from reopen()
+            self.source.close()
+
+    def build_in_background(self):
+        self.thread = threading.Thread(target=self.build, name='ThumbnailCache', daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.cancelled = True
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def get_nearest(self, framenum: int):
+        # (framenum, thumbnail) of the cached frame nearest framenum, or None if there are none yet
+        framenums = self.framenums
+        if len(framenums) == 0:
+            return None
+        index = np.searchsorted(framenums, framenum)
+        candidates = framenums[max(index - 1, 0):index + 1]
+        nearest = int(candidates[np.argmin(np.abs(candidates - framenum))])
+        return nearest, self.thumbnails[nearest]
+
+
+def get_thumbnails(videofile: Union[str, os.PathLike], source: FrameSource, **kwargs):
+    # thumbnails for scrubbing, loaded from a sidecar and refined in the background. sources that are already in
+    # memory, e.g. memory-mapped arrays, show any frame about as fast as a thumbnail, so they don't get any
+    if source.in_memory or len(source) < 2:
+        return None
+    thumbnails = ThumbnailCache(videofile, source.reopen(), **kwargs)
+    thumbnails.load()
+    thumbnails.build_in_background()
+    return thumbnails
@@ -0,0 +1,220 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import warnings
+from typing import Callable, Union
+
+import cv2
+import numpy as np
+
+from pose_annotator.frame_source import FrameSource, read_image
+from pose_annotator.utils import get_file_key
+
+
+def get_cache_root(cache_dir: Union[str, os.PathLike] = None) -> str:
+    if cache_dir is not None:
+        return str(cache_dir)
+    return os.path.join(os.path.expanduser('~'), '.pose_annotator', 'tiles')
+
+
+def get_cache_dir(imagefile: Union[str, os.PathLike], cache_dir: Union[str, os.PathLike] = None) -> str:
+    # one directory per image, named by its path
+    name = hashlib.sha1(os.path.abspath(imagefile).encode()).hexdigest()[:16]
+    return os.path.join(get_cache_root(cache_dir), name)
+
+
+def get_directory_size(directory: Union[str, os.PathLike]) -> int:
+    with os.scandir(directory) as entries:
+        return sum(entry.stat().st_size for entry in entries if entry.is_file())
+
+
+def evict_cache(cache_dir: Union[str, os.PathLike], max_bytes: float, keep: str = None):
+    # deletes the least recently opened pyramids until the tile cache fits in max_bytes
+    root = get_cache_root(cache_dir)
+    if not os.path.isdir(root):
+        return
+    entries = [os.path.join(root, name) for name in os.listdir(root)]
+    entries = [entry for entry in entries if os.path.isdir(entry) and entry != keep]
+    sizes = {entry: get_directory_size(entry) for entry in entries}
+    total = sum(sizes.values()) + (get_directory_size(keep) if keep is not None and os.path.isdir(keep) else 0)
+    for entry in sorted(entries, key=os.path.getmtime):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= sizes[entry]
+
+
+class TilePyramid(FrameSource):
+    """Multi-resolution tile pyramid of a large image, built lazily and cached on disk
+
+    Level 0 is the full-resolution image and each level above it is half the size of the one below, up to a level
+    that fits in one tile. Every level is a memory-mapped .npy file in the cache directory, so memory use doesn't
+    grow with image size. A tile is downsampled from the (up to four) tiles under it the first time it is asked for.
+    Which tiles have been built is saved on close, so later sessions pick up where this one left off.
+
+    As a FrameSource it is one frame: the memory-mapped full-resolution image.
+    """
+    thread_safe = True
+    in_memory = True
+
+    def __init__(self, directory: Union[str, os.PathLike], imagefile: Union[str, os.PathLike]):
+        self.directory = directory
+        self.imagefile = imagefile
+        with open(os.path.join(directory, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        self.tile_size = meta['tile_size']
+        self.levels = [np.load(self.get_level_filename(level), mmap_mode='r+') for level in range(meta['n_levels'])]
+        self.built = [np.load(self.get_built_filename(level)) for level in range(meta['n_levels'])]
+        self.lock = threading.RLock()
+        super().__init__(1)
+        self.names = [imagefile]
+        self._frame_shape, self._dtype = self.levels[0].shape, self.levels[0].dtype
+        # marks this pyramid as recently used, for evict_cache
+        os.utime(directory)
+
+    def get_level_filename(self, level: int) -> str:
+        return os.path.join(self.directory, 'level{}.npy'.format(level))
+
+    def get_built_filename(self, level: int) -> str:
+        return os.path.join(self.directory, 'built{}.npy'.format(level))
+
+    @classmethod
+    def create(cls, directory: Union[str, os.PathLike], imagefile: Union[str, os.PathLike], image: np.ndarray,
+               tile_size: int = 512, progress: Callable = None) -> 'TilePyramid':
+        os.makedirs(directory, exist_ok=True)
+        shape = image.shape
+        n_levels = 0
+        while True:
+            level = np.lib.format.open_memmap(os.path.join(directory, 'level{}.npy'.format(n_levels)), mode='w+',
+                                              dtype=image.dtype, shape=shape)
+            rows, cols = -(-shape[0] // tile_size), -(-shape[1] // tile_size)
+            # level 0 is the image itself, so it's built from the start
+            np.save(os.path.join(directory, 'built{}.npy'.format(n_levels)),
+                    np.full((rows, cols), n_levels == 0, dtype=bool))
+            if n_levels == 0:
+                # copied a row of tiles at a time, to report progress while it's written out to disk
+                for y0 in range(0, shape[0], tile_size):
+                    level[y0:y0 + tile_size] = image[y0:y0 + tile_size]
+                    if progress is not None:
+                        progress(min(y0 + tile_size, shape[0]), shape[0])
+            level.flush()
+            del level
+            n_levels += 1
+            if max(shape[:2]) <= tile_size:
+                break
+            shape = (-(-shape[0] // 2), -(-shape[1] // 2)) + shape[2:]
+        # written last, so that a pyramid interrupted while being created is never opened
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump({'file_key': get_file_key(imagefile).tolist(), 'tile_size': tile_size, 'n_levels': n_levels},
+                      f)
+        return cls(directory, imagefile)
+
+    @property
+    def n_levels(self) -> int:
+        return len(self.levels)
+
+    def get_level_for_scale(self, scale: float) -> int:
+        # the coarsest level that still has at least one pixel per screen pixel, at scale screen pixels per image pixel
+        if scale >= 1:
+            return 0
+        return int(np.clip(np.floor(np.log2(1 / scale)), 0, self.n_levels - 1))
+
+    def get_tile_bounds(self, level: int, row: int, col: int) -> tuple:
+        # y0, y1, x0, x1 of the tile, in pixels of its level
+        height, width = self.levels[level].shape[:2]
+        y0, x0 = row * self.tile_size, col * self.tile_size
+        return y0, min(y0 + self.tile_size, height), x0, min(x0 + self.tile_size, width)
+
+    def get_tiles_in_rect(self, level: int, x0: float, y0: float, x1: float, y1: float) -> list:
+        # (row, col) of the tiles of level that overlap a rectangle given in full-resolution pixels
+        rows, cols = self.built[level].shape
+        extent = self.tile_size * 2 ** level
+        row0, row1 = max(int(y0 // extent), 0), min(int(y1 // extent) + 1, rows)
+        col0, col1 = max(int(x0 // extent), 0), min(int(x1 // extent) + 1, cols)
+        return [(row, col) for row in range(row0, row1) for col in range(col0, col1)]
+
+    def is_built(self, level: int, row: int, col: int) -> bool:
+        return bool(self.built[level][row, col])
+
+    def build_tile(self, level: int, row: int, col: int):
+        if self.built[level][row, col]:
+            return
+        below = self.levels[level - 1]
+        rows, cols = self.built[level - 1].shape
+        for below_row in range(2 * row, min(2 * row + 2, rows)):
+            for below_col in range(2 * col, min(2 * col + 2, cols)):
+                self.build_tile(level - 1, below_row, below_col)
+        y0, y1, x0, x1 = self.get_tile_bounds(level, row, col)
+        source = np.asarray(below[2 * y0:min(2 * y1, below.shape[0]), 2 * x0:min(2 * x1, below.shape[1])])
+        destination = self.levels[level][y0:y1, x0:x1]
+        destination[:] = cv2.resize(source, (x1 - x0, y1 - y0), interpolation=cv2.INTER_AREA).reshape(
+            destination.shape)
+        self.built[level][row, col] = True
+
+    def get_tile(self, level: int, row: int, col: int) -> np.ndarray:
+        with self.lock:
+            self.build_tile(level, row, col)
+        y0, y1, x0, x1 = self.get_tile_bounds(level, row, col)
+        return self.levels[level][y0:y1, x0:x1]
+
+    def read(self, framenum: int) -> np.ndarray:
+        self.check_framenum(framenum)
+        return self.levels[0]
+
+    def close(self):
+        with self.lock:
+            if self.levels is None:
+                return
+            for level in range(self.n_levels):
+                self.levels[level].flush()
+                try:
+                    np.save(self.get_built_filename(level), self.built[level])
+                except OSError as e:
+                    warnings.warn('could not save tile pyramid state to {}: {}'.format(self.directory, e))
+            self.levels = None
+
+
+def open_pyramid(imagefile: Union[str, os.PathLike], cache_dir: Union[str, os.PathLike] = None):
+    # the cached pyramid of imagefile, if there is one and it was made from the current version of the image
+    directory = get_cache_dir(imagefile, cache_dir)
+    meta_filename = os.path.join(directory, 'meta.json')
+    if not os.path.isfile(meta_filename):
+        return None
+    try:
+        with open(meta_filename, 'r') as f:
+            meta = json.load(f)
+        if meta['file_key'] != get_file_key(imagefile).tolist():
+            return None
+        return TilePyramid(directory, imagefile)
+    except (OSError, ValueError, KeyError) as e:
+        warnings.warn('could not open tile pyramid {}: {}'.format(directory, e))
+        return None
+
+
+def build_pyramid(imagefile: Union[str, os.PathLike], image: np.ndarray, cache_dir: Union[str, os.PathLike] = None,
+                  tile_size: int = 512, max_disk_gb: float = 20, progress: Callable = None) -> TilePyramid:
+    directory = get_cache_dir(imagefile, cache_dir)
+    if os.path.isdir(directory):
+        shutil.rmtree(directory)
+    # room for this pyramid: a third more than the full-resolution image
+    evict_cache(cache_dir, max_disk_gb * 1e9 - image.nbytes * 4 / 3)
+    return TilePyramid.create(directory, imagefile, image, tile_size, progress)
+
+
+def load_image(imagefile: Union[str, os.PathLike], min_megapixels: float, cache_dir: Union[str, os.PathLike] = None,
+               progress: Callable = None, **kwargs):
+    """The image to show for imagefile: its TilePyramid if it has at least min_megapixels, otherwise the image itself
+
+    Decoding a large image and writing its pyramid out takes a while, so this is meant to run off the GUI thread, e.g.
+    in a JobWorker. A cached pyramid is opened without decoding the image.
+    """
+    pyramid = open_pyramid(imagefile, cache_dir)
+    if pyramid is not None:
+        return pyramid
+    image = read_image(imagefile)
+    if image.shape[0] * image.shape[1] < min_megapixels * 1e6:
+        return image
+    print('building tile pyramid for {}'.format(imagefile))
+    return build_pyramid(imagefile, image, cache_dir, progress=progress, **kwargs)
@@ -0,0 +1,79 @@
+import numpy as np
+
+from pose_annotator.store import EMPTY, LABELED, PARTIAL, AnnotationStore
+
+
+def get_bucket_edges(n_frames: int, n_buckets: int) -> np.ndarray:
+    # frame f is in bucket f * n_buckets // n_frames, so bucket b starts at ceil(b * n_frames / n_buckets)
+    return (np.arange(n_buckets + 1, dtype=np.int64) * n_frames + n_buckets - 1) // n_buckets
+
+
+class TimelineHistogram:
+    """Frame statuses and keypoint completeness of a store, binned into at most n_buckets buckets of frames
+
+    Built from the store's status index and its labeled frames only, so the cost is one vectorized pass over the
+    status array plus work per labeled frame, however long the video. After an edit only the bucket of the edited
+    frame is recounted. A keypoint's completeness in a bucket is the fraction of labeled instances that have it.
+    """
+    def __init__(self, store: AnnotationStore, n_buckets: int):
+        self.store = store
+        self.n_buckets = max(min(n_buckets, store.n_frames), 0)
+        self.edges = get_bucket_edges(store.n_frames, self.n_buckets) if self.n_buckets > 0 else np.zeros(1, int)
+        self.totals = np.diff(self.edges)
+        self.statuses = np.zeros((self.n_buckets, 3), dtype=np.int64)
+        self.keypoints = np.zeros((self.n_buckets, store.n_keypoints), dtype=np.int64)
+        self.instances = np.zeros(self.n_buckets, dtype=np.int64)
+        self.update_all()
+
+    def get_bucket(self, framenum: int) -> int:
+        return framenum * self.n_buckets // self.store.n_frames
+
+    def update_all(self):
+        if self.n_buckets == 0:
+            return
+        status = self.store.status.status
+        labeled = np.flatnonzero(status)
+        buckets = labeled * self.n_buckets // self.store.n_frames
+        for value in (PARTIAL, LABELED):
+            self.statuses[:, value] = np.bincount(buckets[status[labeled] == value], minlength=self.n_buckets)
+        self.statuses[:, EMPTY] = self.totals - self.statuses[:, PARTIAL] - self.statuses[:, LABELED]
+
+        framenums, frames = self.store.get_labeled_rows()
+        buckets = framenums * self.n_buckets // self.store.n_frames
+        p = frames[..., 2] > 0
+        self.keypoints[:] = 0
+        np.add.at(self.keypoints, buckets, p.sum(axis=1))
+        self.instances[:] = np.bincount(buckets, weights=p.any(axis=2).sum(axis=1), minlength=self.n_buckets)
+
+    def update_bucket(self, bucket: int):
+        start, stop = self.edges[bucket], self.edges[bucket + 1]
+        self.statuses[bucket] = np.bincount(self.store.status.status[start:stop], minlength=3)
+        _, frames = self.store.get_labeled_rows(start, stop)
+        p = frames[..., 2] > 0
+        self.keypoints[bucket] = p.sum(axis=(0, 1))
+        self.instances[bucket] = p.any(axis=2).sum()
+
+    def get_density(self, buckets: np.ndarray, value: int) -> np.ndarray:
+        # fraction of frames in each bucket with the status, boosted so that one labeled frame among thousands shows
+        fraction = self.statuses[buckets, value] / np.maximum(self.totals[buckets], 1)
+        return np.where(fraction > 0, 0.3 + 0.7 * fraction, 0)
+
+    def get_completeness(self, buckets: np.ndarray) -> np.ndarray:
+        # (len(buckets), n_keypoints)
+        return self.keypoints[buckets] / np.maximum(self.instances[buckets], 1)[:, None]
+
+    def render(self, buckets: np.ndarray, colors: np.ndarray, band_height: int = 6, row_height: int = 2,
+               background=(40, 40, 40)) -> np.ndarray:
+        # (height, len(buckets), 3) uint8 image columns: a band for fully labeled frames, one for partially labeled
+        # frames, then a row per keypoint in its color
+        background = np.asarray(background, dtype=np.float32)
+        rows = [(self.get_density(buckets, LABELED), (80, 200, 80), band_height),
+                (self.get_density(buckets, PARTIAL), (230, 150, 40), band_height)]
+        completeness = self.get_completeness(buckets)
+        for k in range(self.store.n_keypoints):
+            rows.append((completeness[:, k], colors[k, :3], row_height))
+        columns = []
+        for alpha, color, height in rows:
+            row = background + alpha[:, None] * (np.asarray(color, dtype=np.float32) - background)
+            columns.append(np.broadcast_to(row, (height,) + row.shape))
+        return np.concatenate(columns).round().astype(np.uint8)
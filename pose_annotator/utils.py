@@ -1,84 +1,173 @@
 from collections import OrderedDict
+import os
+import time
+import warnings
 
 import numpy as np
 import pandas as pd
 
-def check_for_any_data(data: list) -> list:
-    has_any_data = []
-    for element in data:
-        frame_has_data = False
-        for key, value in element.items():
-            if key != 'image_name' and len(value) > 0:
-                frame_has_data = True
-                break
-        has_any_data.append(frame_has_data)
-    return has_any_data
+def get_columns(keys: list, n_instances: int = 1) -> list:
+    # wide csv layout: <key>_x, <key>_y, <key>_p for each keypoint, in keypoint order. with more than one instance,
+    # <key>_<instance>_x etc., all of instance 0's keypoints first
+    if n_instances == 1:
+        return [key + suffix for key in keys for suffix in ('_x', '_y', '_p')]
+    return ['{}_{}{}'.format(key, instance, suffix) for instance in range(n_instances) for key in keys
+            for suffix in ('_x', '_y', '_p')]
 
-def convert_data_to_df(data: list, image_names=None) -> pd.DataFrame:
-    has_any_data = check_for_any_data(data)
-    
-    # rows = {}
-    indices = []
-    rows = []
-    keys = []
-    for i, element in enumerate(data):
-        row = OrderedDict()
-        if not has_any_data[i]:
+def get_keys_from_columns(columns: list, n_instances: int = None, infer: bool = False) -> tuple:
+    # inverse of get_columns: keypoint names and number of instances of a keypoints csv
+    # e.g. nose_0_x, nose_1_x could be two keypoints or two instances of one. they're read as n_instances instances,
+    # or with infer, as the most instances the columns fit; otherwise as one instance of keypoints named as they are
+    names = [column[:-2] for column in columns if column.endswith('_x')]
+    coordinate_columns = [column for column in columns if column[-2:] in ('_x', '_y', '_p')]
+    if n_instances is not None:
+        candidates = [n_instances]
+    else:
+        candidates = range(len(names), 0, -1) if infer else [1]
+    for n in candidates:
+        if n == 1:
+            return names, 1
+        if len(names) % n != 0:
             continue
-        for key, value in element.items():
-            if value is None or np.isnan(value).sum() > 0:
-                value = [np.nan, np.nan]
-                p = 0
-            else:
-                p = 1
-            row[key + '_x'] = value[0]
-            row[key + '_y'] = value[1]
-            row[key + '_p'] = p
-            if i == 0:
-                keys.append(key + '_x')
-                keys.append(key + '_y')
-                keys.append(key + '_p')
-        rows.append(row)
-        indices.append(i)
-
-    df = pd.DataFrame( data=rows, columns=keys, index=indices)
-    if image_names is not None:
-        df = df.join(pd.DataFrame(
-            data=[image_names[i] for i in indices], 
-            columns=['image_name'], index=indices))
+        keys = [name.rsplit('_', 1)[0] for name in names[:len(names) // n]]
+        if get_columns(keys, n) == coordinate_columns:
+            return keys, n
+    raise ValueError('columns are not laid out for {} instances: {}'.format(n_instances, columns))
+
+def get_ignored_columns(columns: list, keys: list, n_instances: int = 1) -> list:
+    # coordinate columns of a keypoints csv that a store of keys and n_instances can't hold, so reading would drop
+    readable = set(get_columns(keys, n_instances))
+    return [column for column in columns if column[-2:] in ('_x', '_y', '_p') and column not in readable]
+
+def get_n_instances(array: np.ndarray) -> int:
+    # arrays are (n_frames, n_keypoints, 3), or (n_frames, n_instances, n_keypoints, 3)
+    return array.shape[1] if array.ndim == 4 else 1
+
+def array_to_df(array: np.ndarray, keys: list, image_names=None, index: np.ndarray = None) -> pd.DataFrame:
+    # array: (n_frames, [n_instances,] n_keypoints, 3) of x, y, p. only frames with at least one labeled keypoint
+    # become rows. index: frame number of each row of array, if array only holds a subset of frames
+    columns = get_columns(keys, get_n_instances(array))
+    array = array.reshape(len(array), len(columns) // 3, 3)
+    p = array[..., 2] > 0
+    rows_with_data = np.flatnonzero(p.any(axis=1))
+    indices = rows_with_data if index is None else np.asarray(index)[rows_with_data]
+    rows = array[rows_with_data]
+    rows[..., :2][~p[rows_with_data]] = np.nan
+    rows[..., 2] = p[rows_with_data]
 
+    df = pd.DataFrame(data=rows.reshape(len(indices), len(columns)), columns=columns, index=indices)
+    p_columns = columns[2::3]
+    df[p_columns] = df[p_columns].astype(int)
+    if image_names is not None:
+        df['image_name'] = [image_names[i] for i in indices]
     return df
 
+def atomic_to_csv(df: pd.DataFrame, filename: str):
+    # write next to the destination and rename over it, so a crash mid-write never leaves a truncated csv
+    tmp_filename = filename + '.tmp'
+    df.to_csv(tmp_filename)
+    os.replace(tmp_filename, filename)
+
+def get_file_key(filename: str) -> np.ndarray:
+    # identifies a version of a file for sidecar caches: (size in bytes, mtime in ns)
+    stat = os.stat(filename)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+def df_to_rows(df: pd.DataFrame, keys: list, n_frames: int, n_instances: int = 1) -> tuple:
+    # frame numbers and (n_rows, n_instances, n_keypoints, 3) x, y, p of the rows of df within [0, n_frames).
+    # columns not in keys (e.g. image_name) are ignored; missing keys are left unlabeled
+    index = df.index.to_numpy()
+    in_range = (index >= 0) & (index < n_frames)
+    if not in_range.all():
+        warnings.warn('dropping {} rows with frame numbers outside [0, {})'.format((~in_range).sum(), n_frames))
+
+    values = df.reindex(columns=get_columns(keys, n_instances)).to_numpy(dtype=np.float32)[in_range]
+    values = values.reshape(len(values), n_instances, len(keys), 3)
+    valid = np.isfinite(values[..., :2]).all(axis=-1) & (values[..., 2] > 1e-7)
+    values[..., :2][~valid] = 0
+    values[..., 2] = valid
+    return index[in_range], values
+
+def df_to_array(df: pd.DataFrame, keys: list, n_frames: int, out: np.ndarray = None,
+                n_instances: int = 1) -> np.ndarray:
+    # inverse of array_to_df. with out given, n_instances is taken from its shape
+    if out is None:
+        shape = (n_frames, len(keys), 3) if n_instances == 1 else (n_frames, n_instances, len(keys), 3)
+        out = np.zeros(shape, dtype=np.float32)
+    index, values = df_to_rows(df, keys, n_frames, get_n_instances(out))
+    out[index] = values.reshape((len(values),) + out.shape[1:])
+    return out
+
+def convert_data_to_df(data: list, image_names=None) -> pd.DataFrame:
+    keys = None
+    array = []
+    for element in data:
+        if keys is None:
+            keys = list(element.keys())
+        frame = np.zeros((len(keys), 3), dtype=np.float32)
+        for i, value in enumerate(element.values()):
+            if value is not None and len(value) > 0 and not np.isnan(value).any():
+                frame[i] = value[0], value[1], 1
+        array.append(frame)
+    if keys is None:
+        return pd.DataFrame()
+    return array_to_df(np.stack(array), keys, image_names=image_names)
+
 def convert_row_to_dict(row) -> dict:
     N = len(row) // 3
     keys = row.keys().to_list()
-    
+    values = row.to_numpy(dtype=np.float32)[:N * 3].reshape(N, 3)
+    valid = np.isfinite(values[:, :2]).all(axis=1) & (values[:, 2] > 1e-7)
+    values[~valid, :2] = np.nan
+
     data = OrderedDict()
-    for i in range(0, len(row), 3):
-        x = row[i]
-        y = row[i+1]
-        p = row[i+2]
-        if np.isnan(x) or np.isnan(y) or p < 1e-7:
-            x = np.nan
-            y = np.nan
-            p = 0
+    for i in range(N):
         # chop off the _x, _y, or _p at the end
-        key = keys[i][:-2]
+        key = keys[i * 3][:-2]
         # don't do anything with p for now
-        data[key] = np.array([x, y]).astype(np.float32)
+        data[key] = values[i, :2]
     return data
 
 def convert_df_to_data(df: pd.DataFrame, n_frames: int, empty_dict: dict) -> list:
+    keys = list(empty_dict.keys())
+    array = df_to_array(df, keys, n_frames)
+    frames_with_data = set(df.index.to_list())
+
     data = []
-    
-    frames_with_data = df.index.to_list()
     for i in range(n_frames):
         if i in frames_with_data:
-            row = df.loc[i]
-            row = convert_row_to_dict(row)
-            # print(row)
-            data.append(row)
+            coords = np.where(array[i, :, 2:] > 0, array[i, :, :2], np.nan)
+            data.append(OrderedDict(zip(keys, coords)))
         else:
             data.append(empty_dict)
     return data
-    
\ No newline at end of file
+
+class LatencyCounter:
+    # running count, mean, and max of how long something takes, for comparing interaction latency
+    def __init__(self, name: str):
+        self.name = name
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def start(self) -> float:
+        return time.perf_counter()
+
+    def stop(self, start: float):
+        self.add(time.perf_counter() - start)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count > 0 else 0.0
+
+    def __str__(self):
+        return '{}: n={}, mean={:.3f} ms, max={:.3f} ms'.format(self.name, self.count, self.mean * 1000,
+                                                               self.max * 1000)
@@ -19,10 +19,11 @@ setuptools.setup(
     ],
     entry_points={
         'console_scripts':[
-            'pose_annotator = pose_annotator.gui.main:run']
+            'pose_annotator = pose_annotator.cli:main']
     },
     python_requires='>=3.6',
-    install_requires=['matplotlib',
+    install_requires=['h5py',
+                      'matplotlib',
                       'numpy',
                       'omegaconf>=2.0',
                       'opencv-python-headless',
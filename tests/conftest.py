@@ -0,0 +1,27 @@
+import cv2
+import numpy as np
+import pytest
+
+
+def write_video(filename, frames, fps=30):
+    # frames are RGB. MJPG, so every frame is a keyframe and the test doesn't depend on which codecs are installed
+    height, width = frames[0].shape[:2]
+    writer = cv2.VideoWriter(str(filename), cv2.VideoWriter_fourcc(*'MJPG'), fps, (width, height))
+    for frame in frames:
+        writer.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+    writer.release()
+    return str(filename)
+
+
+@pytest.fixture
+def tiny_video(tmp_path):
+    # 5 frames of 64x48: solid red, green and blue, then two gradients, which survive jpg compression
+    frames = []
+    for channel in range(3):
+        frame = np.zeros((48, 64, 3), dtype=np.uint8)
+        frame[..., channel] = 255
+        frames.append(frame)
+    ramp = np.linspace(0, 255, 64).astype(np.uint8)
+    frames.append(np.stack([np.tile(ramp, (48, 1)), np.full((48, 64), 128, np.uint8), np.tile(ramp[::-1], (48, 1))], 2))
+    frames.append(frames[-1][:, ::-1].copy())
+    return write_video(tmp_path / 'tiny.avi', frames)
@@ -0,0 +1,32 @@
+"""Writes the H.264 test videos with B-frames in this directory. Needs PyAV with libx264
+
+60 frames of 64x48, frame i showing a white bar i + 1 pixels wide, with a keyframe every 12 frames and up to 3
+B-frames between references. In closed_gop.mp4 keyframes are IDR frames, so they come in the same place in decode
+order as in display order. open_gop.mp4 has non-IDR keyframes that B-frames shown before them depend on, so each of
+its keyframes after the first is decoded 3 frames before it's shown.
+"""
+import os
+
+import av
+import numpy as np
+
+
+def write_video(filename: str, open_gop: bool, n_frames: int = 60, width: int = 64, height: int = 48):
+    with av.open(filename, 'w') as container:
+        stream = container.add_stream('libx264', rate=30)
+        stream.width, stream.height, stream.pix_fmt = width, height, 'yuv420p'
+        stream.options = {'bf': '3', 'g': '12', 'keyint_min': '12', 'sc_threshold': '0',
+                          'x264-params': 'open-gop={}'.format(int(open_gop))}
+        for i in range(n_frames):
+            frame = np.zeros((height, width, 3), dtype=np.uint8)
+            frame[:, :i + 1] = 255
+            for packet in stream.encode(av.VideoFrame.from_ndarray(frame, format='rgb24')):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+
+
+if __name__ == '__main__':
+    directory = os.path.dirname(os.path.abspath(__file__))
+    write_video(os.path.join(directory, 'closed_gop.mp4'), open_gop=False)
+    write_video(os.path.join(directory, 'open_gop.mp4'), open_gop=True)
@@ -0,0 +1,82 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pose_annotator import utils
+from pose_annotator.export import export, get_image_dir_names, read_keypoints
+from tests.conftest import write_video
+
+
+def test_keys_from_columns_single_instance_by_default():
+    columns = utils.get_columns(['ear_0', 'ear_1'])
+    assert utils.get_keys_from_columns(columns) == (['ear_0', 'ear_1'], 1)
+    assert utils.get_keys_from_columns(columns, infer=True) == (['ear'], 2)
+    assert utils.get_keys_from_columns(columns + ['image_name'], n_instances=2) == (['ear'], 2)
+
+
+def test_keys_from_columns_wrong_layout():
+    with pytest.raises(ValueError):
+        utils.get_keys_from_columns(utils.get_columns(['nose', 'tail']), n_instances=2)
+
+
+def test_image_dir_names():
+    names = get_image_dir_names(['day1/cam0.mp4', 'day2/cam0.mp4', 'cam1.mp4', 'a/day1_cam0.mp4'])
+    assert names['day1/cam0.mp4'] == 'day1_cam0'
+    assert names['day2/cam0.mp4'] == 'day2_cam0'
+    assert names['cam1.mp4'] == 'cam1'
+    assert len(set(names.values())) == 4
+
+
+def test_export_videos_with_the_same_name(tmp_path):
+    keys = ['nose', 'tail']
+    videofiles = []
+    for day, value in [('day1', 50), ('day2', 200)]:
+        os.makedirs(tmp_path / day)
+        frames = [np.full((48, 64, 3), value, dtype=np.uint8) for _ in range(5)]
+        videofiles.append(write_video(tmp_path / day / 'cam0.avi', frames))
+        array = np.zeros((5, 2, 3), dtype=np.float32)
+        array[2] = [[10, 20, 1], [30, 40, 1]]
+        utils.array_to_df(array, keys).to_csv(tmp_path / day / 'cam0_keypoints.csv')
+
+    output_dir = tmp_path / 'out'
+    export(videofiles, output_dir, format='coco', workers=1)
+    with open(output_dir / 'annotations.json') as f:
+        coco = json.load(f)
+    file_names = sorted(image['file_name'] for image in coco['images'])
+    assert file_names == [os.path.join('images', 'day1_cam0', 'img000002.png'),
+                          os.path.join('images', 'day2_cam0', 'img000002.png')]
+    assert coco['annotations'][0]['keypoints'] == [10, 20, 2, 30, 40, 2]
+    assert coco['categories'][0]['keypoints'] == keys
+
+    export(videofiles, output_dir, format='dlc', workers=1)
+    df = pd.read_csv(output_dir / 'CollectedData_pose_annotator.csv', header=[0, 1, 2], index_col=0)
+    assert sorted(df.index) == ['labeled-data/day1_cam0/img000002.png', 'labeled-data/day2_cam0/img000002.png']
+
+
+def test_read_keypoints(tmp_path):
+    keys = ['nose', 'tail']
+    array = np.zeros((6, 2, 3), dtype=np.float32)
+    array[[4, 1]] = [[1, 2, 1], [3, 4, 1]]
+    df = utils.array_to_df(array, keys)
+    # frame 4 again, unlabeled: the last row wins
+    df = pd.concat([df, pd.DataFrame(np.nan, index=[4], columns=df.columns)])
+    df.to_csv(tmp_path / 'keypoints.csv')
+    read_keys, framenums, rows = read_keypoints(tmp_path / 'keypoints.csv', 6)
+    assert read_keys == keys and framenums.tolist() == [1]
+    np.testing.assert_array_equal(rows[0, 0], array[1])
+
+    # no labeled rows at all
+    utils.array_to_df(np.zeros_like(array), keys).to_csv(tmp_path / 'empty.csv')
+    _, framenums, rows = read_keypoints(tmp_path / 'empty.csv', 6)
+    assert len(framenums) == 0 and rows.shape == (0, 1, 2, 3)
+
+
+def test_read_keypoints_of_image_directory(tmp_path):
+    df = pd.DataFrame({'nose_x': [5.0], 'nose_y': [6.0], 'nose_p': [1], 'image_name': ['img10.png']}, index=[1])
+    df.to_csv(tmp_path / 'keypoints.csv')
+    _, framenums, rows = read_keypoints(tmp_path / 'keypoints.csv', 3, image_names=['img1.png', 'img2.png',
+                                                                                    'img10.png'])
+    assert framenums.tolist() == [2]
@@ -0,0 +1,62 @@
+import threading
+import time
+
+import numpy as np
+
+from pose_annotator.frame_cache import FrameCache
+
+
+class CountingReader:
+    # a video whose readers count how often they had to seek, i.e. read anything but the frame after the last one
+    def __init__(self, nframes: int = 200, readers: list = None):
+        self.nframes = nframes
+        self.fnum = 0
+        self.seeks = 0
+        self.readers = readers if readers is not None else []
+        self.readers.append(self)
+        self.thread = None
+
+    def __len__(self):
+        return self.nframes
+
+    def __getitem__(self, framenum: int) -> np.ndarray:
+        # readers aren't thread-safe: each must only ever be used from one thread
+        if self.thread is None:
+            self.thread = threading.current_thread()
+        assert self.thread is threading.current_thread()
+        if framenum != self.fnum:
+            self.seeks += 1
+        self.fnum = framenum + 1
+        time.sleep(0.001)
+        return np.full((4, 4), framenum, dtype=np.uint8)
+
+    def reopen(self):
+        return CountingReader(self.nframes, self.readers)
+
+    def close(self):
+        pass
+
+
+def test_stepping_forward_reads_sequentially():
+    reader = CountingReader()
+    cache = FrameCache(reader, reader.reopen, prefetch=8, workers=2)
+    for framenum in range(100):
+        assert cache[framenum][0, 0] == framenum
+        time.sleep(0.002)
+    cache.close()
+    worker_readers = reader.readers[1:]
+    assert len(worker_readers) > 0
+    # one seek per worker to wherever its first block started, then every block continues where its reader stopped
+    assert sum(r.seeks for r in worker_readers) <= len(worker_readers)
+    assert cache.hits > 90
+
+
+def test_prefetch_backward_and_close():
+    reader = CountingReader()
+    cache = FrameCache(reader, reader.reopen, prefetch=8, workers=2)
+    for framenum in range(150, 100, -1):
+        assert cache[framenum][0, 0] == framenum
+        time.sleep(0.002)
+    cache.close()
+    assert cache.prefetched > 0
+    assert len(cache.frames) == 0
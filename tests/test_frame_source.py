@@ -0,0 +1,33 @@
+import cv2
+import numpy as np
+import pytest
+
+from pose_annotator.frame_source import read_image
+
+
+def test_read_image_applies_exif_orientation(tmp_path):
+    Image = pytest.importorskip('PIL.Image')
+    # left half white, stored landscape with orientation 6: displayed rotated 90 degrees clockwise
+    frame = np.zeros((20, 40, 3), dtype=np.uint8)
+    frame[:, :20] = 255
+    image = Image.fromarray(frame)
+    exif = image.getexif()
+    exif[0x0112] = 6
+    filename = str(tmp_path / 'rotated.jpg')
+    image.save(filename, exif=exif, quality=95)
+
+    rotated = read_image(filename)
+    assert rotated.shape == (40, 20, 3)
+    # the white half is now on top
+    assert rotated[:20].mean() > 200 and rotated[20:].mean() < 50
+
+
+@pytest.mark.parametrize('frame', [
+    np.arange(20 * 40, dtype=np.uint16).reshape(20, 40) * 64,
+    np.arange(20 * 40 * 3, dtype=np.uint16).reshape(20, 40, 3) * 16,
+    np.arange(20 * 40, dtype=np.uint8).reshape(20, 40),
+])
+def test_read_image_keeps_depth_and_channels(tmp_path, frame):
+    filename = str(tmp_path / 'frame.png')
+    cv2.imwrite(filename, frame[..., ::-1] if frame.ndim == 3 else frame)
+    np.testing.assert_array_equal(read_image(filename), frame)
@@ -0,0 +1,63 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pose_annotator.image_sequence import align_to_image_names, legacy_sort, natural_sort, scan_directory
+
+
+@pytest.mark.parametrize('names, expected', [
+    (['img10.png', 'img2.png', 'img1.png'], ['img1.png', 'img2.png', 'img10.png']),
+    (['frame_000010.jpg', 'frame_000002.jpg'], ['frame_000002.jpg', 'frame_000010.jpg']),
+    # no shared prefix and suffix around the numbers: the general natural key
+    (['b2.png', 'a10.png', 'a2.png', 'B1.png'], ['a2.png', 'a10.png', 'B1.png', 'b2.png']),
+    (['cam1_10.png', 'cam1_9.png', 'cam2_1.png'], ['cam1_9.png', 'cam1_10.png', 'cam2_1.png']),
+    ([], []),
+])
+def test_natural_sort(names, expected):
+    assert natural_sort(names) == expected
+
+
+def test_natural_sort_matches_key_sort():
+    rng = np.random.default_rng(0)
+    names = ['img{}.png'.format(i) for i in rng.permutation(1000)]
+    assert natural_sort(names) == ['img{}.png'.format(i) for i in range(1000)]
+
+
+@pytest.fixture
+def directory(tmp_path):
+    for name in ['img1.png', 'img10.png', 'img2.png', 'IMG3.PNG', 'notes.txt']:
+        (tmp_path / name).touch()
+    return tmp_path
+
+
+def test_scan_and_legacy_order(directory):
+    assert scan_directory(directory) == ['img1.png', 'img2.png', 'IMG3.PNG', 'img10.png']
+    # vidio's order: lexicographic, and upper case extensions weren't images
+    assert legacy_sort(directory) == ['img1.png', 'img10.png', 'img2.png']
+
+
+def test_align_by_image_name(directory):
+    names = scan_directory(directory)
+    df = pd.DataFrame({'nose_x': [1.0, 2.0], 'image_name': ['img10.png', 'IMG3.PNG']}, index=[1, 2])
+    aligned = align_to_image_names(df, names)
+    assert 'image_name' not in aligned
+    assert aligned.index.tolist() == [3, 2]
+    assert aligned['nose_x'].tolist() == [1.0, 2.0]
+
+
+def test_align_legacy_csv_without_names(directory):
+    # saved when the directory was img1, img10, img2: row 1 was labeled on img10
+    df = pd.DataFrame({'nose_x': [1.0, 2.0, 3.0]}, index=[0, 1, 2])
+    aligned = align_to_image_names(df, scan_directory(directory), legacy_sort(directory))
+    assert dict(zip(aligned.index, aligned['nose_x'])) == {0: 1.0, 3: 2.0, 1: 3.0}
+
+
+def test_align_drops_missing_images(directory):
+    df = pd.DataFrame({'nose_x': [1.0, 2.0], 'image_name': ['img1.png', 'deleted.png']}, index=[0, 1])
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        aligned = align_to_image_names(df, scan_directory(directory))
+    assert aligned.index.tolist() == [0]
+    assert any('deleted.png' in str(warning.message) for warning in caught)
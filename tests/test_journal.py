@@ -0,0 +1,91 @@
+import json
+
+import numpy as np
+import pytest
+
+from pose_annotator.journal import EditJournal, get_journal_filename
+from pose_annotator.store import make_store
+
+keys = ['nose', 'ear', 'tail']
+
+
+def test_journal_filename():
+    assert get_journal_filename('/data/video_keypoints.csv') == '/data/video_keypoints.journal'
+
+
+@pytest.mark.parametrize('kind', ['dense', 'sparse'])
+@pytest.mark.parametrize('n_instances', [1, 2])
+def test_replay_reproduces_edits(tmp_path, kind, n_instances):
+    rng = np.random.default_rng(n_instances)
+    store = make_store(kind, keys, 20, n_instances)
+    journal = EditJournal(str(tmp_path / 'video_keypoints.journal'), keys, n_instances)
+    for framenum in [3, 7, 3, 15, 7]:
+        frame = np.zeros((n_instances, len(keys), 3), dtype=np.float32)
+        frame[..., :2] = rng.uniform(0, 100, (n_instances, len(keys), 2)).round(2)
+        frame[..., 2] = rng.random((n_instances, len(keys))) < 0.7
+        frame[frame[..., 2] == 0] = 0
+        store.set_frame(framenum, frame)
+        journal.append(framenum, store.get_frame(framenum))
+    # an edit that unlabels a frame again
+    store.clear_frame(15)
+    journal.append(15, store.get_frame(15))
+    journal.close()
+
+    replayed = make_store(kind, keys, 20, n_instances)
+    assert journal.replay(replayed) == 6
+    np.testing.assert_array_equal(replayed.labeled_frames(), store.labeled_frames())
+    for framenum in range(20):
+        np.testing.assert_allclose(replayed.get_frame(framenum), store.get_frame(framenum), atol=1e-4)
+
+    journal.clear()
+    assert journal.replay(make_store(kind, keys, 20, n_instances)) == 0
+
+
+def write_lines(filename, lines):
+    with open(filename, 'w') as f:
+        for line in lines:
+            f.write(line if isinstance(line, str) else json.dumps(line) + '\n')
+
+
+def test_replay_single_instance_journal(tmp_path):
+    # written before instances existed: no instances in the header, and (n_keypoints, 3) frames
+    filename = str(tmp_path / 'old.journal')
+    write_lines(filename, [{'keys': keys},
+                           {'frame': 2, 'xyp': [[1, 2, 1], [3, 4, 1], [0, 0, 0]]}])
+    store = make_store('sparse', keys, 10, n_instances=2)
+    assert EditJournal(filename, keys, 2).replay(store) == 1
+    # into the first instance
+    np.testing.assert_array_equal(store.get_frame(2)[0], [[1, 2, 1], [3, 4, 1], [0, 0, 0]])
+    np.testing.assert_array_equal(store.get_frame(2)[1], np.zeros((3, 3)))
+
+
+def test_replay_maps_keypoints_by_name(tmp_path):
+    # the config's keypoints changed since the journal was written: reordered, one removed and one added
+    filename = str(tmp_path / 'renamed.journal')
+    write_lines(filename, [{'keys': ['tail', 'paw', 'nose'], 'instances': 1},
+                           {'frame': 0, 'xyp': [[[5, 6, 1], [7, 8, 1], [1, 2, 1]]]}])
+    store = make_store('dense', keys, 5)
+    assert EditJournal(filename, keys).replay(store) == 1
+    np.testing.assert_array_equal(store.get_frame(0)[0], [[1, 2, 1], [0, 0, 0], [5, 6, 1]])
+
+
+def test_replay_stops_at_corrupt_line(tmp_path):
+    filename = str(tmp_path / 'crashed.journal')
+    write_lines(filename, [{'keys': keys, 'instances': 1},
+                           {'frame': 1, 'xyp': [[[1, 2, 1], [0, 0, 0], [0, 0, 0]]]},
+                           {'frame': 99, 'xyp': [[[1, 2, 1], [0, 0, 0], [0, 0, 0]]]},
+                           '{"frame": 3, "xyp": [[[1, 2'])
+    store = make_store('sparse', keys, 5)
+    with pytest.warns(UserWarning) as record:
+        assert EditJournal(filename, keys).replay(store) == 1
+    messages = [str(warning.message) for warning in record]
+    assert any('out of range' in message for message in messages)
+    assert any('corrupt line 3' in message for message in messages)
+    np.testing.assert_array_equal(store.labeled_frames(), [1])
+
+
+def test_replay_without_header(tmp_path):
+    filename = str(tmp_path / 'headless.journal')
+    write_lines(filename, [{'frame': 1, 'xyp': [[1, 2, 1], [0, 0, 0], [0, 0, 0]]}])
+    with pytest.raises(ValueError):
+        EditJournal(filename, keys).replay(make_store('dense', keys, 5))
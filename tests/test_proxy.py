@@ -0,0 +1,58 @@
+import h5py
+import numpy as np
+import pytest
+
+from pose_annotator.backends import open_frame_source
+from pose_annotator.proxy import find_proxy, make_proxy
+from tests.conftest import write_video
+
+
+def test_make_proxy_last_chunk_of_one_frame(tiny_video):
+    # 5 frames in chunks of 4: the last chunk has a single frame
+    proxyfile = make_proxy(tiny_video, scale=0.5, chunk_size=4, workers=1)
+    assert find_proxy(tiny_video) == proxyfile
+    with h5py.File(proxyfile, 'r') as f:
+        assert float(f.attrs['scale']) == 0.5
+    with open_frame_source(proxyfile) as reader:
+        assert len(reader) == 5
+        assert reader[4].shape == (24, 32, 3)
+
+
+def test_make_proxy_equal_length_frames(tmp_path):
+    # identical frames encode to identical, equal-length jpgs
+    videofile = write_video(tmp_path / 'black.avi', [np.zeros((48, 64, 3), dtype=np.uint8)] * 6)
+    proxyfile = make_proxy(videofile, scale=1, chunk_size=3, workers=1)
+    with open_frame_source(proxyfile) as reader:
+        assert len(reader) == 6
+        assert reader[5].max() < 5
+
+
+def test_proxy_colors_match_original(tiny_video):
+    proxyfile = make_proxy(tiny_video, scale=1, quality=100, workers=1)
+    with open_frame_source(tiny_video) as original, open_frame_source(proxyfile) as proxy:
+        for framenum in range(len(original)):
+            difference = np.abs(original[framenum].astype(int) - proxy[framenum].astype(int))
+            assert difference.mean() < 4
+        # the first frame is pure red
+        assert proxy[0][..., 0].min() > 240 and proxy[0][..., 2].max() < 15
+
+
+def test_grayscale_proxy(tmp_path):
+    frames = np.tile(np.linspace(0, 255, 64).astype(np.uint8), (4, 48, 1))
+    frames[1] = frames[1, :, ::-1]
+    videofile = str(tmp_path / 'gray.npy')
+    np.save(videofile, frames)
+    proxyfile = make_proxy(videofile, scale=1, quality=100, chunk_size=2, workers=1)
+    with open_frame_source(proxyfile) as proxy:
+        assert len(proxy) == 4
+        for framenum in range(4):
+            frame = proxy[framenum].astype(int)
+            # read back as equal color channels
+            assert np.abs(frame - frames[framenum][..., None]).mean() < 4
+
+
+def test_16_bit_proxy_is_refused(tmp_path):
+    videofile = str(tmp_path / 'deep.npy')
+    np.save(videofile, np.zeros((3, 48, 64), dtype=np.uint16))
+    with pytest.raises(ValueError, match='8-bit'):
+        make_proxy(videofile, workers=1)
@@ -0,0 +1,100 @@
+import os
+import shutil
+
+import cv2
+import numpy as np
+import pytest
+
+from pose_annotator import seek_index
+from pose_annotator.frame_source import OpenCVSource
+from pose_annotator.seek_index import SeekIndex
+
+# H.264 videos with B-frames, written by make_gop_videos.py
+data_dir = os.path.join(os.path.dirname(__file__), 'data')
+
+
+@pytest.fixture
+def gop_video(tmp_path):
+    # mpeg-4 part 2, which OpenCV writes with a keyframe every 12 frames and no B-frames
+    filename = str(tmp_path / 'gop.mp4')
+    writer = cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*'mp4v'), 30, (64, 48))
+    if not writer.isOpened():
+        pytest.skip('no mpeg-4 encoder')
+    for i in range(60):
+        frame = np.zeros((48, 64, 3), dtype=np.uint8)
+        # each frame's number as the width of a bright bar
+        frame[:, :i + 1] = 255
+        writer.write(frame)
+    writer.release()
+    return filename
+
+
+@pytest.mark.parametrize('use_pyav', [True, False])
+def test_build_and_load(gop_video, monkeypatch, use_pyav):
+    if use_pyav:
+        pytest.importorskip('av')
+    else:
+        monkeypatch.setattr(seek_index, 'av', None)
+    index = SeekIndex(gop_video)
+    index.build()
+    assert not index.reordered
+    np.testing.assert_array_equal(index.keyframes, np.arange(0, 60, 12))
+    loaded = SeekIndex(gop_video)
+    assert loaded.load()
+    np.testing.assert_array_equal(loaded.keyframes, index.keyframes)
+    assert loaded.nearest_keyframe(30) == 24
+
+
+def test_seeking_with_index_matches_sequential(gop_video):
+    index = SeekIndex(gop_video)
+    index.build()
+    with OpenCVSource(gop_video) as reader:
+        sequential = [reader[i] for i in range(60)]
+    with OpenCVSource(gop_video, index) as reader:
+        for framenum in [50, 13, 12, 59, 0, 25, 24, 26, 11]:
+            np.testing.assert_array_equal(reader[framenum], sequential[framenum])
+
+
+def test_lagging_keyframe_flags_mean_reordered(gop_video):
+    index = SeekIndex(gop_video)
+    is_key = [i % 12 == 0 for i in range(60)]
+    assert index.decodes_in_order(is_key)
+    # what a decoder that reads one packet ahead of the frame it returns reports
+    assert not index.decodes_in_order(is_key[1:] + [False])
+
+
+def bar_width(frame: np.ndarray) -> int:
+    # frames of the gop videos show their frame number + 1 as the width of a white bar
+    return int((frame[24].mean(axis=-1) > 128).sum())
+
+
+@pytest.mark.parametrize('name', ['closed_gop.mp4', 'open_gop.mp4'])
+def test_b_frames_numbered_in_display_order(tmp_path, name):
+    pytest.importorskip('av')
+    videofile = str(tmp_path / name)
+    shutil.copy(os.path.join(data_dir, name), videofile)
+    index = SeekIndex(videofile)
+    index.build()
+    # in open_gop.mp4, packets 9, 21, 33 and 45 are the keyframes shown as frames 12, 24, 36 and 48
+    assert not index.reordered
+    np.testing.assert_array_equal(index.keyframes, np.arange(0, 60, 12))
+    with OpenCVSource(videofile, index) as reader:
+        for framenum in [50, 13, 12, 59, 0, 25, 24, 23, 11, 36]:
+            assert bar_width(reader[framenum]) == framenum + 1
+
+
+def test_reordered_index_is_not_used_without_pyav(tmp_path, monkeypatch):
+    monkeypatch.setattr(seek_index, 'av', None)
+    videofile = str(tmp_path / 'open_gop.mp4')
+    shutil.copy(os.path.join(data_dir, 'open_gop.mp4'), videofile)
+    index = SeekIndex(videofile)
+    index.build()
+    assert index.reordered and index.keyframes is None
+    loaded = SeekIndex(videofile)
+    # the sidecar records that the stream is reordered, so it isn't rebuilt on every open
+    assert loaded.load()
+    assert loaded.reordered and loaded.keyframes is None
+    assert loaded.nearest_keyframe(30) is None
+    with OpenCVSource(videofile, loaded) as reader:
+        for framenum in [50, 13, 12, 0]:
+            assert bar_width(reader[framenum]) == framenum + 1
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from pose_annotator.spatial import GridIndex, find_nearest
+
+
+def random_points(rng, n):
+    # some off the image (negative coordinates) and some unlabeled (nan)
+    coords = rng.uniform(-50, 500, (n, 2))
+    coords[rng.random(n) < 0.1] = np.nan
+    return coords
+
+
+def check_queries(rng, index, coords, radii, cell_size):
+    for x, y in rng.uniform(-60, 510, (200, 2)):
+        candidates = index.query(x, y)
+        near = np.flatnonzero(np.hypot(coords[:, 0] - x, coords[:, 1] - y) <= cell_size)
+        assert set(near) <= set(candidates)
+        assert find_nearest(coords, radii, x, y, candidates) == find_nearest(coords, radii, x, y)
+
+
+@pytest.mark.parametrize('n', [0, 1, 300])
+def test_grid_index_matches_brute_force(n):
+    rng = np.random.default_rng(n)
+    coords = random_points(rng, n)
+    radii = rng.uniform(5, 20, n)
+    index = GridIndex(coords, cell_size=20)
+    check_queries(rng, index, coords, radii, 20)
+
+
+def test_grid_index_update():
+    rng = np.random.default_rng(0)
+    coords = random_points(rng, 300)
+    radii = np.full(300, 10.0)
+    index = GridIndex(coords, cell_size=10)
+    for _ in range(5):
+        # move a few points, unlabel some, and label some that weren't
+        moved = rng.choice(300, 10, replace=False)
+        coords[moved] = random_points(rng, 10)
+        index.update(moved, coords)
+        assert len(index.ids) == np.isfinite(coords).all(axis=1).sum()
+        assert np.all(np.diff(index.ids) >= 0)
+        check_queries(rng, index, coords, radii, 10)
@@ -0,0 +1,186 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pose_annotator import utils
+from pose_annotator.store import EMPTY, LABELED, PARTIAL, FrameStatus, make_store
+
+keys = ['nose', 'ear', 'tail']
+
+
+def random_frames(rng, n_frames, n_instances, fraction=0.5):
+    # (n_frames, n_instances, n_keypoints, 3), with a random subset of keypoints labeled
+    frames = rng.uniform(0, 100, (n_frames, n_instances, len(keys), 3)).astype(np.float32)
+    labeled = rng.random((n_frames, n_instances, len(keys))) < fraction
+    frames[..., 2] = labeled
+    frames[~labeled] = 0
+    return frames
+
+
+def assert_same(sparse, dense):
+    np.testing.assert_array_equal(sparse.labeled_frames(), dense.labeled_frames())
+    np.testing.assert_array_equal(sparse.status.status, dense.status.status)
+    np.testing.assert_array_equal(sparse.status.counts, dense.status.counts)
+    for framenum in range(dense.n_frames):
+        np.testing.assert_array_equal(sparse.get_frame(framenum), dense.get_frame(framenum))
+    for framenum in range(-1, dense.n_frames + 1):
+        assert sparse.next_labeled(framenum) == dense.next_labeled(framenum)
+        assert sparse.previous_labeled(framenum) == dense.previous_labeled(framenum)
+    for start, stop in [(0, None), (5, 17), (30, 31)]:
+        for a, b in zip(sparse.get_labeled_rows(start, stop), dense.get_labeled_rows(start, stop)):
+            np.testing.assert_array_equal(a, b)
+    pd.testing.assert_frame_equal(sparse.to_df(), dense.to_df())
+    np.testing.assert_array_equal(sparse.array, dense.array)
+    assert (sparse.n_frames, sparse.n_instances, sparse.n_keypoints) == dense.array.shape[:3]
+    # rows stay packed: every labeled frame has its own row among the first n_labeled
+    assert sorted(sparse.slots.tolist()) == list(range(sparse.n_labeled))
+
+
+@pytest.mark.parametrize('n_instances', [1, 2])
+def test_sparse_matches_dense(n_instances):
+    rng = np.random.default_rng(n_instances)
+    n_frames = 40
+    sparse = make_store('sparse', keys, n_frames, n_instances)
+    dense = make_store('dense', keys, n_frames, n_instances)
+    for step in range(400):
+        framenum = int(rng.integers(n_frames))
+        action = rng.random()
+        if action < 0.5:
+            # grows past the initial 16 rows, and unlabels frames, which moves the last row into the gap
+            coords = random_frames(rng, 1, n_instances, fraction=rng.choice([0, 0.5, 1]))[0]
+            coords[..., :2][coords[..., 2] == 0] = np.nan
+            sparse.set_frame(framenum, coords[..., :2])
+            dense.set_frame(framenum, coords[..., :2])
+        elif action < 0.6:
+            sparse.clear_frame(framenum)
+            dense.clear_frame(framenum)
+        elif action < 0.65:
+            # merges with what's there. frames can be in the csv twice, and the last row wins
+            frames = random_frames(rng, 8, n_instances, fraction=0.3)
+            index = rng.integers(0, n_frames, 8)
+            df = utils.array_to_df(frames, keys, index=index)
+            if rng.random() < 0.5:
+                unlabeled = pd.DataFrame(np.nan, index=index[:1], columns=df.columns)
+                df = pd.concat([df, unlabeled])
+            sparse.update_from_df(df)
+            dense.update_from_df(df)
+        if step % 20 == 0:
+            assert_same(sparse, dense)
+    assert_same(sparse, dense)
+
+
+def test_sparse_update_from_df_without_labels():
+    # a csv whose rows are all unlabeled
+    df = utils.array_to_df(np.zeros((4, 3, 3), dtype=np.float32), keys)
+    df.loc[2] = np.nan
+    store = make_store('sparse', keys, 4)
+    store.update_from_df(df)
+    assert len(store.labeled_frames()) == 0
+
+
+def test_update_from_df_last_row_wins():
+    frame = np.ones((1, len(keys), 3), dtype=np.float32)
+    df = pd.concat([utils.array_to_df(frame, keys, index=[3]), utils.array_to_df(2 * frame, keys, index=[3])])
+    # the second row for frame 3 unlabels it
+    df.iloc[1] = np.nan
+    for kind in ['dense', 'sparse']:
+        store = make_store(kind, keys, 5)
+        store.set_frame(3, np.full((len(keys), 2), 7.0))
+        store.update_from_df(df)
+        assert not store.is_labeled(3)
+        assert store.status[3] == EMPTY
+
+
+def test_status():
+    store = make_store('sparse', keys, 10, 2)
+    coords = np.full((2, len(keys), 2), np.nan)
+    coords[0] = 1
+    store.set_frame(1, coords)
+    coords[1, 0] = 1
+    store.set_frame(2, coords)
+    assert [store.status[i] for i in range(3)] == [EMPTY, LABELED, PARTIAL]
+    assert store.next_with_status(0, PARTIAL) == 2
+    assert store.previous_with_status(9, LABELED) == 1
+
+
+@pytest.mark.parametrize('kind', ['dense', 'sparse'])
+def test_more_instances_than_configured(kind):
+    df = utils.array_to_df(random_frames(np.random.default_rng(0), 20, 2), keys)
+    store = make_store(kind, keys, 20, 1)
+    with pytest.raises(ValueError, match='2 instances'):
+        store.update_from_df(df)
+    # non-strict reads what fits, which is nothing: a 2-instance csv's columns are <key>_<instance>_x
+    store.update_from_df(df, strict=False)
+    assert len(store.labeled_frames()) == 0
+
+    store = make_store(kind, keys, 20, 2)
+    with pytest.raises(ValueError, match='3 instances'):
+        store.update_from_df(utils.array_to_df(random_frames(np.random.default_rng(0), 20, 3), keys))
+
+
+@pytest.mark.parametrize('kind', ['dense', 'sparse'])
+def test_keypoints_not_configured(kind):
+    df = utils.array_to_df(random_frames(np.random.default_rng(0), 20, 1), keys)
+    store = make_store(kind, keys[:2], 20)
+    with pytest.raises(ValueError, match='tail_x'):
+        store.update_from_df(df)
+    # fewer keypoints in the csv than configured is fine: the others are unlabeled
+    store = make_store(kind, keys + ['paw'], 20)
+    store.update_from_df(df)
+    assert not store.get_frame(store.labeled_frames()[0])[:, 3, 2].any()
+
+
+@pytest.mark.parametrize('kind', ['dense', 'sparse'])
+def test_single_instance_csv_into_first_instance(kind):
+    frames = random_frames(np.random.default_rng(1), 20, 1)
+    df = utils.array_to_df(frames, keys)
+    store = make_store(kind, keys, 20, 2)
+    store.update_from_df(df)
+    for framenum in range(20):
+        np.testing.assert_array_equal(store.get_frame(framenum)[0], frames[framenum, 0])
+        assert not store.get_frame(framenum)[1, :, 2].any()
+
+
+def brute_next(status, framenum, statuses):
+    hits = [i for i in range(max(framenum + 1, 0), len(status)) if status[i] in statuses]
+    return hits[0] if hits else None
+
+
+def brute_previous(status, framenum, statuses):
+    hits = [i for i in range(min(framenum, len(status))) if status[i] in statuses]
+    return hits[-1] if hits else None
+
+
+@pytest.mark.parametrize('n_frames', [1, 7, 8, 50])
+def test_frame_status_matches_brute_force(n_frames):
+    rng = np.random.default_rng(n_frames)
+    # blocks of 8 frames, so most searches cross a block boundary, or skip over whole blocks
+    status = FrameStatus(n_frames, block_size=8)
+    expected = np.zeros(n_frames, dtype=np.uint8)
+    # mostly empty, with a few labeled runs, as when labeling a long video
+    for _ in range(3):
+        framenums = rng.integers(0, n_frames, rng.integers(1, 4))
+        statuses = rng.choice([EMPTY, PARTIAL, LABELED], len(framenums))
+        status.set(framenums, statuses)
+        for framenum, value in zip(framenums, statuses):
+            expected[framenum] = value
+
+        np.testing.assert_array_equal(status.status, expected)
+        for value in [EMPTY, PARTIAL, LABELED]:
+            assert status.count(value) == (expected == value).sum()
+        for statuses in [EMPTY, PARTIAL, LABELED, (PARTIAL, LABELED)]:
+            values = np.atleast_1d(statuses).tolist()
+            for framenum in range(-2, n_frames + 2):
+                assert status.next(framenum, statuses) == brute_next(expected, framenum, values)
+                assert status.previous(framenum, statuses) == brute_previous(expected, framenum, values)
+
+
+def test_frame_status_set_twice():
+    status = FrameStatus(20, block_size=8)
+    # the last status given for a frame wins, and the block counts stay consistent
+    status.set([3, 3, 12], [LABELED, PARTIAL, LABELED])
+    assert status[3] == PARTIAL
+    status.set(3, EMPTY)
+    np.testing.assert_array_equal(status.counts.sum(axis=1), [8, 8, 4])
+    assert status.count(LABELED) == 1 and status.count(PARTIAL) == 0
+    assert status.next(0, LABELED) == 12 and status.previous(12, LABELED) is None
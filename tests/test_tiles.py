@@ -0,0 +1,40 @@
+import cv2
+import numpy as np
+
+from pose_annotator.tiles import TilePyramid, load_image
+
+
+def write_image(filename, height=300, width=200):
+    ramp = np.linspace(0, 255, width).astype(np.uint8)
+    image = np.stack([np.tile(ramp, (height, 1)), np.full((height, width), 128, np.uint8),
+                      np.tile(ramp[::-1], (height, 1))], 2)
+    cv2.imwrite(str(filename), cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+    return str(filename), image
+
+
+def test_small_image_is_not_tiled(tmp_path):
+    imagefile, image = write_image(tmp_path / 'small.png')
+    loaded = load_image(imagefile, 1, cache_dir=tmp_path / 'tiles')
+    np.testing.assert_array_equal(loaded, image)
+
+
+def test_load_image_builds_and_reuses_pyramid(tmp_path):
+    imagefile, image = write_image(tmp_path / 'large.png')
+    reported = []
+    pyramid = load_image(imagefile, 0.01, cache_dir=tmp_path / 'tiles', tile_size=64,
+                         progress=lambda n_done, n_total: reported.append((n_done, n_total)))
+    assert isinstance(pyramid, TilePyramid)
+    # one report per row of tiles, ending at the image's height
+    assert reported == [(min(y + 64, 300), 300) for y in range(0, 300, 64)]
+    np.testing.assert_array_equal(pyramid.read(0), image)
+    assert pyramid.n_levels == 4
+    assert pyramid.get_tile(3, 0, 0).shape == (38, 25, 3)
+    pyramid.close()
+
+    # the cached pyramid is opened without building it again
+    reported.clear()
+    pyramid = load_image(imagefile, 0.01, cache_dir=tmp_path / 'tiles', tile_size=64,
+                         progress=lambda n_done, n_total: reported.append((n_done, n_total)))
+    assert reported == []
+    np.testing.assert_array_equal(pyramid.read(0), image)
+    pyramid.close()
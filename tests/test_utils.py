@@ -0,0 +1,79 @@
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pose_annotator import utils
+
+keys = ['nose', 'ear', 'tail']
+
+
+def random_array(n_frames, n_instances=1, fraction=0.3, seed=0):
+    # (n_frames, [n_instances,] n_keypoints, 3) x, y, p with a random subset of keypoints labeled
+    rng = np.random.default_rng(seed)
+    array = rng.uniform(0, 1000, (n_frames, n_instances, len(keys), 3)).astype(np.float32)
+    labeled = rng.random(array.shape[:3]) < fraction
+    array[..., 2] = labeled
+    array[~labeled] = 0
+    return array[:, 0] if n_instances == 1 else array
+
+
+@pytest.mark.parametrize('n_instances', [1, 3])
+def test_csv_round_trip(tmp_path, n_instances):
+    array = random_array(50, n_instances)
+    df = utils.array_to_df(array, keys)
+    labeled = np.flatnonzero(array[..., 2].reshape(50, -1).any(axis=1))
+    assert df.index.tolist() == labeled.tolist()
+    assert list(df.columns) == utils.get_columns(keys, n_instances)
+
+    utils.atomic_to_csv(df, str(tmp_path / 'keypoints.csv'))
+    loaded = pd.read_csv(tmp_path / 'keypoints.csv', index_col=0)
+    out = utils.df_to_array(loaded, keys, 50, n_instances=n_instances)
+    # unlabeled keypoints come back as zeros; labeled ones to float32 precision
+    np.testing.assert_allclose(out, array, rtol=1e-6)
+
+
+def test_csv_round_trip_subset_of_frames():
+    array = random_array(10)
+    index = np.array([3, 7, 100, 250, 999, 1000, 1001, 5000, 6000, 9999])
+    df = utils.array_to_df(array, keys, index=index)
+    framenums, rows = utils.df_to_rows(df, keys, 10000)
+    labeled = array[..., 2].any(axis=1)
+    np.testing.assert_array_equal(framenums, index[labeled])
+    np.testing.assert_array_equal(rows[:, 0], array[labeled])
+
+
+def test_csv_without_labels():
+    df = utils.array_to_df(np.zeros((5, len(keys), 3), dtype=np.float32), keys)
+    assert len(df) == 0 and list(df.columns) == utils.get_columns(keys)
+    np.testing.assert_array_equal(utils.df_to_array(df, keys, 5), 0)
+
+
+def test_df_to_rows_drops_out_of_range_and_invalid():
+    df = pd.DataFrame({'nose_x': [1.0, np.nan, 3.0, 4.0], 'nose_y': [1.0, 2.0, 3.0, 4.0],
+                       'nose_p': [1, 1, 0, 1], 'image_name': ['a', 'b', 'c', 'd']}, index=[0, 1, 2, 10])
+    with pytest.warns(UserWarning, match='outside'):
+        framenums, rows = utils.df_to_rows(df, ['nose', 'tail'], 5)
+    assert framenums.tolist() == [0, 1, 2]
+    # NaN coordinates and p == 0 are unlabeled, and so is a keypoint that isn't in the csv
+    assert rows[:, 0, :, 2].tolist() == [[1, 0], [0, 0], [0, 0]]
+
+
+def test_dict_codec_matches_array_codec():
+    # the list-of-dicts api the GUI used to hold data in
+    array = random_array(20)
+    data = []
+    for frame in array:
+        data.append(OrderedDict((key, np.array([x, y]) if p else []) for key, (x, y, p) in zip(keys, frame)))
+    df = utils.convert_data_to_df(data)
+    pd.testing.assert_frame_equal(df, utils.array_to_df(array, keys))
+
+    empty = OrderedDict((key, []) for key in keys)
+    converted = utils.convert_df_to_data(df, 20, empty)
+    for frame, element in zip(array, converted):
+        for (x, y, p), value in zip(frame, element.values()):
+            if p:
+                np.testing.assert_allclose(value, [x, y])
+            else:
+                assert len(value) == 0 or np.isnan(value).all()